@@ -1,198 +1,526 @@
 import argparse
+import bisect
+import itertools
 import math
+import sys
 
-from .utils import wrap_sort, get_aggregate_prefix, get_warning_prefix, get_error_prefix
+from array import array
+from typing import Any, Callable, Iterator
 
-def _compute_sum_prod_count(sum_or_count_or_prod : str, aggregate_lines: 'list[tuple[str,str]]', filename : str | None = None) -> 'int | float':
-    if sum_or_count_or_prod == "prod":
-        result : float = 1
+from . import vectorized
+from .external import RUN_BLOCK, ExternalSorter
+from .sketches import DistinctSketch, QuantileSketch
+from .utils import parse_number, get_aggregate_prefix, get_warning_prefix, get_error_prefix
+
+
+def count_file(files : 'list[tuple[str,int]]', filename : str, count : int) -> None:
+    """
+    Add count values of a file to a list of (file, number of values)
+    pairs, merged with the last pair if it has the same file, so the
+    list grows with the number of files and not of values.
+    """
+    if files and files[-1][0] == filename:
+        files[-1] = (filename, files[-1][1] + count)
     else:
-        result : float = 0
-    
-    for line in aggregate_lines:
-        if filename is not None:
-            if line[0] == filename:
-                if sum_or_count_or_prod in ["prod", "sum"]:
-                    val = float(line[1])
+        files.append((filename, count))
+
+
+class Statistics:
+    """
+    State of the requested aggregation functions over the values of a
+    group (a file with -ks, all of them otherwise), updated in a single
+    pass while the files are processed: each value (only the ones that are
+    not blank) is parsed once, and only the state needed by the requested
+    functions is kept, so the values are stored only for median, the sorts,
+    concat, and unique (the values to sort are written to temporary files
+    past args.sort_memory of them).
+    If NumPy is available, the numbers are buffered in blocks of
+    VECTOR_BLOCK, and each block is reduced by the kernels in vectorized.
+    needs contains the parts of the state to keep (see AGGREGATES), and
+    args the options of the approximate functions.
+    """
+    def __init__(self, needs : 'frozenset[str]', args : argparse.Namespace) -> None:
+        self.count : int = 0
+        self.track_sum : bool = "sum" in needs
+        self.track_product : bool = "product" in needs
+        self.track_moments : bool = "moments" in needs
+        self.track_values : bool = "values" in needs
+        self.track_min : bool = "min" in needs
+        self.track_max : bool = "max" in needs
+        self.track_texts : bool = "texts" in needs
+        self.track_sorted : bool = "sorted" in needs
+        self.track_unique : bool = "unique" in needs
+        self.track_words : bool = "words" in needs
+        self.track_quantiles : bool = "quantiles" in needs
+        self.track_distinct : bool = "distinct" in needs
+        self.parse : bool = self.track_sum or self.track_product or self.track_moments or self.track_values or self.track_min or self.track_max or self.track_quantiles
+        # error parsing a value as a number, raised by the numeric
+        # functions (product has its own, since it stops parsing at 0)
+        self.numeric_error : 'Exception|None' = None
+        self.product_error : 'Exception|None' = None
+        self.total : float = 0
+        self.product : float = 1
+        # running mean and sum of squared deviations (Welford's algorithm)
+        # of the numbers added so far
+        self.numbers : int = 0
+        self.running_mean : float = 0.0
+        self.m2 : float = 0.0
+        # numbers not yet reduced, and where the files of their values
+        # start in the block (for min and max, block_file is the last one)
+        reduce : bool = self.track_sum or self.track_product or self.track_moments or self.track_values or self.track_min or self.track_max
+        self.block : 'array[float]|None' = array('d') if reduce and vectorized.HAS_NUMPY else None
+        self.block_starts : 'list[int]' = []
+        self.block_files : 'list[str]' = []
+        self.block_file : 'str|None' = None
+        self.values : 'ExternalSorter|None' = ExternalSorter(args.sort_memory, numeric=True) if self.track_values else None
+        self.quantile_levels : 'list[float]' = args.quantiles
+        self.quantiles : 'QuantileSketch|None' = QuantileSketch(args.sketch_size, args.exact_size) if self.track_quantiles else None
+        self.min : 'float|None' = None
+        self.max : 'float|None' = None
+        # files where the min and max are printed, as (file, number of
+        # values) pairs (see count_file), only for -H without -ks
+        self.track_files : bool = args.with_filename and not args.keep_separated
+        self.min_files : 'list[tuple[str,int]]' = []
+        self.max_files : 'list[tuple[str,int]]' = []
+        self.texts : 'list[str]' = []
+        # the values to sort, and the same values as numbers until one is
+        # not a number (then they are sorted as strings)
+        self.sorted_texts : 'ExternalSorter|None' = ExternalSorter(args.sort_memory) if self.track_sorted else None
+        self.sorted_numbers : 'ExternalSorter|None' = ExternalSorter(args.sort_memory, numeric=True) if self.track_sorted else None
+        self.unique : 'set[str]' = set()
+        self.distinct : 'DistinctSketch|None' = DistinctSketch(args.hll_precision, args.exact_size) if self.track_distinct else None
+        self.words : int = 0
+        # first and last value in the order of the lines in the files,
+        # also if they are processed backwards (args.reverse)
+        self.reverse : bool = args.reverse
+        self.first : 'str|None' = None
+        self.last : 'str|None' = None
+
+    def add(self, filename : str, value : str) -> None:
+        self.count += 1
+        if self.reverse:
+            if self.last is None:
+                self.last = value
+            self.first = value
+        else:
+            if self.first is None:
+                self.first = value
+            self.last = value
+        if self.track_texts:
+            self.texts.append(value)
+        if self.track_sorted:
+            self.sorted_texts.add(value) # type: ignore
+            if self.sorted_numbers is not None:
+                number = parse_number(value)
+                if number is None:
+                    self.sorted_numbers.close()
+                    self.sorted_numbers = None
                 else:
-                    val = 1 # for count
+                    self.sorted_numbers.add(number)
+        if self.track_unique:
+            self.unique.add(value.rstrip())
+        if self.track_words:
+            self.words += len(value.split())
+        if self.track_distinct:
+            self.distinct.add(value.rstrip()) # type: ignore
+        if not self.parse or self.numeric_error is not None:
+            return
+        try:
+            v = float(value)
+        except Exception as e:
+            self.flush()
+            self.numeric_error = e
+            if self.product != 0:
+                self.product_error = e
+            return
+        if self.track_quantiles:
+            self.quantiles.add(v) # type: ignore
+        block = self.block
+        if block is not None:
+            if filename != self.block_file:
+                self.block_starts.append(len(block))
+                self.block_files.append(filename)
+                self.block_file = filename
+            block.append(v)
+            if len(block) >= vectorized.VECTOR_BLOCK:
+                self.flush()
+        else:
+            self.add_number(filename, v)
+
+    def add_number(self, filename : str, v : float) -> None:
+        """
+        Add a number to the state (without NumPy).
+        """
+        self.numbers += 1
+        if self.track_sum:
+            self.total += v
+        if self.track_product and self.product != 0:
+            # once 0, the following values do not change it
+            self.product *= v
+        if self.track_moments:
+            delta = v - self.running_mean
+            self.running_mean += delta / self.numbers
+            self.m2 += delta * (v - self.running_mean)
+        if self.track_values:
+            self.values.add(v) # type: ignore
+        if self.track_min:
+            if self.min is None or v < self.min:
+                self.min = v
+                self.min_files = [(filename, 1)] if self.track_files else []
+            elif v == self.min and self.track_files:
+                count_file(self.min_files, filename, 1)
+        if self.track_max:
+            if self.max is None or v > self.max:
+                self.max = v
+                self.max_files = [(filename, 1)] if self.track_files else []
+            elif v == self.max and self.track_files:
+                count_file(self.max_files, filename, 1)
+
+    def update_min(self, v : float, files : 'list[tuple[str,int]]') -> None:
+        if self.min is None or v < self.min:
+            self.min = v
+            self.min_files = []
+        elif v != self.min:
+            return
+        for filename, count in files:
+            count_file(self.min_files, filename, count)
+
+    def update_max(self, v : float, files : 'list[tuple[str,int]]') -> None:
+        if self.max is None or v > self.max:
+            self.max = v
+            self.max_files = []
+        elif v != self.max:
+            return
+        for filename, count in files:
+            count_file(self.max_files, filename, count)
+
+    def files_at(self, positions : 'list[int]') -> 'list[tuple[str,int]]':
+        """
+        The files of the values at some positions of the block, as
+        (file, number of values) pairs (none if the files are not tracked).
+        """
+        files : 'list[tuple[str,int]]' = []
+        if self.track_files:
+            for position in positions:
+                count_file(files, self.file_at(position), 1)
+        return files
+
+    def update_moments(self, count : int, mean : float, m2 : float) -> None:
+        """
+        Chan et al. update for the union with count numbers with the given
+        mean and sum of squared deviations.
+        """
+        total = self.numbers + count
+        delta = mean - self.running_mean
+        self.m2 += m2 + delta * delta * self.numbers * count / total
+        self.running_mean += delta * count / total
+        self.numbers = total
+
+    def file_at(self, position : int) -> str:
+        return self.block_files[bisect.bisect_right(self.block_starts, position) - 1]
+
+    def flush(self) -> None:
+        """
+        Reduce the buffered numbers with the NumPy kernels.
+        """
+        if not self.block:
+            return
+        block = vectorized.as_array(self.block)
+        if vectorized.has_nan(block):
+            # the comparisons with NaN depend on the order of the numbers
+            for position, v in enumerate(self.block):
+                self.add_number(self.file_at(position), v)
+        else:
+            if self.track_sum:
+                self.total += float(block.sum())
+            if self.track_product and self.product != 0:
+                self.product *= vectorized.block_product(block)
+            if self.track_moments:
+                self.update_moments(len(block), *vectorized.block_moments(block))
             else:
-                val = 1 if sum_or_count_or_prod == "prod" else 0
+                self.numbers += len(block)
+            if self.track_values:
+                self.values.extend(self.block.tolist()) # type: ignore
+            if self.track_min:
+                v, positions = vectorized.block_extreme(block, largest=False)
+                self.update_min(v, self.files_at(positions))
+            if self.track_max:
+                v, positions = vectorized.block_extreme(block, largest=True)
+                self.update_max(v, self.files_at(positions))
+        del block
+        self.block = array('d')
+        self.block_starts = []
+        self.block_files = []
+        self.block_file = None
+
+    def merge(self, other : 'Statistics') -> None:
+        """
+        Add the state of the values of another group, printed after the
+        ones of this group (e.g., by a worker process).
+        """
+        if other.first is None:
+            return
+        self.flush()
+        other.flush()
+        if self.reverse:
+            if self.last is None:
+                self.last = other.last
+            self.first = other.first
         else:
-            if sum_or_count_or_prod == "count":
-                val = 1
+            if self.first is None:
+                self.first = other.first
+            self.last = other.last
+        self.texts.extend(other.texts)
+        if self.sorted_texts is not None and other.sorted_texts is not None:
+            self.sorted_texts.merge(other.sorted_texts)
+            if self.sorted_numbers is not None and other.sorted_numbers is not None:
+                self.sorted_numbers.merge(other.sorted_numbers)
             else:
-                val = float(line[1])
-        if sum_or_count_or_prod in ["sum","count"]:
-            result += val
-        elif sum_or_count_or_prod == "prod":
-            result *= val
-            if result == 0:
-                break # I can stop here
-    return result
-
-def _compute_count(aggregate_lines: 'list[tuple[str,str]]', filename : str | None) -> 'int | float':
-    return _compute_sum_prod_count("count", aggregate_lines, filename)
-
-def _compute_sum(aggregate_lines: 'list[tuple[str,str]]', filename : str | None) -> 'int | float':
-    return _compute_sum_prod_count("sum", aggregate_lines, filename)
-
-def _compute_product(aggregate_lines: 'list[tuple[str,str]]', filename : str | None) -> 'int | float':
-    return _compute_sum_prod_count("prod", aggregate_lines, filename)
-
-def _compute_min_or_max(min_or_max : str, aggregate_lines: 'list[tuple[str,str]]', filename : str | None) -> 'int | float':
-    fn = min if min_or_max == "min" else max
-    if filename is not None:
-        return fn(float(line[1]) for line in aggregate_lines if line[0] == filename)
-    return fn(float(line[1]) for line in aggregate_lines)
-
-def _compute_min(aggregate_lines: 'list[tuple[str,str]]', filename : str | None) -> 'int | float':
-    return _compute_min_or_max("min", aggregate_lines, filename)
-
-def _compute_max(aggregate_lines: 'list[tuple[str,str]]', filename : str | None) -> 'int | float':
-    return _compute_min_or_max("max", aggregate_lines, filename)
-
-def _compute_range(aggregate_lines: 'list[tuple[str,str]]', filename : str | None) -> 'int | float':
-    min_val = _compute_min(aggregate_lines, filename)
-    max_val = _compute_max(aggregate_lines, filename)
-    return max_val - min_val
-
-def _compute_mean(aggregate_lines: 'list[tuple[str,str]]', filename : str | None) -> float:
-    if filename is not None:
-        total = sum(float(line[1]) for line in aggregate_lines if line[0] == filename)
-        count = sum(1 for line in aggregate_lines if line[0] == filename)
-    else:
-        total = sum(float(line[1]) for line in aggregate_lines)
-        count = len(aggregate_lines)
-    res = total / count if count > 0 else 0
-    return res
-
-def _compute_average(aggregate_lines: 'list[tuple[str,str]]', filename : str | None) -> float:
-    return _compute_mean(aggregate_lines, filename)
-
-def _compute_median(aggregate_lines: 'list[tuple[str,str]]', filename : str | None) -> float:
-    if filename is not None:
-        values = sorted(float(line[1]) for line in aggregate_lines if line[0] == filename)
-        n = sum(1 for line in aggregate_lines if line[0] == filename)
-    else:
-        values = sorted(float(line[1]) for line in aggregate_lines)
-        n = len(values)
-    if n % 2 == 1:
-        median = values[n // 2]
-    else:
-        median = (values[n // 2 - 1] + values[n // 2]) / 2
-    return median
+                self.close_sorter(other.sorted_numbers)
+                self.close_sorter(self.sorted_numbers)
+                self.sorted_numbers = None
+        self.unique.update(other.unique)
+        self.words += other.words
+        if self.distinct is not None and other.distinct is not None:
+            self.distinct.merge(other.distinct)
+        if self.parse and self.numeric_error is None:
+            if self.product != 0:
+                self.product *= other.product
+                self.product_error = other.product_error
+            self.numeric_error = other.numeric_error
+            self.update_moments(other.numbers, other.running_mean, other.m2)
+            self.total += other.total
+            if self.values is not None and other.values is not None:
+                self.values.merge(other.values)
+            if self.quantiles is not None and other.quantiles is not None:
+                self.quantiles.merge(other.quantiles)
+            if other.min is not None:
+                self.update_min(other.min, other.min_files)
+            if other.max is not None:
+                self.update_max(other.max, other.max_files)
+        self.count += other.count
 
-def _compute_variance(aggregate_lines: 'list[tuple[str,str]]', filename : str | None) -> float:
-    if filename is not None:
-        n = sum(1 for line in aggregate_lines if line[0] == filename)
-    else:
-        n = len(aggregate_lines)
-    if n < 2:
-        return 0.0
-    mean = _compute_mean(aggregate_lines, filename)
-    if filename is not None:
-        variance = sum((float(line[1]) - mean) ** 2 for line in aggregate_lines if line[0] == filename) / (n - 1)
+    def numeric(self) -> 'Statistics':
+        """
+        The state, if all the values are numbers.
+        """
+        self.flush()
+        if self.numeric_error is not None:
+            raise self.numeric_error
+        return self
+
+    def get_product(self) -> float:
+        self.flush()
+        if self.product_error is not None:
+            raise self.product_error
+        return self.product
+
+    def get_mean(self) -> float:
+        return self.numeric().total / self.count if self.count > 0 else 0
+
+    def get_variance(self) -> float:
+        self.numeric()
+        if self.count < 2:
+            return 0.0
+        return self.m2 / (self.count - 1)
+
+    def get_median(self) -> float:
+        values : ExternalSorter = self.numeric().values # type: ignore
+        n = values.count
+        if vectorized.HAS_NUMPY and not values.runs and n > 0:
+            middle = vectorized.middle(values.buffer)
+        else:
+            # the middle values of the merged runs
+            middle = list(itertools.islice(values.sorted(), (n - 1) // 2, n // 2 + 1))
+        if n % 2 == 1:
+            return middle[0]
+        return (middle[0] + middle[1]) / 2
+
+    def get_min(self) -> float:
+        return self.numeric().min # type: ignore
+
+    def get_max(self) -> float:
+        return self.numeric().max # type: ignore
+
+    def get_summary(self) -> str:
+        min_val = self.get_min()
+        max_val = self.get_max()
+        res = "\nCount:    " + str(self.count) + \
+              "\nSum:      " + str(self.numeric().total) + \
+              "\nMean:     " + str(self.get_mean()) + \
+              "\nMedian:   " + str(self.get_median()) + \
+              "\nStd Dev:  " + str(math.sqrt(self.get_variance())) + \
+              "\nMin:      " + str(min_val) + \
+              "\nMax:      " + str(max_val) + \
+              "\nRange:    " + str(max_val - min_val)
+        return res
+
+    def get_quantiles(self) -> 'list[float]':
+        if any(not 0 <= q <= 1 for q in self.quantile_levels):
+            raise ValueError("the quantiles must be between 0 and 1")
+        return self.numeric().quantiles.quantiles(self.quantile_levels) # type: ignore
+
+    def get_percentiles(self) -> str:
+        res = ""
+        for q, value in zip(self.quantile_levels, self.get_quantiles()):
+            res += "\n" + f"p{q * 100:g}:".ljust(10) + str(value)
+        return res
+
+    def get_sorted(self, ascending : bool) -> 'Iterator[str]':
+        """
+        The sorted values (as numbers if all of them are numbers), one per
+        line, streamed in blocks.
+        """
+        sorter = self.sorted_numbers if self.sorted_numbers is not None else self.sorted_texts
+        values = sorter.sorted(reverse=not ascending) # type: ignore
+        while True:
+            block = list(itertools.islice(values, RUN_BLOCK))
+            if not block:
+                return
+            yield '\n' + '\n'.join([str(line) for line in block])
+
+    @staticmethod
+    def close_sorter(sorter : 'ExternalSorter|None') -> None:
+        if sorter is not None:
+            sorter.close()
+
+    def close(self) -> None:
+        """
+        Remove the temporary files.
+        """
+        for sorter in [self.values, self.sorted_texts, self.sorted_numbers]:
+            self.close_sorter(sorter)
+
+
+# aggregation function -> parts of the state it needs, and its result
+AGGREGATES : 'dict[str, tuple[tuple[str, ...], Callable[[Statistics], Any]]]' = {
+    "count": ((), lambda stats: stats.count),
+    "sum": (("sum",), lambda stats: stats.numeric().total),
+    "product": (("product",), Statistics.get_product),
+    "average": (("sum",), Statistics.get_mean),
+    "mean": (("sum",), Statistics.get_mean),
+    "stddev": (("moments",), lambda stats: math.sqrt(stats.get_variance())),
+    "variance": (("moments",), Statistics.get_variance),
+    "median": (("values",), Statistics.get_median),
+    "min": (("min",), Statistics.get_min),
+    "max": (("max",), Statistics.get_max),
+    "range": (("min", "max"), lambda stats: stats.get_max() - stats.get_min()),
+    "summary": (("sum", "moments", "values", "min", "max"), Statistics.get_summary),
+    "concat": (("texts",), lambda stats: ''.join(stats.texts)),
+    "unique": (("unique",), lambda stats: stats.unique),
+    "first": ((), lambda stats: stats.first.rstrip() if stats.first is not None else "-"),
+    "last": ((), lambda stats: stats.last.rstrip() if stats.last is not None else "-"),
+    "sort_ascending": (("sorted",), lambda stats: stats.get_sorted(True)),
+    "sort_descending": (("sorted",), lambda stats: stats.get_sorted(False)),
+    "word_count": (("words",), lambda stats: stats.words),
+    "quantile": (("quantiles",), lambda stats: ' '.join(str(value) for value in stats.get_quantiles())),
+    "percentiles": (("quantiles",), Statistics.get_percentiles),
+    "count_distinct": (("distinct",), lambda stats: stats.distinct.count())
+}
+
+# aggregation functions whose result is known after the first value
+FIRST_VALUE_AGGREGATES = {"first"}
+
+# the same, when the lines are processed backwards (args.reverse)
+LAST_VALUE_AGGREGATES = {"last"}
+
+
+class Aggregation:
+    """
+    State of the requested aggregation functions (args.aggregate), for
+    each file if the files are kept separated.
+    """
+    def __init__(self, args : argparse.Namespace) -> None:
+        self.args = args
+        self.keep_separated : bool = args.keep_separated
+        self.needs : 'frozenset[str]' = frozenset(need for aggregate in args.aggregate for need in AGGREGATES[aggregate][0])
+        self.groups : 'dict[str|None, Statistics]' = {}
+        self.count : int = 0
+        immediate = LAST_VALUE_AGGREGATES if args.reverse else FIRST_VALUE_AGGREGATES
+        self.complete_after_first : bool = all(aggregate in immediate for aggregate in args.aggregate)
+
+    def add(self, filename : str, value : str) -> None:
+        """
+        Add a printed value (not blank).
+        """
+        key = filename if self.keep_separated else None
+        group = self.groups.get(key)
+        if group is None:
+            group = self.groups[key] = Statistics(self.needs, self.args)
+        group.add(filename, value)
+        self.count += 1
+
+    def is_complete(self, filename : str) -> bool:
+        """
+        True if the results for the group of filename cannot change with
+        the values printed after these ones.
+        """
+        return self.complete_after_first and (filename if self.keep_separated else None) in self.groups
+
+    def merge(self, other : 'Aggregation') -> None:
+        """
+        Add the values of another aggregation, printed after these ones
+        (e.g., by a worker process).
+        """
+        for key, other_group in other.groups.items():
+            group = self.groups.get(key)
+            if group is None:
+                self.groups[key] = other_group
+            else:
+                group.merge(other_group)
+        self.count += other.count
+
+    def close(self) -> None:
+        """
+        Remove the temporary files.
+        """
+        for group in self.groups.values():
+            group.close()
+
+
+def print_result(prefix : str, res : Any) -> None:
+    """
+    Print the result of an aggregate, writing it in chunks if it is an
+    iterator (the sorts).
+    """
+    if isinstance(res, Iterator):
+        sys.stdout.write(f"{prefix} ")
+        for chunk in res:
+            sys.stdout.write(chunk)
+        sys.stdout.write("\n")
     else:
-        variance = sum((float(line[1]) - mean) ** 2 for line in aggregate_lines) / (n - 1)
-    return variance
-
-def _compute_stddev(aggregate_lines: 'list[tuple[str,str]]', filename : str | None) -> float:
-    return math.sqrt(_compute_variance(aggregate_lines, filename))
-
-def _compute_summary(aggregate_lines: 'list[tuple[str,str]]', filename : str | None) -> str:
-    n = _compute_count(aggregate_lines, filename)
-    total = _compute_sum(aggregate_lines, filename)
-    mean = _compute_mean(aggregate_lines, filename)
-    median = _compute_median(aggregate_lines, filename)
-    # variance = _compute_variance(aggregate_lines)
-    std_dev = _compute_stddev(aggregate_lines, filename)
-    min_val = _compute_min(aggregate_lines, filename)
-    max_val = _compute_max(aggregate_lines, filename)
-    res = "\nCount:    " + str(n) + \
-          "\nSum:      " + str(total) + \
-          "\nMean:     " + str(mean) + \
-          "\nMedian:   " + str(median) + \
-          "\nStd Dev:  " + str(std_dev) + \
-          "\nMin:      " + str(min_val) + \
-          "\nMax:      " + str(max_val) + \
-          "\nRange:    " + str(max_val - min_val)
-    return res
-
-def _compute_concat(aggregate_lines: 'list[tuple[str,str]]', filename : str | None) -> str:
-    if filename is not None:
-        return ''.join(line[1] for line in aggregate_lines if line[0] == filename)
-    return ''.join(line[1] for line in aggregate_lines)
-
-def _compute_word_count(aggregate_lines: 'list[tuple[str,str]]', filename : str | None) -> int:
-    if filename is not None:
-        return sum(len(line[1].split()) for line in aggregate_lines if line[0] == filename)
-    return sum(len(line[1].split()) for line in aggregate_lines)
-
-def _compute_unique(aggregate_lines: 'list[tuple[str,str]]', filename : str | None) -> set[str]:
-    if filename is not None:
-        return set(line[1].rstrip() for line in aggregate_lines if line[0] == filename)
-    return set(line[1].rstrip() for line in aggregate_lines)
-
-def _compute_first_last(first_or_last : str, aggregate_lines: 'list[tuple[str,str]]', filename : str | None) -> str:
-    idx = 0 if first_or_last == "first" else -1
-
-    if filename is None:
-        return aggregate_lines[idx][1].rstrip()
-    
-    # filename is not none
-    lines = aggregate_lines if first_or_last == "first" else reversed(aggregate_lines)
-    for line in lines:
-        if line[0] == filename:
-            return line[1].rstrip()
-    return "-"
-
-def _compute_first(aggregate_lines: 'list[tuple[str,str]]', filename : str | None) -> str:
-    return _compute_first_last("first", aggregate_lines, filename)
-
-def _compute_last(aggregate_lines: 'list[tuple[str,str]]', filename : str | None) -> str:
-    return _compute_first_last("last", aggregate_lines, filename)
-
-def _compute_sort_ascending_descending(ascending : bool, aggregate_lines: 'list[tuple[str,str]]', filename : str | None) -> 'str':
-    sorted_lines = wrap_sort(aggregate_lines, filename, reverse=not ascending)
-    return '\n' + '\n'.join([str(line) for line in sorted_lines])
-
-def _compute_sort_ascending(aggregate_lines: 'list[tuple[str,str]]', filename : str | None) -> 'str':
-    return _compute_sort_ascending_descending(True, aggregate_lines, filename)
-
-def _compute_sort_descending(aggregate_lines: 'list[tuple[str,str]]', filename : str | None) -> 'str':
-    return _compute_sort_ascending_descending(False, aggregate_lines, filename)
-
-def apply_aggregation_function(aggregate_lines : 'list[tuple[str,str]]', args : argparse.Namespace) -> None:
+        print(f"{prefix} {res}")
+
+
+def apply_aggregation_function(aggregation : Aggregation, args : argparse.Namespace) -> None:
     """
     Apply the aggregate function.
     """
     # check aggregation function
     for aggregate in args.aggregate:
+        compute = AGGREGATES[aggregate][1]
         prefix = get_aggregate_prefix(aggregate, args.uncolored)
-        if len(aggregate_lines) == 0:
+        if aggregation.count == 0:
             print(f"{get_warning_prefix(args.uncolored)} No lines to aggregate")
             return
         try:
-            # TODO: if keep separated, loop through all the files: not super efficient
-            # because I loop multiple times, but compact
             if args.keep_separated:
-                files_with_data = set(line[0] for line in aggregate_lines)
                 for filename in args.filename:
-                    if filename in files_with_data:
-                        res =  globals()[f"_compute_{aggregate}"](aggregate_lines, filename)
+                    if filename in aggregation.groups:
+                        res = compute(aggregation.groups[filename])
                     else:
                         res = "-"
                     if res != "-" or res == "-" and not args.ignore_no_matches:
-                        print(f"{get_aggregate_prefix(aggregate + ' ' + filename, args.uncolored)} {res}")
+                        print_result(get_aggregate_prefix(aggregate + ' ' + filename, args.uncolored), res)
             else:
-                res =  globals()[f"_compute_{aggregate}"](aggregate_lines, None)
+                stats = aggregation.groups[None]
+                res = compute(stats)
                 if args.with_filename and aggregate in ["min", "max"]:
                     # to allow printing the file location of the min and max values
-                    idxs = [line[0] for line in aggregate_lines if float(line[1]) == res]
-                    s_idxs = ', '.join(idxs)
+                    files = stats.min_files if aggregate == "min" else stats.max_files
+                    s_idxs = ', '.join(filename for filename, count in files for _ in range(count))
                     prefix = get_aggregate_prefix(aggregate + f" {s_idxs}", args.uncolored)
                 if res != "-" or res == "-" and not args.ignore_no_matches:
-                    print(f"{prefix} {res}")
+                    print_result(prefix, res)
         except Exception as e:
             print(f"\n{get_error_prefix(args.uncolored)} Error applying aggregation function '{aggregate}': {e}")
@@ -1,6 +1,14 @@
 import argparse
+import functools
 
-def parse_arguments():
+from typing import Any
+
+from .columnar import BATCH_LINES
+from .external import SORT_MEMORY
+from .index import INDEX_SUFFIX, parse_line_range
+from .sketches import EXACT_SIZE, HLL_PRECISION, SKETCH_SIZE
+
+def build_parser() -> argparse.ArgumentParser:
     epilog = """
 Available predicates (name and arity, i.e., number of arguments):
 - arity 1
@@ -26,6 +34,8 @@ Available predicates (name and arity, i.e., number of arguments):
     - strip/2
     - time_to_seconds/2
     - abs/2
+    - match/2
+    - search/2
 - arity 3
     - add/3
     - sub/3
@@ -33,6 +43,8 @@ Available predicates (name and arity, i.e., number of arguments):
     - div/3
     - pow/3
     - mod/3
+- arity 3 or more
+    - regex/3+
 - arity 4
     - split_select/4
     - replace/4
@@ -59,6 +71,18 @@ Examples:
     parser.add_argument("-ks", "--keep-separated", action="store_true", help="Keep the file data separated during aggregation and plotting")
     parser.add_argument("--ignore-no-matches", "-ign", action="store_true", help="Ignore aggregation functions returning no lines")
     parser.add_argument("--ignore-file", nargs="+", help="Files to ignore during processing")
+    parser.add_argument("--output-buffer", type=int, default=1 << 16, help="Size (in characters) of the output buffer, written in blocks (0 to write each match immediately)")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Number of processes used to process the files in parallel (0 for the number of CPUs)")
+    parser.add_argument("--chunk-size", type=int, default=1 << 26, help="With --jobs, files larger than this size (in bytes) are split into parts processed in parallel (0 to never split)")
+    parser.add_argument("--threaded-output", action="store_true", help="Write the output from a background thread")
+    parser.add_argument("--engine", choices=["row", "columnar"], default="row", help="Evaluate the commands one line at a time (row) or on batches of lines, one literal at a time (columnar)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_LINES, help="Number of lines of the batches of the columnar engine")
+    parser.add_argument("--lines", type=parse_line_range, default=None, metavar="START:END", help="Only process the lines from START to END (included, starting from 1, negative numbers count from the end of the file, both optional)")
+    parser.add_argument("--reverse", action="store_true", help="Process the files and their lines from the last one to the first one (as tac), reading the files backwards from the end (first and last still refer to the order of the lines in the files)")
+    parser.add_argument("--index", action="store_true", help=f"Use an index of the line offsets of each file, saved in FILE{INDEX_SUFFIX} (built if missing or if the file changed), to seek the lines of --lines and to split the files with --jobs")
+    parser.add_argument("--follow", action="store_true", help="After processing the files, process the lines appended to them (as tail -F), also when they are truncated or replaced (e.g., rotated), until interrupted (Ctrl-C) or until --idle-timeout")
+    parser.add_argument("--interval", type=float, default=0, metavar="SECONDS", help="With --follow, print the results of the aggregation functions every SECONDS seconds (0 only at the end)")
+    parser.add_argument("--idle-timeout", type=float, default=0, metavar="SECONDS", help="With --follow, stop after SECONDS seconds without new lines (0 to never stop)")
     parser.add_argument("-a", "--aggregate", action="append", choices=[
             "count",
             "sum",
@@ -78,8 +102,40 @@ Examples:
             "last",
             "sort_ascending",
             "sort_descending",
-            "word_count"
+            "word_count",
+            "quantile",
+            "percentiles",
+            "count_distinct"
         ],
         help="Aggregation function to apply to the results")
+    parser.add_argument("--quantiles", type=float, nargs="+", default=[0.5, 0.9, 0.99, 0.999], help="Quantiles (between 0 and 1) computed by the quantile and percentiles aggregation functions")
+    parser.add_argument("--sketch-size", type=int, default=SKETCH_SIZE, help="Size of the sketches of the approximate aggregation functions (higher is more accurate)")
+    parser.add_argument("--hll-precision", type=int, default=HLL_PRECISION, choices=range(4, 19), metavar="{4..18}", help="Precision of the HyperLogLog sketches of count_distinct (2^precision registers)")
+    parser.add_argument("--exact-size", type=int, default=EXACT_SIZE, help="Number of values up to which the approximate aggregation functions are exact")
+    parser.add_argument("--sort-memory", type=int, default=SORT_MEMORY, help="Number of values kept in memory by sort_ascending, sort_descending, and median (the others are sorted in temporary files)")
     # parser.add_argument("-v", "--verbose", action="store_true",help="Enable verbose output")
-    return parser.parse_args()
+    return parser
+
+def parse_arguments():
+    parser = build_parser()
+    args = parser.parse_args()
+    if args.follow and args.reverse:
+        parser.error("--follow cannot be used with --reverse")
+    return args
+
+@functools.lru_cache(maxsize=1)
+def default_arguments() -> 'dict[str, Any]':
+    """
+    Default value of each option.
+    """
+    return vars(build_parser().parse_args(["-f", "", "-c", ""]))
+
+def complete_arguments(args : argparse.Namespace) -> argparse.Namespace:
+    """
+    Add the options missing from a namespace not built by the parser
+    (e.g., when take is used as a library) with their default value.
+    """
+    for name, value in default_arguments().items():
+        if not hasattr(args, name):
+            setattr(args, name, value)
+    return args
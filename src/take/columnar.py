@@ -0,0 +1,321 @@
+import itertools
+import operator
+
+from typing import Any, Callable, Iterator
+
+from .predicates import *
+from .reader import Batch
+
+# lines evaluated together by the columnar engine
+BATCH_LINES = 1 << 16
+
+# a step of a Program: predicate name, operands, negation, and the keys
+# of the variables bound and numeric when it is executed
+StepSpec = tuple[str, 'list[Var|Const]', bool, 'frozenset[int|str]', 'frozenset[int|str]']
+
+# values of the variables (by slot) on the selected lines of a batch: all
+# the columns have one value for each selected line, in order, and the
+# column of INDEX_SLOT holds the indexes of the selected lines
+Columns = Any # dict indexed by slot
+
+# called with the columns of the selected lines: it may add the column
+# of the variable it binds, and returns which lines are still selected
+# (None if all of them)
+BatchStep = Callable[[Columns], 'list[bool]|None']
+
+# command, indexes of the lines, values printed on each of them (None if
+# the variable is not bound), whether to add a newline, and whether the
+# values come from a variable
+PrintEvent = tuple[int, 'list[int]', 'list[str|None]', bool, bool]
+
+
+#######################
+# Compilation of literals into steps over columns, with the same
+# semantics (and the same errors) of compile_literal.
+
+def _split_select_column(column : 'list[str]', v : str, p : int) -> 'list[str|None]':
+    return [parts[p] if -len(parts) <= p < len(parts) else None for parts in map(str.split, column, itertools.repeat(v))]
+
+# kernels over a column of strings (the first operand) and constants (the
+# other ones), instead of calling the function of KERNELS on each value
+COLUMN_KERNELS : 'dict[str, Callable[..., list[Any]]]' = {
+    "startswith_i": lambda column, s: [l.lower().startswith(s) for l in column],
+    "endswith_i": lambda column, s: [l.lower().endswith(s) for l in column],
+    "contains": lambda column, s: [s in l for l in column],
+    "contains_i": lambda column, s: [s in l.lower() for l in column],
+    "split_select": _split_select_column,
+    "substring": lambda column, start, end: [text[start:end] for text in column],
+    "match": lambda column, p: [found is not None for found in map(p.match, column)],
+    "search": lambda column, p: [found is not None for found in map(p.search, column)],
+}
+
+
+def _batch_raise(error : Exception) -> BatchStep:
+    def step(columns : Columns) -> 'list[bool]|None':
+        raise error
+    return step
+
+
+def _batch_getter(op : 'Var|Const', convert : 'Callable[[Any], Any]', numeric : 'set[int|str]') -> 'Callable[[Columns], Any]':
+    """
+    Function returning the (converted) values of an operand on the
+    selected lines: a column for the variables, and the value repeated for
+    each line for the constants.
+    """
+    if isinstance(op, Const):
+        value = convert(op.value)
+        return lambda columns: itertools.repeat(value, len(columns[INDEX_SLOT]))
+    runtime_convert = runtime_converter(op, convert, numeric)
+    key = op.key
+    if runtime_convert is None:
+        return operator.itemgetter(key)
+    return lambda columns: map(runtime_convert, columns[key])
+
+
+def _batch_call(name : str, fn : 'Callable[..., Any]', operands : 'list[Var|Const]', converters : 'tuple[Callable[[Any], Any], ...]', numeric : 'set[int|str]') -> 'Callable[[Columns], list[Any]]':
+    """
+    Returns a function applying fn to the values of the operands on the
+    selected lines.
+    """
+    if name in COLUMN_KERNELS and isinstance(operands[0], Var) and runtime_converter(operands[0], converters[0], numeric) is None and all(isinstance(op, Const) for op in operands[1:]):
+        kernel = COLUMN_KERNELS[name]
+        key = operands[0].key
+        constants = [convert(op.value) for op, convert in zip(operands[1:], converters[1:])] # type: ignore
+        return lambda columns: kernel(columns[key], *constants)
+    getters = [_batch_getter(op, convert, numeric) for op, convert in zip(operands, converters)]
+    if len(getters) == 1:
+        g0 = getters[0]
+        return lambda columns: list(map(fn, g0(columns)))
+    return lambda columns: list(map(fn, *[getter(columns) for getter in getters]))
+
+
+def compile_batch_literal(name : str, operands : 'list[Var|Const]', is_negated : bool, bound : 'set[int|str]', numeric : 'set[int|str]') -> BatchStep:
+    """
+    Compile a literal (except print/println) into a step over the columns
+    of a batch, as compile_literal does for a single line.
+    """
+    unbound = [op for op in operands if isinstance(op, Var) and op.key not in bound]
+    if name == "line":
+        return _batch_line(operands[0], bound, numeric)
+    if is_negated and unbound:
+        return _batch_raise(unsafe_negation_error(unbound[0], name))
+    try:
+        if name == "line_number":
+            if isinstance(operands[0], Var) and operands[0].key not in bound:
+                return _batch_raise(instantiation_error(operands[0]))
+            return _batch_output(name, operands[-1], lambda columns: [idx + 1 for idx in columns[INDEX_SLOT]], is_negated, bound, numeric)
+        if name == "regex":
+            return _batch_regex(operands, is_negated, bound, numeric)
+
+        kind, fn, converters = KERNELS[name]
+        inputs = operands if kind == CHECK else operands[:-1]
+        for op in inputs:
+            if isinstance(op, Var) and op.key not in bound:
+                return _batch_raise(instantiation_error(op))
+        compute = _batch_call(name, fn, inputs, converters, numeric)
+        if kind == CHECK:
+            if is_negated:
+                return lambda columns: [not selected for selected in compute(columns)]
+            return compute
+        return _batch_output(name, operands[-1], compute, is_negated, bound, numeric)
+    except (NotANumberError, NotAnIntegerError, InvalidPatternError) as e:
+        return _batch_raise(e)
+
+
+def _batch_regex(operands : 'list[Var|Const]', is_negated : bool, bound : 'set[int|str]', numeric : 'set[int|str]') -> BatchStep:
+    """
+    Step searching the pattern in the texts of the selected lines, binding
+    the groups to the unbound variables and comparing them with the other
+    arguments, as _compile_regex.
+    """
+    for op in operands[:2]:
+        if isinstance(op, Var) and op.key not in bound:
+            return _batch_raise(instantiation_error(op))
+    texts = _batch_getter(operands[0], get_text, numeric)
+    outputs = regex_outputs(operands, bound)
+    n = len(outputs)
+    if isinstance(operands[1], Const):
+        search = get_pattern(operands[1].value).search
+        check_groups(search.__self__, n)
+        patterns = None
+    else:
+        patterns = _batch_getter(operands[1], get_pattern, numeric)
+    expected = [None if is_binding else _batch_getter(op, get_text, numeric) for is_binding, op in outputs]
+    targets = [op.key if is_binding else None for is_binding, op in outputs]
+
+    def step(columns : Columns) -> 'list[bool]|None':
+        if patterns is None:
+            found = list(map(search, texts(columns)))
+        else:
+            found = []
+            for text, pattern in zip(texts(columns), patterns(columns)):
+                result = pattern.search(text)
+                if result is not None:
+                    check_groups(pattern, n)
+                found.append(result)
+        groups = [None if result is None else result.groups("") for result in found]
+        selected = [result is not None for result in found]
+        for position, (key, get_expected) in enumerate(zip(targets, expected)):
+            if get_expected is None:
+                columns[key] = [None if values is None else values[position] for values in groups]
+            else:
+                selected = [is_selected and values[position] == value for is_selected, values, value in zip(selected, groups, get_expected(columns))] # type: ignore
+        if is_negated:
+            return [not is_selected for is_selected in selected]
+        if False in selected:
+            return selected
+        return None
+    return step
+
+
+def _batch_line(l : 'Var|Const', bound : 'set[int|str]', numeric : 'set[int|str]') -> BatchStep:
+    if isinstance(l, Var):
+        key = l.key
+        if key in numeric:
+            return lambda columns: [line == str(value) for line, value in zip(columns[LINE_SLOT], columns[key])]
+        if key in bound:
+            return lambda columns: list(map(operator.eq, columns[LINE_SLOT], columns[key]))
+        def bind_line(columns : Columns) -> 'list[bool]|None':
+            columns[key] = columns[LINE_SLOT]
+            return None
+        return bind_line
+    value = l.value
+    return lambda columns: [line == value for line in columns[LINE_SLOT]]
+
+
+def _batch_output(name : str, out : 'Var|Const', compute : 'Callable[[Columns], list[Any]]', is_negated : bool, bound : 'set[int|str]', numeric : 'set[int|str]') -> BatchStep:
+    """
+    Step that computes the results of a function predicate and binds them
+    to the output argument, or compares them with the output argument.
+    The lines with a result equal to None are not selected.
+    """
+    if isinstance(out, Var) and out.key not in bound:
+        key = out.key
+        may_fail = name not in NUMERIC_RESULTS
+        def bind(columns : Columns) -> 'list[bool]|None':
+            results = compute(columns)
+            columns[key] = results
+            if may_fail and None in results:
+                return [result is not None for result in results]
+            return None
+        return bind
+
+    if name in NUMERIC_RESULTS:
+        expected_number = _batch_getter(out, get_number, numeric)
+        compare_number = operator.ne if is_negated else operator.eq
+        return lambda columns: list(map(compare_number, compute(columns), expected_number(columns)))
+
+    expected = _batch_getter(out, get_text, numeric)
+    def compare_text(columns : Columns) -> 'list[bool]|None':
+        return [is_negated if result is None else (result == value) ^ is_negated for result, value in zip(compute(columns), expected(columns))]
+    return compare_text
+
+#######################
+
+
+def _reads(spec : StepSpec) -> 'set[int|str]':
+    """
+    Keys of the columns used by a step.
+    """
+    name, operands, _, _, _ = spec
+    keys : 'set[int|str]' = {op.key for op in operands if isinstance(op, Var)}
+    if name == "line":
+        keys.add(LINE_SLOT)
+    return keys
+
+
+class BatchProgram:
+    """
+    Columnar version of a Program: each command is evaluated over a batch
+    of lines at once, one literal at a time, on the columns of the values
+    of its variables. A filter (a literal that fails on some lines)
+    removes the lines from the selection, so the columns of the following
+    literals only contain the selected lines; the columns that are not
+    used anymore are dropped. The selection after a prefix of steps shared
+    by more commands is computed once.
+    The print steps do not write anything: the values they print are
+    returned as PrintEvents, which the caller writes in the order of the
+    lines (and of the commands for each line).
+    """
+    def __init__(self, specs : 'list[StepSpec]', node_paths : 'list[list[int]]') -> None:
+        self.specs = specs
+        self.node_paths = node_paths
+        self.steps : 'list[BatchStep|None]' = []
+        for name, operands, is_negated, bound, numeric in specs:
+            if name in ["print", "println"]:
+                self.steps.append(None)
+            else:
+                self.steps.append(compile_batch_literal(name, operands, is_negated, set(bound), set(numeric)))
+        # for each prefix of the paths, the columns used after it and
+        # whether it is shared by more than one command
+        self.live : 'dict[tuple[int,...], set[int|str]]' = {}
+        uses : 'dict[tuple[int,...], int]' = {}
+        for path in node_paths:
+            for position in range(len(path)):
+                prefix = tuple(path[:position + 1])
+                live = self.live.setdefault(prefix, {INDEX_SLOT})
+                for node in path[position + 1:]:
+                    live.update(_reads(specs[node]))
+                uses[prefix] = uses.get(prefix, 0) + 1
+        self.shared : 'set[tuple[int,...]]' = {prefix for prefix, count in uses.items() if count > 1}
+
+    def run(self, indexes : 'list[int]', lines : 'list[str]') -> 'list[PrintEvent]':
+        """
+        Evaluate the commands on a batch of lines. The errors raised by
+        the steps are not caught.
+        """
+        events : 'list[PrintEvent]' = []
+        states : 'dict[tuple[int,...], Columns]' = {}
+        for command, path in enumerate(self.node_paths):
+            columns : Columns = {LINE_SLOT: lines, INDEX_SLOT: indexes}
+            for position, node in enumerate(path):
+                prefix = tuple(path[:position + 1])
+                if prefix in states:
+                    columns = states[prefix]
+                else:
+                    columns = self._apply(command, node, columns, self.live[prefix], events)
+                    if prefix in self.shared:
+                        states[prefix] = columns
+                if not columns[INDEX_SLOT]:
+                    break
+        return events
+
+    def _apply(self, command : int, node : int, columns : Columns, live : 'set[int|str]', events : 'list[PrintEvent]') -> Columns:
+        step = self.steps[node]
+        if step is None:
+            name, operands, _, bound, numeric = self.specs[node]
+            op = operands[0]
+            n = len(columns[INDEX_SLOT])
+            if isinstance(op, Const):
+                values : 'list[str|None]' = [op.value] * n
+            elif op.key not in bound:
+                values = [None] * n
+            elif op.key in numeric:
+                values = list(map(str, columns[op.key]))
+            else:
+                values = columns[op.key]
+            events.append((command, columns[INDEX_SLOT], values, name == "println", isinstance(op, Var)))
+            return columns
+        # the columns of a shared prefix are not modified
+        columns = dict(columns)
+        selected = step(columns)
+        if selected is not None and False in selected:
+            return {key: list(itertools.compress(column, selected)) for key, column in columns.items() if key in live}
+        return {key: column for key, column in columns.items() if key in live}
+
+
+def join_batches(batches : 'Iterator[Batch]', size : int) -> 'Iterator[tuple[list[int], list[str]]]':
+    """
+    Groups the batches of lines into batches of at least size lines
+    (except the last one).
+    """
+    indexes : 'list[int]' = []
+    lines : 'list[str]' = []
+    for batch_indexes, batch_lines in batches:
+        indexes.extend(batch_indexes)
+        lines.extend(batch_lines)
+        if len(lines) >= size:
+            yield indexes, lines
+            indexes, lines = [], []
+    if lines:
+        yield indexes, lines
@@ -0,0 +1,160 @@
+import contextlib
+import os
+import tarfile
+import zipfile
+
+from typing import BinaryIO, Iterator
+
+# separator between the name of an archive and the name of one of its
+# members, e.g., logs.tar.gz!/app/server.log
+MEMBER_SEPARATOR = "!/"
+
+# magic bytes at the start of the compressed files
+MAGIC_BYTES = [
+    (b"\x1f\x8b", "gzip"),
+    (b"BZh", "bz2"),
+    (b"\xfd7zXZ\x00", "xz")
+]
+
+# bytes read at once from the compressed files
+STREAM_BUFFER = 1 << 20
+
+# the tar archive opened last (in this process), with its name, size,
+# modification time, and inode: the members of a compressed tar are in the
+# same stream, so reading them in order from the same archive decompresses
+# it only once
+_last_tar : 'tuple[tuple[str,int,int,int], tarfile.TarFile]|None' = None
+
+
+def compression_of(head : bytes) -> 'str|None':
+    """
+    The compression of a stream starting with head, or None.
+    """
+    for magic, compression in MAGIC_BYTES:
+        if head.startswith(magic):
+            return compression
+    return None
+
+
+def is_zip(head : bytes) -> bool:
+    return head.startswith(b"PK\x03\x04") or head.startswith(b"PK\x05\x06")
+
+
+def decompress(fp : BinaryIO, compression : 'str|None') -> BinaryIO:
+    """
+    The decompressed stream of fp (fp if compression is None). The modules
+    are imported here since bz2 and lzma may be missing from a Python
+    build, which only prevents reading those files.
+    """
+    if compression == "gzip":
+        import gzip
+        return gzip.GzipFile(fileobj=fp, mode="rb") # type: ignore
+    if compression == "bz2":
+        import bz2
+        return bz2.BZ2File(fp) # type: ignore
+    if compression == "xz":
+        import lzma
+        return lzma.LZMAFile(fp) # type: ignore
+    return fp
+
+
+def split_member(name : str) -> 'tuple[str,str]|None':
+    """
+    The archive and the member of a name of a member of an archive (see
+    MEMBER_SEPARATOR), or None for the other names.
+    """
+    if MEMBER_SEPARATOR not in name or os.path.exists(name):
+        return None
+    archive, _, member = name.partition(MEMBER_SEPARATOR)
+    return archive, member
+
+
+def is_plain(name : str) -> bool:
+    """
+    True if name is a file that is not compressed nor a member of an
+    archive (also if it cannot be read, the error is reported when it
+    is processed), so it can be read at any offset.
+    """
+    if split_member(name) is not None:
+        return False
+    try:
+        with open(name, "rb") as fp:
+            return compression_of(fp.read(8)) is None
+    except OSError:
+        return True
+
+
+def archive_members(filename : str) -> 'list[str]|None':
+    """
+    The names of the files in a zip or tar (also compressed) archive, or
+    None if filename is not an archive.
+    """
+    with open(filename, "rb") as fp:
+        head = fp.read(8)
+        fp.seek(0)
+        if is_zip(head):
+            with zipfile.ZipFile(fp) as archive:
+                return [info.filename for info in archive.infolist() if not info.is_dir()]
+        with decompress(fp, compression_of(head)) as stream:
+            # the magic of the tar format is at offset 257 of the header
+            if stream.read(512)[257:262] != b"ustar":
+                return None
+    with tarfile.open(filename, "r:*") as archive:
+        return [info.name for info in archive if info.isfile()]
+
+
+def expand_archives(filenames : 'list[str]') -> 'list[str]':
+    """
+    Replace the archives with the names of their members.
+    """
+    expanded : 'list[str]' = []
+    for filename in filenames:
+        try:
+            members = archive_members(filename) if split_member(filename) is None else None
+        except (OSError, EOFError, tarfile.TarError, zipfile.BadZipFile):
+            # the error is reported when the file is processed
+            members = None
+        if members is None:
+            expanded.append(filename)
+        else:
+            expanded.extend(filename + MEMBER_SEPARATOR + member for member in members)
+    return expanded
+
+
+def _open_tar(filename : str) -> tarfile.TarFile:
+    global _last_tar
+    info = os.stat(filename)
+    key = (filename, info.st_size, info.st_mtime_ns, info.st_ino)
+    if _last_tar is not None and _last_tar[0] == key:
+        return _last_tar[1]
+    if _last_tar is not None:
+        _last_tar[1].close()
+        _last_tar = None
+    archive = tarfile.open(filename, "r:*")
+    _last_tar = (key, archive)
+    return archive
+
+
+@contextlib.contextmanager
+def open_input(name : str) -> 'Iterator[BinaryIO]':
+    """
+    The decompressed content of a file or of a member of an archive (see
+    split_member), which may also be compressed.
+    """
+    with contextlib.ExitStack() as stack:
+        member = split_member(name)
+        if member is None:
+            fp : BinaryIO = stack.enter_context(open(name, "rb", buffering=STREAM_BUFFER))
+        else:
+            archive, member_name = member
+            with open(archive, "rb") as archive_fp:
+                head = archive_fp.read(8)
+            if is_zip(head):
+                zip_file = stack.enter_context(zipfile.ZipFile(archive))
+                fp = stack.enter_context(zip_file.open(member_name)) # type: ignore
+            else:
+                extracted = _open_tar(archive).extractfile(member_name)
+                if extracted is None:
+                    raise OSError(f"{name} is not a file")
+                fp = stack.enter_context(extracted) # type: ignore
+        yield stack.enter_context(decompress(fp, compression_of(fp.peek(8)[:8]))) # type: ignore
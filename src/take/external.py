@@ -0,0 +1,140 @@
+import heapq
+import itertools
+import os
+import pickle
+import tempfile
+
+from typing import Any, Iterable, Iterator
+
+from . import vectorized
+
+# default number of values sorted in memory before writing them to a run
+SORT_MEMORY = 1 << 20
+
+# values pickled together in a run, read one block at a time
+RUN_BLOCK = 4096
+
+# runs merged at once (each one is an open file during the merge)
+MAX_RUNS = 64
+
+
+def _write_run(values : 'Iterable[Any]') -> 'tuple[str, list[int]]':
+    """
+    Write sorted values to a temporary file in blocks: returns its path and
+    the offsets of the blocks.
+    """
+    fd, path = tempfile.mkstemp(prefix="take-", suffix=".run")
+    offsets : 'list[int]' = []
+    with os.fdopen(fd, "wb") as fp:
+        iterator = iter(values)
+        while True:
+            block = list(itertools.islice(iterator, RUN_BLOCK))
+            if not block:
+                break
+            offsets.append(fp.tell())
+            pickle.dump(block, fp, pickle.HIGHEST_PROTOCOL)
+    return path, offsets
+
+
+def _read_run(path : str, offsets : 'list[int]', reverse : bool = False) -> 'Iterator[Any]':
+    """
+    Values of a run, in reverse order if reverse.
+    """
+    with open(path, "rb") as fp:
+        for offset in (reversed(offsets) if reverse else offsets):
+            fp.seek(offset)
+            block = pickle.load(fp)
+            yield from (reversed(block) if reverse else block)
+
+
+class ExternalSorter:
+    """
+    Sorts a stream of values keeping at most memory of them in memory: the
+    values are buffered, and a full buffer is sorted and written to a
+    temporary file (a run). The sorted values are produced by a k-way merge
+    (heapq.merge) of the runs, reading them one block at a time, so they
+    are never all in memory. If there are more than MAX_RUNS runs, they are
+    merged into a single one.
+    The runs are removed by close(), and moved with the sorter when it is
+    pickled (e.g., sent by a worker process).
+    If numeric (the values are int and float) and NumPy is available, the
+    buffer is sorted with vectorized.sort_numbers.
+    """
+    def __init__(self, memory : int = SORT_MEMORY, numeric : bool = False) -> None:
+        self.memory = max(memory, 1)
+        self.numeric = numeric
+        self.buffer : 'list[Any]' = []
+        self.runs : 'list[tuple[str, list[int]]]' = []
+        self.count : int = 0
+
+    def add(self, value : Any) -> None:
+        self.buffer.append(value)
+        self.count += 1
+        if len(self.buffer) >= self.memory:
+            self._spill()
+
+    def extend(self, values : 'list[Any]') -> None:
+        start = 0
+        while start < len(values):
+            chunk = values[start:start + self.memory - len(self.buffer)]
+            self.buffer.extend(chunk)
+            self.count += len(chunk)
+            start += len(chunk)
+            if len(self.buffer) >= self.memory:
+                self._spill()
+
+    def _sort_buffer(self) -> None:
+        if self.numeric and vectorized.HAS_NUMPY:
+            self.buffer = vectorized.sort_numbers(self.buffer)
+        else:
+            self.buffer.sort()
+
+    def _spill(self) -> None:
+        self._sort_buffer()
+        self.runs.append(_write_run(self.buffer))
+        self.buffer = []
+        if len(self.runs) > MAX_RUNS:
+            runs = self.runs
+            self.runs = [_write_run(heapq.merge(*(_read_run(*run) for run in runs)))]
+            _remove_runs(runs)
+
+    def merge(self, other : 'ExternalSorter') -> None:
+        """
+        Add the values of another sorter, taking its runs.
+        """
+        self.runs.extend(other.runs)
+        other.runs = []
+        count = self.count + other.count
+        for value in other.buffer:
+            self.add(value)
+        self.count = count
+
+    def sorted(self, reverse : bool = False) -> 'Iterator[Any]':
+        """
+        The values in order (descending if reverse).
+        """
+        self._sort_buffer()
+        sources : 'list[Iterator[Any]]' = [_read_run(path, offsets, reverse) for path, offsets in self.runs]
+        sources.append(reversed(self.buffer) if reverse else iter(self.buffer))
+        return heapq.merge(*sources, reverse=reverse)
+
+    def close(self) -> None:
+        _remove_runs(self.runs)
+        self.runs = []
+
+    def __getstate__(self) -> 'dict[str, Any]':
+        state = self.__dict__.copy()
+        # the runs now belong to the copy
+        self.runs = []
+        return state
+
+    def __del__(self) -> None:
+        self.close()
+
+
+def _remove_runs(runs : 'list[tuple[str, list[int]]]') -> None:
+    for path, _ in runs:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
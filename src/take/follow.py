@@ -0,0 +1,126 @@
+import locale
+import os
+import re
+
+from typing import BinaryIO, Iterator
+
+from .reader import BLOCK_SIZE, Batch, byte_prefilter, decode_block
+
+# first and longest wait (in seconds) between two polls of the followed
+# files: the wait doubles after each poll without new lines
+FOLLOW_MIN_WAIT = 0.05
+FOLLOW_MAX_WAIT = 1.0
+
+
+class FollowedFile:
+    """
+    A file followed for the lines appended to it (as tail -F): the file is
+    kept open, and it is opened again when its name refers to another file
+    (it was rotated, the rest of the old one is read first) or when it
+    becomes shorter than the read position (it was truncated), so the
+    following lines start again from index 0. A missing file is opened
+    when it appears.
+    Only complete lines are returned, the last one waits for its newline,
+    so the memory used does not grow with the size of the file.
+    """
+    def __init__(self, filename : str, prefilter : 're.Pattern[str]|None', block_size : int = BLOCK_SIZE) -> None:
+        self.filename = filename
+        self.prefilter = prefilter
+        self.encoding = locale.getpreferredencoding(False)
+        self.encoded = byte_prefilter(prefilter, self.encoding)
+        self.block_size = block_size
+        self.fp : 'BinaryIO|None' = None
+        self.index : int = 0 # index of the next line
+        self.received : int = 0 # bytes read, over all the opened files
+        self.pending : bytes = b"" # the last line, not complete yet
+
+    def open(self) -> None:
+        """
+        Open the file (raises OSError if it cannot be opened).
+        """
+        self.close()
+        self.fp = open(self.filename, "rb")
+        self.index = 0
+        self.pending = b""
+
+    def close(self) -> None:
+        if self.fp is not None:
+            self.fp.close()
+            self.fp = None
+
+    def complete_end(self, start : int, end : int) -> int:
+        """
+        Offset of the end of the last complete line in a range of bytes of
+        the file (start if there is none).
+        """
+        assert self.fp is not None
+        position = end
+        while position > start:
+            block_start = max(start, position - self.block_size)
+            self.fp.seek(block_start)
+            newline = self.fp.read(position - block_start).rfind(b"\n")
+            if newline >= 0:
+                return block_start + newline + 1
+            position = block_start
+        return start
+
+    def seek(self, offset : int, index : int) -> None:
+        """
+        Continue from the line starting at offset, with index index.
+        """
+        assert self.fp is not None
+        self.fp.seek(offset)
+        self.index = index
+        self.pending = b""
+
+    def replaced(self) -> bool:
+        """
+        True if the file was truncated, or if its name now refers to
+        another file (False if it was removed and not created again yet).
+        """
+        assert self.fp is not None
+        info = os.fstat(self.fp.fileno())
+        if info.st_size < self.fp.tell():
+            return True
+        try:
+            return os.stat(self.filename).st_ino != info.st_ino
+        except OSError:
+            return False
+
+    def batches(self, final : bool = False) -> 'Iterator[Batch]':
+        """
+        The batches of the complete lines appended since the last call
+        (and the last line without newline, if final), read in blocks of
+        block_size bytes.
+        """
+        while True:
+            if self.fp is None:
+                try:
+                    self.open()
+                except OSError:
+                    return
+            data = self.fp.read(self.block_size) # type: ignore
+            if data:
+                self.received += len(data)
+                block = self.pending + data
+                cut = block.rfind(b"\n") + 1
+                self.pending = block[cut:]
+                if cut > 0:
+                    yield self.decode(block[:cut])
+                continue
+            # end of the file
+            if self.replaced():
+                # the last line of the old file
+                if self.pending:
+                    yield self.decode(self.pending)
+                self.close()
+                continue
+            if final and self.pending:
+                yield self.decode(self.pending)
+                self.pending = b""
+            return
+
+    def decode(self, block : bytes) -> Batch:
+        batch, n = decode_block(block, self.prefilter, self.encoded, self.encoding, self.index)
+        self.index += n
+        return batch
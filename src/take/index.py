@@ -0,0 +1,298 @@
+import argparse
+import bisect
+import itertools
+import json
+import os
+import re
+import tempfile
+
+from typing import Any
+
+from .compression import is_plain
+from .reader import BLOCK_SIZE, count_line_ends, count_newlines
+
+# suffix of the sidecar file holding the index of a file
+INDEX_SUFFIX = ".takeidx"
+
+# bytes between two checkpoints of an index (moved to the end of a line)
+INDEX_SPACING = 1 << 16
+
+# format of the sidecar files: a different version is rebuilt (the
+# lines are counted with universal newlines since version 2)
+INDEX_VERSION = 2
+
+# end of a line, as open() splits the lines (universal newlines)
+LINE_END = re.compile(rb"\r\n?|\n")
+
+# lines selected with --lines: the numbers (starting from 1, negative
+# from the end) of the first and last line, None for the first and the
+# last line of the file
+LineRange = tuple['int|None', 'int|None']
+
+# size, modification time, and inode of a file: the index of a file is
+# valid only if they did not change
+Signature = tuple[int, int, int]
+
+
+def parse_line_range(text : str) -> LineRange:
+    """
+    Parse a range of lines of the form START:END (both optional) or N
+    (the line N only): numbers start from 1, and negative numbers count
+    from the end of the file (-1 is the last line).
+    """
+    first, _, last = text.partition(":") if ":" in text else (text, "", text)
+    def parse(part : str) -> 'int|None':
+        part = part.strip()
+        if part == "":
+            return None
+        try:
+            number = int(part)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"invalid line number: {part}")
+        if number == 0:
+            raise argparse.ArgumentTypeError("line numbers start from 1 (or from -1 for the last line)")
+        return number
+    return parse(first), parse(last)
+
+
+def file_signature(filename : str) -> Signature:
+    info = os.stat(filename)
+    return info.st_size, info.st_mtime_ns, info.st_ino
+
+
+def skip_lines(filename : str, offset : int, n : int, block_size : int = BLOCK_SIZE) -> int:
+    """
+    Offset of the line n lines after the one starting at offset, or the
+    size of the file if it has fewer lines.
+    """
+    with open(filename, "rb") as fp:
+        fp.seek(offset)
+        after_carriage_return = False
+        while n > 0:
+            block = fp.read(block_size)
+            if not block:
+                break
+            count = count_line_ends(block, after_carriage_return)
+            if count < n:
+                n -= count
+                offset += len(block)
+                after_carriage_return = block.endswith(b"\r")
+                continue
+            skip = 1 if after_carriage_return and block.startswith(b"\n") else 0
+            match = next(itertools.islice(LINE_END.finditer(block, skip), n - 1, None))
+            end = match.end()
+            if end == len(block) and match.group() == b"\r" and fp.read(1) == b"\n":
+                # the line ends with the newline after the block
+                end += 1
+            return offset + end
+    return offset
+
+
+def count_lines(filename : str, byte_range : 'tuple[int,int]|None' = None, block_size : int = BLOCK_SIZE) -> int:
+    """
+    Number of lines of a file, or of a range of bytes of it (the last one
+    may not end with a newline).
+    """
+    start, end = byte_range if byte_range is not None else (0, os.path.getsize(filename))
+    if end <= start:
+        return 0
+    with open(filename, "rb") as fp:
+        fp.seek(end - 1)
+        last = fp.read(1)
+    return count_newlines(filename, start, end, block_size) + (last not in (b"\n", b"\r"))
+
+
+class LineIndex:
+    """
+    Checkpoints of the lines of a file: the index (starting from 0) and
+    the offset of a line about every INDEX_SPACING bytes, and the number of
+    lines. The offset of a line is found by reading from the checkpoint
+    before it, so at most INDEX_SPACING bytes.
+    The index is saved in a sidecar file (the name of the file followed by
+    INDEX_SUFFIX) with the signature of the file, and it is used only if
+    the signature did not change.
+    """
+    def __init__(self, signature : Signature, lines : 'list[int]', offsets : 'list[int]', total : int) -> None:
+        self.signature = signature
+        self.size = signature[0]
+        self.lines = lines
+        self.offsets = offsets
+        self.total = total
+
+    @classmethod
+    def build(cls, filename : str, spacing : int = INDEX_SPACING) -> 'LineIndex':
+        signature = file_signature(filename)
+        lines : 'list[int]' = [0]
+        offsets : 'list[int]' = [0]
+        count = 0
+        position = 0
+        last = b"\n"
+        with open(filename, "rb") as fp:
+            while True:
+                block = fp.read(spacing)
+                if not block:
+                    break
+                if not block.endswith(b"\n"):
+                    # complete the last line
+                    block += fp.readline()
+                # the block ends after a newline, or at the end of the file
+                count += count_line_ends(block)
+                position += len(block)
+                last = block[-1:]
+                if last == b"\n":
+                    lines.append(count)
+                    offsets.append(position)
+        return cls(signature, lines, offsets, count + (last not in (b"\n", b"\r")))
+
+    @classmethod
+    def load(cls, path : str, signature : Signature) -> 'LineIndex|None':
+        """
+        The index saved in path, or None if it is missing, not valid, or
+        of a file with a different signature.
+        """
+        try:
+            with open(path) as fp:
+                data = json.load(fp)
+            if data["version"] != INDEX_VERSION or tuple(data["signature"]) != signature:
+                return None
+            return cls(signature, data["lines"], data["offsets"], data["total"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def save(self, path : str) -> None:
+        data : 'dict[str, Any]' = {
+            "version": INDEX_VERSION,
+            "signature": list(self.signature),
+            "total": self.total,
+            "lines": self.lines,
+            "offsets": self.offsets
+        }
+        # written to a temporary file and renamed, so a reader never
+        # sees a partial index
+        fd, temporary = tempfile.mkstemp(prefix=os.path.basename(path) + ".", dir=os.path.dirname(path) or ".")
+        try:
+            with os.fdopen(fd, "w") as fp:
+                json.dump(data, fp)
+            os.replace(temporary, path)
+        except OSError:
+            os.unlink(temporary)
+            raise
+
+    def line_offset(self, filename : str, idx : int) -> int:
+        """
+        Offset of the line with index idx (the size of the file if idx is
+        not smaller than the number of lines).
+        """
+        if idx >= self.total:
+            return self.size
+        k = bisect.bisect_right(self.lines, idx) - 1
+        return skip_lines(filename, self.offsets[k], idx - self.lines[k])
+
+    def split_ranges(self, chunk_size : int, byte_range : 'tuple[int,int]', first_index : int) -> 'list[tuple[tuple[int,int], int]]':
+        """
+        Split a range of lines (whose first line has index first_index)
+        into ranges of about chunk_size bytes starting at the checkpoints,
+        with the index of their first line, so the lines do not need to be
+        counted.
+        """
+        start, end = byte_range
+        ranges : 'list[tuple[tuple[int,int], int]]' = []
+        k = bisect.bisect_right(self.offsets, start)
+        for line, offset in zip(self.lines[k:], self.offsets[k:]):
+            if offset >= end:
+                break
+            if offset - start >= chunk_size:
+                ranges.append(((start, offset), first_index))
+                start, first_index = offset, line
+        ranges.append(((start, end), first_index))
+        return ranges
+
+
+def load_index(filename : str) -> LineIndex:
+    """
+    The index of a file, read from its sidecar file or built (and saved,
+    if the directory is writable) if it is missing or stale.
+    """
+    path = filename + INDEX_SUFFIX
+    index = LineIndex.load(path, file_signature(filename))
+    if index is None:
+        index = LineIndex.build(filename)
+        try:
+            index.save(path)
+        except OSError:
+            pass
+    return index
+
+
+def resolve_line_range(filename : str, line_range : LineRange, index : 'LineIndex|None') -> 'tuple[tuple[int,int], int]':
+    """
+    Range of bytes of the lines of a file selected by line_range, and the
+    index of its first line. The offsets are found with the index, if not
+    None, otherwise by counting the newlines from the start of the file
+    (negative line numbers also need the number of lines).
+    """
+    first, last = line_range
+    total = 0
+    if (first is not None and first < 0) or (last is not None and last < 0):
+        total = index.total if index is not None else count_lines(filename)
+    start = 0 if first is None else (first - 1 if first > 0 else max(total + first, 0))
+    end = None if last is None else (last if last > 0 else total + last + 1)
+    if end is not None and end < start:
+        end = start
+    if index is not None:
+        start_offset = index.line_offset(filename, start)
+        end_offset = index.size if end is None else index.line_offset(filename, end)
+    else:
+        start_offset = skip_lines(filename, 0, start)
+        end_offset = os.path.getsize(filename) if end is None else skip_lines(filename, start_offset, end - start)
+    return (start_offset, end_offset), start
+
+
+def select_lines(filename : str, line_range : 'LineRange|None', use_index : bool) -> 'tuple[tuple[int,int]|None, int, LineIndex|None]':
+    """
+    The range of bytes of a file to process (None for the whole file), the
+    index of its first line, and the index of the file (if use_index).
+    The lines of the compressed files cannot be selected, and they have
+    no index.
+    """
+    if not is_plain(filename):
+        if line_range is not None:
+            raise ValueError(f"{filename} is compressed: --lines needs a file that is not compressed")
+        return None, 0, None
+    index = load_index(filename) if use_index else None
+    if line_range is None:
+        return None, 0, index
+    byte_range, first_index = resolve_line_range(filename, line_range, index)
+    return byte_range, first_index, index
+
+
+def reverse_range(
+        filename : str,
+        byte_range : 'tuple[int,int]|None',
+        first_index : int,
+        line_limit : 'int|None',
+        count : bool,
+        use_index : bool
+    ) -> 'tuple[tuple[int,int], int]':
+    """
+    The range of bytes of a file (or of byte_range, whose first line has
+    index first_index) to read backwards, without the lines with index
+    line_limit or larger (if not None), and the index of the line after
+    its last line. The lines are counted only if count (with the index of
+    the file, if use_index), otherwise the returned index is first_index,
+    so the indexes of the lines are only relative.
+    """
+    if not is_plain(filename):
+        raise ValueError(f"{filename} is compressed and cannot be read backwards")
+    index = load_index(filename) if use_index else None
+    start, end = byte_range if byte_range is not None else (0, os.path.getsize(filename))
+    if line_limit is not None:
+        limit = max(line_limit, first_index)
+        offset = index.line_offset(filename, limit) if index is not None else skip_lines(filename, start, limit - first_index)
+        if offset < end:
+            return (start, offset), limit
+    if not count:
+        return (start, end), first_index
+    if index is not None and start == 0 and end == index.size:
+        return (start, end), index.total
+    return (start, end), first_index + count_lines(filename, (start, end))
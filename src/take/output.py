@@ -0,0 +1,158 @@
+import queue
+import sys
+import threading
+
+from typing import TextIO
+
+from .utils import bcolors
+
+
+def format_value(
+        value : str,
+        with_newline : bool = False,
+        filename : str|None = None,
+        uncolored_output : bool = False,
+        max_columns : int = 0,
+        already_printed_filename : bool = False
+    ) -> str:
+    """
+    Format a value, prefixed by the filename (if not None and not already
+    printed for the current line) and truncated to max_columns (if > 0).
+    """
+    end = "\n" if with_newline else ""
+    if filename is None or already_printed_filename:
+        if max_columns > 0:
+            return value[:max_columns] + end
+        return value + end
+    max_len = max_columns
+    if max_columns > 0 and len(filename) > max_columns-1:
+        # no space left for the value
+        filename = filename[:max_columns-1]
+        prefix = f"{filename}:" if uncolored_output else f"{bcolors.PURPLE}{filename}:{bcolors.ENDC}"
+        return prefix + "\n"
+    prefix = f"{filename}:" if uncolored_output else f"{bcolors.PURPLE}{filename}:{bcolors.ENDC}"
+    if max_columns > 0:
+        max_len -= len(filename) + 1
+        value = value[:max_len]
+    return prefix + value + end
+
+
+class OutputWriter:
+    """
+    Writes the output of print/println in large blocks: each value is
+    formatted once and appended to a buffer that is written when it
+    exceeds buffer_size characters (0 to write each value immediately).
+    If threaded, the blocks are written by a background thread through a
+    bounded queue, so the scan of the files does not wait for the output.
+    An error of the thread (e.g., a closed pipe) is raised by the next
+    flush, sync, or close, and the following blocks are discarded.
+    """
+    def __init__(
+            self,
+            uncolored_output : bool = False,
+            max_columns : int = 0,
+            buffer_size : int = 1 << 16,
+            threaded : bool = False,
+            stream : 'TextIO|None' = None,
+            queue_size : int = 16
+        ) -> None:
+        self.uncolored_output = uncolored_output
+        self.max_columns = max_columns
+        self.stream : TextIO = stream if stream is not None else sys.stdout
+        self.buffer_size = buffer_size
+        self.parts : 'list[str]' = []
+        self.size : int = 0
+        self.queue : 'queue.Queue[str|None]|None' = None
+        self.thread : 'threading.Thread|None' = None
+        self.error : 'Exception|None' = None # error of the background thread
+        if threaded:
+            self.queue = queue.Queue(maxsize=queue_size)
+            self.thread = threading.Thread(target=self._write_blocks, daemon=True)
+            self.thread.start()
+
+    def write_value(self, value : str, with_newline : bool, filename : 'str|None' = None, already_printed_filename : bool = False) -> None:
+        """
+        Buffer a printed value.
+        """
+        if filename is None and self.max_columns == 0:
+            text = value + "\n" if with_newline else value
+        else:
+            text = format_value(value, with_newline, filename, self.uncolored_output, self.max_columns, already_printed_filename)
+        self.write(text)
+
+    def write(self, text : str) -> None:
+        """
+        Buffer some text.
+        """
+        self.parts.append(text)
+        self.size += len(text)
+        if self.size > self.buffer_size:
+            self.flush()
+
+    def drain(self) -> str:
+        """
+        Return the buffered text without writing it.
+        """
+        text = ''.join(self.parts)
+        self.parts = []
+        self.size = 0
+        return text
+
+    def flush(self) -> None:
+        """
+        Write the buffered text (in the background thread if threaded,
+        in this case the text may not be written yet when this returns).
+        """
+        if self.error is not None:
+            raise self.error
+        if not self.parts:
+            return
+        block = ''.join(self.parts)
+        self.parts = []
+        self.size = 0
+        if self.queue is not None:
+            self.queue.put(block)
+        else:
+            self.stream.write(block)
+            self.stream.flush()
+
+    def sync(self) -> None:
+        """
+        Write the buffered text and wait until it is written, for instance
+        before printing a message directly.
+        """
+        self.flush()
+        if self.queue is not None:
+            self.queue.join()
+            if self.error is not None:
+                raise self.error
+
+    def close(self) -> None:
+        """
+        Write the buffered text and stop the background thread.
+        """
+        try:
+            self.sync()
+        finally:
+            if self.queue is not None and self.thread is not None:
+                self.queue.put(None)
+                self.thread.join()
+                self.queue = None
+                self.thread = None
+
+    def _write_blocks(self) -> None:
+        assert self.queue is not None
+        while True:
+            block = self.queue.get()
+            try:
+                if block is None:
+                    return
+                if self.error is None:
+                    self.stream.write(block)
+                    self.stream.flush()
+            except Exception as e:
+                # keep consuming the queue, so flush and close do not
+                # block on it
+                self.error = e
+            finally:
+                self.queue.task_done()
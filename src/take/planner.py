@@ -0,0 +1,243 @@
+import math
+import re
+
+from typing import Any
+
+from .predicates import InvalidPatternError, NotANumberError, check_groups, get_constant, get_integer, get_number, get_pattern, is_variable, output_positions
+
+# predicates on the line that can be checked on blocks of text before
+# evaluating the commands
+SCREENING_PREDICATES = ["line", "startswith", "startswith_i", "endswith", "endswith_i", "contains", "contains_i"]
+
+# predicates that cannot raise an error when their input variables are
+# bound (split_select also needs a valid delimiter and position, match,
+# search, and regex a valid constant pattern, and length an unbound output
+# or a numeric constant to compare with)
+SAFE_PREDICATES = ["startswith", "startswith_i", "endswith", "endswith_i", "contains", "contains_i", "strip", "capitalize", "length", "replace", "split_select", "match", "search", "regex"]
+
+
+def _is_safe(literal : Any, bound : 'set[str]') -> bool:
+    """
+    True if the literal cannot raise an error, given the set of the
+    variables bound before it.
+    """
+    if literal.name not in SAFE_PREDICATES:
+        return False
+    outputs = output_positions(literal.name, len(literal.args))
+    inputs = [arg for position, arg in enumerate(literal.args) if position not in outputs]
+    if any(is_variable(arg) and arg not in bound for arg in inputs):
+        return False
+    if literal.is_negated and any(is_variable(arg) and arg not in bound for arg in literal.args):
+        return False
+    if literal.name == "split_select":
+        v, p = literal.args[1], literal.args[2]
+        if is_variable(v) or is_variable(p) or get_constant(v) == "":
+            return False
+        try:
+            get_integer(get_constant(p))
+        except Exception:
+            return False
+    if literal.name == "length":
+        n = literal.args[1]
+        if is_variable(n):
+            return n not in bound
+        try:
+            get_number(get_constant(n))
+        except NotANumberError:
+            return False
+    if literal.name in ["match", "search", "regex"]:
+        if is_variable(literal.args[1]):
+            return False
+        try:
+            check_groups(get_pattern(get_constant(literal.args[1])), len(outputs))
+        except InvalidPatternError:
+            return False
+    return True
+
+
+def line_conditions(command : Any) -> 'list[str]':
+    """
+    Regular expressions (one per line) that a line must match for the
+    command to reach its first print/println: the constants checked on
+    the whole line by startswith, endswith, contains, and line.
+    Only the literals before the first print and before any literal that
+    could raise an error are considered, so skipping the lines that do not
+    match does not change the output.
+    """
+    first = command.literals[0]
+    if not is_variable(first.args[0]):
+        return [f"^{re.escape(get_constant(first.args[0]))}$"]
+    line_var = first.args[0]
+    bound = {line_var}
+    conditions : 'list[str]' = []
+    for literal in command.literals[1:]:
+        if literal.name in ["print", "println"] or not _is_safe(literal, bound):
+            break
+        if literal.name in SCREENING_PREDICATES and not literal.is_negated and literal.args[0] == line_var and not is_variable(literal.args[1]):
+            text = get_constant(literal.args[1])
+            case_insensitive = literal.name.endswith("_i")
+            if text == "" or (case_insensitive and not text.isascii()):
+                # always true, or the regular expression could be
+                # stricter than lower()
+                continue
+            escaped = re.escape(text)
+            if case_insensitive:
+                escaped = f"(?i:{escaped})"
+            if literal.name.startswith("startswith"):
+                conditions.append(f"^{escaped}")
+            elif literal.name.startswith("endswith"):
+                conditions.append(f"{escaped}$")
+            else:
+                conditions.append(escaped)
+        for position in output_positions(literal.name, len(literal.args)):
+            if is_variable(literal.args[position]):
+                bound.add(literal.args[position])
+    return conditions
+
+
+def build_prefilter(commands : 'list[Any]') -> 're.Pattern[str]|None':
+    """
+    Regular expression matching (a part of) the lines that may be printed
+    by at least one of the commands, or None if every line must be
+    evaluated.
+    For each command, the longest of its conditions is used.
+    """
+    alternatives : 'list[str]' = []
+    for command in commands:
+        conditions = line_conditions(command)
+        if not conditions:
+            return None
+        alternatives.append(max(conditions, key=len))
+    return re.compile('|'.join(alternatives), re.MULTILINE)
+
+
+def raises_no_errors(commands : 'list[Any]') -> bool:
+    """
+    True if no literal of the commands can raise an error, so the scan of
+    a file can stop before its end without hiding an error.
+    """
+    for command in commands:
+        bound = {arg for arg in command.literals[0].args if is_variable(arg)}
+        for literal in command.literals[1:]:
+            if literal.name in ["line", "print", "println"]:
+                if literal.name == "line" and is_variable(literal.args[0]):
+                    bound.add(literal.args[0])
+                continue
+            if not _is_safe(literal, bound):
+                return False
+            for position in output_positions(literal.name, len(literal.args)):
+                if is_variable(literal.args[position]):
+                    bound.add(literal.args[position])
+    return True
+
+
+def uses_line_numbers(commands : 'list[Any]') -> bool:
+    """
+    True if the index of the lines is used by some command.
+    """
+    return any(literal.name == "line_number" for command in commands for literal in command.literals)
+
+
+# comparisons of numbers: the comparison with the arguments swapped, and
+# the one with the opposite result (for the negated literals)
+COMPARISONS = {
+    "lt": ("gt", "geq"),
+    "leq": ("geq", "gt"),
+    "gt": ("lt", "leq"),
+    "geq": ("leq", "lt"),
+    "eq": ("eq", "neq"),
+    "neq": ("neq", "eq"),
+}
+
+
+def _number(arg : str) -> 'int|float|None':
+    """
+    The value of a constant argument if it is a number.
+    """
+    if is_variable(arg):
+        return None
+    try:
+        return get_number(get_constant(arg))
+    except NotANumberError:
+        return None
+
+
+def _upper_bound(name : str, value : 'int|float') -> 'int|None':
+    """
+    Largest line number N (an integer) such that name(N,value) is true, or
+    None if there is none.
+    """
+    if not math.isfinite(value):
+        return None
+    if name == "lt":
+        return math.ceil(value) - 1
+    if name == "leq":
+        return math.floor(value)
+    if name == "eq":
+        return int(value) if value == int(value) else 0
+    return None
+
+
+def line_number_bound(command : Any) -> 'int|None':
+    """
+    Upper bound on the number (starting from 1) of the lines where the
+    command can reach its first print/println, given by line_number(L,N)
+    followed by a comparison of N with a constant (e.g., leq(N,10)), or
+    None if there is no bound.
+    As in line_conditions, only the literals before the first print and
+    before any literal that could raise an error are considered, so
+    skipping the lines after the bound does not change the output.
+    """
+    first = command.literals[0]
+    if not is_variable(first.args[0]):
+        return None
+    bound = {first.args[0]}
+    line_numbers : 'set[str]' = set() # variables holding the line number
+    limit : 'int|None' = None
+    for literal in command.literals[1:]:
+        if literal.name in ["print", "println"]:
+            break
+        value : 'int|None' = None
+        if literal.name == "line_number" and (not is_variable(literal.args[0]) or literal.args[0] in bound):
+            n = literal.args[1]
+            if is_variable(n) and n not in bound and not literal.is_negated:
+                line_numbers.add(n)
+                bound.add(n)
+                continue
+            if n in line_numbers:
+                # always true
+                continue
+            number = _number(n)
+            if number is None:
+                break
+            if not literal.is_negated:
+                value = _upper_bound("eq", number)
+        elif literal.name in COMPARISONS:
+            name = COMPARISONS[literal.name][1] if literal.is_negated else literal.name
+            a, b = literal.args
+            if a in line_numbers and _number(b) is not None:
+                value = _upper_bound(name, _number(b)) # type: ignore
+            elif b in line_numbers and _number(a) is not None:
+                value = _upper_bound(COMPARISONS[name][0], _number(a)) # type: ignore
+            elif not all(arg in line_numbers or _number(arg) is not None for arg in literal.args):
+                break
+        elif _is_safe(literal, bound):
+            for position in output_positions(literal.name, len(literal.args)):
+                if is_variable(literal.args[position]):
+                    bound.add(literal.args[position])
+        else:
+            break
+        if value is not None:
+            limit = value if limit is None else min(limit, value)
+    return limit
+
+
+def line_limit(commands : 'list[Any]') -> 'int|None':
+    """
+    Number of lines of a file after which no command can print anything,
+    or None if every line must be evaluated.
+    """
+    bounds = [line_number_bound(command) for command in commands]
+    if any(bound is None for bound in bounds):
+        return None
+    return max(max(bounds), 0) # type: ignore
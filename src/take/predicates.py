@@ -1,4 +1,10 @@
-from .utils import bcolors
+import functools
+import operator
+import re
+
+from typing import Any, Callable
+
+from .output import format_value
 
 PREDICATES = {
     # arity 1
@@ -24,6 +30,8 @@ PREDICATES = {
     "strip": 2,
     "time_to_seconds": 2,
     "abs": 2,
+    "match": 2,
+    "search": 2,
     # arity 3
     "add": 3,
     "sub": 3,
@@ -31,6 +39,8 @@ PREDICATES = {
     "div": 3,
     "pow": 3,
     "mod": 3,
+    # arity 3 or more
+    "regex": 3,
     # arity 4
     "split_select": 4,
     "replace": 4,
@@ -50,6 +60,14 @@ class NotAnIntegerError(Exception):
     pass
 class UnsafeError(Exception):
     pass
+class InvalidPatternError(Exception):
+    pass
+
+# predicates taking any number of arguments, at least the one in PREDICATES
+VARIADIC_PREDICATES = {"regex"}
+
+# regular expressions compiled at most once, for all the commands
+PATTERN_CACHE_SIZE = 256
 
 def is_instantiated(s : str, instantiations : 'dict[str,str|None]') -> bool:
     """
@@ -90,30 +108,60 @@ def get_constant(s : str) -> str:
     return s
 
 
-def get_integer(s : str) -> int:
+def get_integer(s : 'str|int|float') -> int:
     """
-    Get the integer from a string.
+    Get the integer from a string (or an integer value).
     If the string cannot be converted to an integer, raise NotANumberError.
     """
+    if type(s) is int:
+        return s
+    if type(s) is float:
+        raise NotAnIntegerError(f"Value {s} is not an integer")
     try:
         return int(s)
     except ValueError:
         raise NotAnIntegerError(f"Value {s} is not an integer")
 
 
-def get_number(s : str) -> 'int|float':
+def get_number(s : 'str|int|float') -> 'int|float':
     """
-    Get the number (int or float) from a string.
+    Get the number (int or float) from a string (or a number value).
     """
+    if type(s) is int or type(s) is float:
+        return s
     try:
-        return get_integer(s)
-    except NotAnIntegerError:
+        return int(s)
+    except ValueError:
         try:
             return float(s)
         except ValueError:
             raise NotANumberError(f"Value {s} is not a number")
 
 
+def get_text(s : 'str|int|float') -> str:
+    """
+    Get the string form of a value: the variables bound by the numeric
+    predicates hold numbers, converted to text only when needed.
+    """
+    return s if type(s) is str else str(s)
+
+
+@functools.lru_cache(maxsize=PATTERN_CACHE_SIZE)
+def _compile_pattern(pattern : str) -> 're.Pattern[str]':
+    try:
+        return re.compile(pattern)
+    except re.error as e:
+        raise InvalidPatternError(f"Value {pattern} is not a valid regular expression: {e}")
+
+
+def get_pattern(s : 'str|int|float') -> 're.Pattern[str]':
+    """
+    Get the compiled regular expression from a string (cached).
+    If it is not valid, raise InvalidPatternError.
+    """
+    return _compile_pattern(get_text(s))
+
+
 def check_safe_negation(args : 'list[str]', instantiations : 'dict[str,str|None]', pred_name : str) -> None:
     """
     Check if all arguments are ground (i.e., not variables) for safe negation.
@@ -124,6 +172,425 @@ def check_safe_negation(args : 'list[str]', instantiations : 'dict[str,str|None]
             raise UnsafeError(f"Negation is not safe for variable {arg} in {pred_name}.")
 
 #######################
+# Compilation of literals into steps over a binding frame.
+# A frame is indexable by the key of the variables: in the main loop it is
+# a list and the keys are the slots assigned by the parser, while the
+# functions below that take the variable names use a dictionary.
+# The first two slots hold the current line and its index.
+
+LINE_SLOT = 0
+INDEX_SLOT = 1
+FIRST_VARIABLE_SLOT = 2
+
+Frame = Any # list indexed by slot or dict indexed by variable name
+Step = Callable[[Frame], bool]
+
+class Var:
+    """
+    Variable argument of a literal, identified by its key in the frame,
+    with its name in the command (for the error messages).
+    """
+    __slots__ = ("key", "name")
+    def __init__(self, key : 'int|str', name : 'str|None' = None) -> None:
+        self.key = key
+        self.name = name if name is not None else str(key)
+
+
+def unsafe_negation_error(var : Var, pred_name : str) -> UnsafeError:
+    return UnsafeError(f"Negation is not safe for variable {var.name} in {pred_name}.")
+
+
+def instantiation_error(var : Var) -> InstantiationError:
+    return InstantiationError(f"s is not instantiated: {var.name}")
+
+class Const:
+    """
+    Constant argument of a literal, decoded once when the command is
+    compiled (quotes removed).
+    """
+    __slots__ = ("raw", "value")
+    def __init__(self, raw : str) -> None:
+        self.raw = raw
+        self.value = get_constant(raw)
+
+# predicates that only test their arguments
+CHECK = "check"
+# predicates that compute their last argument from the other ones
+FUNCTION = "function"
+
+# special delimiters of split_select
+DELIMITERS = {"space": " ", "tab": "\t"}
+
+def get_delimiter(s : 'str|int|float') -> str:
+    """
+    Map the special delimiters to the corresponding character.
+    """
+    s = get_text(s)
+    return DELIMITERS.get(s, s)
+
+def get_lowered(s : 'str|int|float') -> str:
+    """
+    Lower case version of a string, for the case insensitive predicates.
+    """
+    return get_text(s).lower()
+
+
+def _split_select(l : str, v : str, p : int) -> 'str|None':
+    parts = l.split(v)
+    if -len(parts) <= p < len(parts):
+        return parts[p]
+    return None
+
+def _time_to_seconds(l : str) -> float:
+    # Example: 0m1.131s -> 1.131
+    parts = l.split("m")
+    if len(parts) != 2 or not parts[1].endswith("s"):
+        raise ValueError(f"Invalid time format: {l}")
+    minutes = int(parts[0])
+    seconds = float(parts[1][:-1])  # Remove the 's' at the end
+    return minutes * 60 + seconds
+
+def _abs(n : 'int|float') -> 'int|float':
+    return -n if n < 0 else n
+
+# name -> (
+#   kind,
+#   function computing the result from the input values,
+#   conversion applied to each input value before calling the function:
+#   constants are converted once, when the literal is compiled, and
+#   variables only if they may not hold a value of the right type
+# )
+KERNELS : 'dict[str, tuple[str, Callable[..., Any], tuple[Callable[[Any], Any], ...]]]' = {
+    "startswith": (CHECK, str.startswith, (get_text, get_text)),
+    "startswith_i": (CHECK, lambda l, s: l.lower().startswith(s), (get_text, get_lowered)),
+    "endswith": (CHECK, str.endswith, (get_text, get_text)),
+    "endswith_i": (CHECK, lambda l, s: l.lower().endswith(s), (get_text, get_lowered)),
+    "lt": (CHECK, operator.lt, (get_number, get_number)),
+    "leq": (CHECK, operator.le, (get_number, get_number)),
+    "gt": (CHECK, operator.gt, (get_number, get_number)),
+    "geq": (CHECK, operator.ge, (get_number, get_number)),
+    "eq": (CHECK, operator.eq, (get_number, get_number)),
+    "neq": (CHECK, operator.ne, (get_number, get_number)),
+    "contains": (CHECK, lambda l, s: s in l, (get_text, get_text)),
+    "contains_i": (CHECK, lambda l, s: s in l.lower(), (get_text, get_lowered)),
+    "length": (FUNCTION, len, (get_text,)),
+    "capitalize": (FUNCTION, str.capitalize, (get_text,)),
+    "strip": (FUNCTION, str.strip, (get_text,)),
+    "time_to_seconds": (FUNCTION, _time_to_seconds, (get_text,)),
+    "abs": (FUNCTION, _abs, (get_number,)),
+    "add": (FUNCTION, operator.add, (get_number, get_number)),
+    "sub": (FUNCTION, operator.sub, (get_number, get_number)),
+    "mul": (FUNCTION, operator.mul, (get_number, get_number)),
+    "div": (FUNCTION, operator.truediv, (get_number, get_number)),
+    "pow": (FUNCTION, operator.pow, (get_number, get_number)),
+    "mod": (FUNCTION, operator.mod, (get_number, get_number)),
+    "split_select": (FUNCTION, _split_select, (get_text, get_delimiter, get_integer)),
+    "replace": (FUNCTION, str.replace, (get_text, get_text, get_text)),
+    "substring": (FUNCTION, lambda text, start, end: text[start:end], (get_text, get_integer, get_integer)),
+    "match": (CHECK, lambda l, p: p.match(l) is not None, (get_text, get_pattern)),
+    "search": (CHECK, lambda l, p: p.search(l) is not None, (get_text, get_pattern)),
+}
+
+# function predicates whose result is a number (int or float), the other
+# ones return strings
+NUMERIC_RESULTS = {"length", "time_to_seconds", "abs", "add", "sub", "mul", "div", "pow", "mod", "line_number"}
+
+
+def _raise_step(error : Exception) -> Step:
+    """
+    Step raising the given error when reached.
+    """
+    def step(frame : Frame) -> bool:
+        raise error
+    return step
+
+
+def runtime_converter(op : 'Var', convert : 'Callable[[Any], Any]', numeric : 'set[int|str]') -> 'Callable[[Any], Any]|None':
+    """
+    Conversion to apply to the value of a variable when the step is
+    executed, None if the value has already the right type.
+    """
+    if convert is get_text and op.key not in numeric:
+        return None
+    if convert is get_number and op.key in numeric:
+        return None
+    return convert
+
+
+def _compile_getter(op : 'Var|Const', convert : 'Callable[[Any], Any]', numeric : 'set[int|str]') -> 'Callable[[Frame], Any]':
+    """
+    Function returning the (converted) value of an operand from the frame.
+    Raises the conversion error if the operand is a constant that cannot
+    be converted.
+    """
+    if isinstance(op, Const):
+        value = convert(op.value)
+        return lambda frame: value
+    runtime_convert = runtime_converter(op, convert, numeric)
+    if runtime_convert is None:
+        return operator.itemgetter(op.key)
+    key = op.key
+    return lambda frame: runtime_convert(frame[key])
+
+
+def _compile_call(fn : 'Callable[..., Any]', operands : 'list[Var|Const]', converters : 'tuple[Callable[[Any], Any], ...]', numeric : 'set[int|str]') -> 'Callable[[Frame], Any]':
+    """
+    Returns a function applying fn to the values of the operands.
+    All the variables among the operands must be bound.
+    """
+    direct = [isinstance(op, Var) and runtime_converter(op, convert, numeric) is None for op, convert in zip(operands, converters)]
+    if len(operands) == 1 and direct[0]:
+        k0 = operands[0].key
+        return lambda frame: fn(frame[k0])
+    getters = [_compile_getter(op, convert, numeric) for op, convert in zip(operands, converters)]
+    if len(getters) == 1:
+        g0 = getters[0]
+        return lambda frame: fn(g0(frame))
+    if len(getters) == 2:
+        g0, g1 = getters
+        if direct[0] and isinstance(operands[1], Const):
+            # most common shape, e.g., startswith(L,'text')
+            k0 = operands[0].key
+            v1 = g1(None)
+            return lambda frame: fn(frame[k0], v1)
+        return lambda frame: fn(g0(frame), g1(frame))
+    g0, g1, g2 = getters
+    if direct[0] and isinstance(operands[1], Const) and isinstance(operands[2], Const):
+        # e.g., split_select(L,space,1,L1)
+        k0 = operands[0].key
+        v1 = g1(None)
+        v2 = g2(None)
+        return lambda frame: fn(frame[k0], v1, v2)
+    return lambda frame: fn(g0(frame), g1(frame), g2(frame))
+
+
+def output_positions(name : str, arity : int) -> range:
+    """
+    Positions of the arguments of the predicate that are bound by a
+    successful call (if they are unbound variables): the last one for the
+    function predicates, and the groups of regex.
+    """
+    if name == "regex":
+        return range(2, arity)
+    if name == "line" or name == "line_number" or (name in KERNELS and KERNELS[name][0] == FUNCTION):
+        return range(arity - 1, arity)
+    return range(0)
+
+
+def binds(name : str, operands : 'list[Var|Const]') -> 'list[int|str]':
+    """
+    Keys of the variables bound by a successful call of the predicate
+    (ignoring the ones already bound).
+    """
+    keys : 'list[int|str]' = []
+    for position in output_positions(name, len(operands)):
+        op = operands[position]
+        if isinstance(op, Var) and op.key not in keys:
+            keys.append(op.key)
+    return keys
+
+
+def compile_literal(name : str, operands : 'list[Var|Const]', is_negated : bool, bound : 'set[int|str]', numeric : 'set[int|str]') -> Step:
+    """
+    Compile a literal (except print/println) into a step over the frame.
+    bound contains the keys of the variables that are bound when the step
+    is executed: the binding state is known in advance since a failing
+    step ends the evaluation of the command on the current line.
+    numeric contains the bound variables holding numbers (the outputs of
+    the predicates in NUMERIC_RESULTS), the other ones hold strings.
+    Errors (unsafe negation, unbound inputs, constants of the wrong type)
+    are raised when the step is executed, as in the interpreted version.
+    """
+    unbound = [op for op in operands if isinstance(op, Var) and op.key not in bound]
+    if name == "line":
+        return _compile_line(operands[0], bound, numeric)
+    if is_negated and unbound:
+        return _raise_step(unsafe_negation_error(unbound[0], name))
+    try:
+        if name == "line_number":
+            # the first argument is not used but it must be bound
+            if isinstance(operands[0], Var) and operands[0].key not in bound:
+                return _raise_step(instantiation_error(operands[0]))
+            return _compile_output(name, operands[-1], lambda frame: frame[INDEX_SLOT] + 1, is_negated, bound, numeric)
+        if name == "regex":
+            return _compile_regex(operands, is_negated, bound, numeric)
+
+        kind, fn, converters = KERNELS[name]
+        inputs = operands if kind == CHECK else operands[:-1]
+        for op in inputs:
+            if isinstance(op, Var) and op.key not in bound:
+                return _raise_step(instantiation_error(op))
+        compute = _compile_call(fn, inputs, converters, numeric)
+        if kind == CHECK:
+            if is_negated:
+                return lambda frame: not compute(frame)
+            return compute
+        return _compile_output(name, operands[-1], compute, is_negated, bound, numeric)
+    except (NotANumberError, NotAnIntegerError, InvalidPatternError) as e:
+        return _raise_step(e)
+
+
+def regex_outputs(operands : 'list[Var|Const]', bound : 'set[int|str]') -> 'list[tuple[bool, Var|Const]]':
+    """
+    Groups of a regex literal: for each one, whether it binds a variable
+    (or compares the group with a constant or a bound variable), and the
+    argument. A variable repeated among the groups is bound by the first
+    one.
+    """
+    outputs : 'list[tuple[bool, Var|Const]]' = []
+    binding : 'set[int|str]' = set()
+    for op in operands[2:]:
+        if isinstance(op, Var) and op.key not in bound and op.key not in binding:
+            binding.add(op.key)
+            outputs.append((True, op))
+        else:
+            outputs.append((False, op))
+    return outputs
+
+
+def check_groups(pattern : 're.Pattern[str]', n : int) -> None:
+    if pattern.groups < n:
+        raise InvalidPatternError(f"The regular expression {pattern.pattern} has {pattern.groups} groups, expected at least {n}")
+
+
+def _compile_regex(operands : 'list[Var|Const]', is_negated : bool, bound : 'set[int|str]', numeric : 'set[int|str]') -> Step:
+    """
+    Step searching the pattern (the second argument) in the text (the
+    first one) and binding the groups to the other arguments, or
+    comparing them with the arguments that are not unbound variables.
+    The groups that do not participate in the match are empty strings.
+    """
+    for op in operands[:2]:
+        if isinstance(op, Var) and op.key not in bound:
+            return _raise_step(instantiation_error(op))
+    text = _compile_getter(operands[0], get_text, numeric)
+    get_compiled = _compile_getter(operands[1], get_pattern, numeric)
+    outputs = regex_outputs(operands, bound)
+    n = len(outputs)
+    if isinstance(operands[1], Const):
+        check_groups(get_compiled(None), n)
+    keys = [op.key for is_binding, op in outputs if is_binding]
+    if len(keys) == n and not is_negated and isinstance(operands[1], Const) and runtime_converter(operands[0], get_text, numeric) is None:
+        # most common shape, e.g., regex(L,'(\d+) (\w+)',N,W)
+        search = get_compiled(None).search
+        k0 = operands[0].key # type: ignore
+        if n == 1:
+            k1 = keys[0]
+            def bind_group(frame : Frame) -> bool:
+                found = search(frame[k0])
+                if found is None:
+                    return False
+                frame[k1] = found.group(1) or ""
+                return True
+            return bind_group
+        def bind_groups(frame : Frame) -> bool:
+            found = search(frame[k0])
+            if found is None:
+                return False
+            for key, group in zip(keys, found.groups("")):
+                frame[key] = group
+            return True
+        return bind_groups
+
+    expected = [None if is_binding else _compile_getter(op, get_text, numeric) for is_binding, op in outputs]
+    targets = [op.key if is_binding else None for is_binding, op in outputs]
+    def step(frame : Frame) -> bool:
+        pattern = get_compiled(frame)
+        found = pattern.search(text(frame))
+        if found is None:
+            return is_negated
+        check_groups(pattern, n)
+        for key, get_expected, group in zip(targets, expected, found.groups("")):
+            if get_expected is None:
+                frame[key] = group
+            elif group != get_expected(frame):
+                return is_negated
+        return not is_negated
+    return step
+
+
+def _compile_line(l : 'Var|Const', bound : 'set[int|str]', numeric : 'set[int|str]') -> Step:
+    if isinstance(l, Var):
+        key = l.key
+        if key in numeric:
+            return lambda frame: frame[LINE_SLOT] == str(frame[key])
+        if key in bound:
+            return lambda frame: frame[LINE_SLOT] == frame[key]
+        def bind_line(frame : Frame) -> bool:
+            frame[key] = frame[LINE_SLOT]
+            return True
+        return bind_line
+    value = l.value
+    return lambda frame: frame[LINE_SLOT] == value
+
+
+def _compile_output(name : str, out : 'Var|Const', compute : 'Callable[[Frame], Any]', is_negated : bool, bound : 'set[int|str]', numeric : 'set[int|str]') -> Step:
+    """
+    Step that computes the result of a function predicate and binds it to
+    the output argument, or compares it with the output argument if this
+    is a constant or a bound variable.
+    A result equal to None means that the predicate fails.
+    """
+    if isinstance(out, Var) and out.key not in bound:
+        key = out.key
+        def bind(frame : Frame) -> bool:
+            result = compute(frame)
+            if result is None:
+                return False
+            frame[key] = result
+            return True
+        return bind
+
+    if name in NUMERIC_RESULTS:
+        expected_number = _compile_getter(out, get_number, numeric)
+        def compare(frame : Frame) -> bool:
+            return (compute(frame) == expected_number(frame)) ^ is_negated
+        return compare
+
+    expected = _compile_getter(out, get_text, numeric)
+    def compare_text(frame : Frame) -> bool:
+        result = compute(frame)
+        if result is None:
+            return is_negated
+        return (result == expected(frame)) ^ is_negated
+    return compare_text
+
+
+def _to_operand(arg : str) -> 'Var|Const':
+    return Var(arg) if is_variable(arg) else Const(arg)
+
+
+def _evaluate(
+        name : str,
+        args : 'list[str]',
+        instantiations : 'dict[str,str|None]',
+        is_negated : bool,
+        current_line : 'str|None' = None,
+        current_idx : 'int|None' = None
+    ) -> bool:
+    """
+    Evaluate a literal on the variables in the instantiations dictionary,
+    which is updated with the new bindings.
+    """
+    operands = [_to_operand(arg) for arg in args]
+    bound : 'set[int|str]' = set()
+    numeric : 'set[int|str]' = set()
+    for op in operands:
+        if isinstance(op, Var):
+            if is_instantiated(op.key, instantiations): # type: ignore
+                bound.add(op.key)
+                if not isinstance(instantiations[op.key], str): # type: ignore
+                    numeric.add(op.key)
+    frame : 'dict[int|str, Any]' = dict(instantiations)
+    frame[LINE_SLOT] = current_line
+    frame[INDEX_SLOT] = current_idx
+    res = compile_literal(name, operands, is_negated, bound, numeric)(frame)
+    for op in operands:
+        if isinstance(op, Var):
+            instantiations[op.key] = frame[op.key] # type: ignore
+    return res
+
+#######################
 
 
 def line(current_line : str, l : str, instantiations : 'dict[str,str|None]') -> bool:
@@ -134,15 +601,21 @@ def line(current_line : str, l : str, instantiations : 'dict[str,str|None]') ->
     Returns:
     - True if the variable l is instantiated, False otherwise
     """
-    if is_variable(l):
-        # check_exists(l, instantiations)
-        if is_instantiated(l, instantiations):
-            return current_line == instantiations[l]
-
-        instantiations[l] = current_line
-        return True
+    return _evaluate("line", [l], instantiations, False, current_line=current_line)
 
-    return current_line == l
+def print_value(
+        value : str,
+        with_newline : bool = False,
+        filename : str|None = None,
+        uncolored_output : bool = False,
+        max_columns : int = 0,
+        already_printed_filename : bool = False
+    ) -> None:
+    """
+    Print a value, prefixed by the filename (if not None and not already
+    printed for the current line) and truncated to max_columns (if > 0).
+    """
+    print(format_value(value, with_newline, filename, uncolored_output, max_columns, already_printed_filename), end='')
 
 def print_line(
         line : str,
@@ -158,33 +631,12 @@ def print_line(
     If l is not a variable, print it directly.
     Returns True if the variable exists and is printed, False otherwise.
     """
-    stop = False
     if is_variable(line):
-        max_len = max_columns
-        if instantiations[line] is not None:
-            if filename is not None and not already_printed_filename:
-                if max_columns > 0 and len(filename) > max_columns-1:
-                    stop = True
-                    filename = filename[:max_columns-1]
-                if not uncolored_output:
-                    print(f"{bcolors.PURPLE}{filename}:{bcolors.ENDC}", end='')
-                else:
-                    print(f"{filename}:", end='')
-                if stop:
-                    print("")
-                    return True
-                max_len -= len(filename) + 1
-            if max_columns > 0:
-                to_print = instantiations[line][:max_len]
-            else:
-                to_print = instantiations[line]
-            print(f"{to_print}", end="\n" if with_newline else "")
+        value = instantiations[line]
+        if value is not None:
+            print_value(get_text(value), with_newline, filename, uncolored_output, max_columns, already_printed_filename)
     else:
-        line = get_constant(line)
-        if max_columns > 0:
-            print(line[:max_columns], end="\n" if with_newline else "")
-        else:
-            print(line, end="\n" if with_newline else "")
+        print_value(get_constant(line), with_newline, max_columns=max_columns)
     return True
 
 
@@ -236,26 +688,8 @@ def _starts_end_with(t : bool, l : str, s : str, instantiations : 'dict[str,str|
     """
     Wrapper. t = True for startswith, False for endswith.
     """
-    if is_negated:
-        check_safe_negation([l, s], instantiations, f"{'startswith' if t else 'endswith'}")
-
-    if is_variable(s):
-        s = get_instantiation(s, instantiations)
-    else:
-        s = get_constant(s)
-
-    # to allow nonsense things like checking if a constant starts with another constant
-    if is_variable(l):
-        # check_exists(l, instantiations)
-        l = get_instantiation(l, instantiations)
-    else:
-        l = get_constant(l)
-
-    # print(f"Checking if {l} {'starts' if t else 'ends'} with {s}")
-    if case_sensitive:
-        return ((t and l.startswith(s)) or (not t and l.endswith(s))) ^ is_negated
-
-    return ((t and l.lower().startswith(s.lower())) or (not t and l.lower().endswith(s.lower()))) ^ is_negated
+    name = ("startswith" if t else "endswith") + ("" if case_sensitive else "_i")
+    return _evaluate(name, [l, s], instantiations, is_negated)
 
 def lt(n : str, v : str, instantiations : 'dict[str,str|None]', is_negated : bool) -> bool:
     """
@@ -298,58 +732,15 @@ def lt_leq_gt_geq_eq_wrapper(t : str, n : str, v : str, instantiations : 'dict[s
     - t = eq: n == v
     - t = neq: n != v
     """
-    if is_negated:
-        check_safe_negation([n, v], instantiations, t)
-
-    if is_variable(n):
-        n = get_instantiation(n, instantiations)
-    else:
-        n = get_constant(n)
-    if is_variable(v):
-        v = get_instantiation(v, instantiations)
-    else:
-        v = get_constant(v)
-    
-    n_number = get_number(n)
-    v_number = get_number(v)
-
-    if t == "lt":
-        return (n_number < v_number) ^ is_negated
-    elif t == "leq":
-        return (n_number <= v_number) ^ is_negated
-    elif t == "gt":
-        return (n_number > v_number) ^ is_negated
-    elif t == "geq":
-        return (n_number >= v_number) ^ is_negated
-    elif t == "eq":
-        return (n_number == v_number) ^ is_negated
-    elif t == "neq":
-        return (n_number != v_number) ^ is_negated
-
-    raise ValueError(f"Unknown comparison type: {t}. Expected one of 'lt', 'leq', 'gt', 'geq', 'eq', 'neq'.")
+    if t not in ["lt", "leq", "gt", "geq", "eq", "neq"]:
+        raise ValueError(f"Unknown comparison type: {t}. Expected one of 'lt', 'leq', 'gt', 'geq', 'eq', 'neq'.")
+    return _evaluate(t, [n, v], instantiations, is_negated)
 
 def length(l : str, n : str, instantiations : 'dict[str,str|None]', is_negated : bool) -> bool:
     """
     Compute the length of a string and store it in the instantiations dictionary.
     """
-    if is_negated:
-        check_safe_negation([l, n], instantiations, "length")
-    
-    if is_variable(l):
-        l = get_instantiation(l, instantiations)
-    else:
-        l = get_constant(l)
-
-    if is_variable(n):
-        if is_instantiated(n, instantiations):
-            num = get_number(instantiations[n])
-            return (len(l) == num) ^ is_negated
-
-        instantiations[n] = str(len(l))
-        return True
-
-    n = get_constant(n)
-    return (len(l) == get_number(n)) ^ is_negated
+    return _evaluate("length", [l, n], instantiations, is_negated)
 
 
 def capitalize(l: str, s: str, instantiations: 'dict[str,str|None]', is_negated : bool) -> bool:
@@ -358,24 +749,7 @@ def capitalize(l: str, s: str, instantiations: 'dict[str,str|None]', is_negated
     If s is a variable, store the capitalized string in it.
     If s is not a variable, check if it matches the capitalized string.
     """
-    if is_negated:
-        check_safe_negation([l, s], instantiations, "capitalize")
-    
-    if is_variable(l):
-        l = get_instantiation(l, instantiations)
-    else:
-        l = get_constant(l)
-
-    capitalized = l.capitalize()
-
-    if is_variable(s):
-        if instantiations[s] is None:
-            instantiations[s] = capitalized
-            return True
-        return (instantiations[s] == capitalized) ^ is_negated
-
-    s = get_constant(s)
-    return (capitalized == s) ^ is_negated
+    return _evaluate("capitalize", [l, s], instantiations, is_negated)
 
 
 def split_select(l: str, v: str, p: str, l1: str, instantiations: 'dict[str,str|None]', is_negated : bool) -> bool:
@@ -384,43 +758,7 @@ def split_select(l: str, v: str, p: str, l1: str, instantiations: 'dict[str,str|
     If l1 is a variable, store the selected part in it.
     If l1 is not a variable, check if it matches the selected part.
     """
-    if is_negated:
-        check_safe_negation([l, v, p, l1], instantiations, "split_select")
-    
-    if is_variable(l):
-        l = get_instantiation(l, instantiations)
-    else:
-        l = get_constant(l)
-    
-    if is_variable(v):
-        v = get_instantiation(v, instantiations)
-    else:
-        v = get_constant(v)
-    if v == "space":
-        v = " "
-    elif v == "tab":
-        v = "\t"
-    
-
-    if is_variable(p):
-        p = get_instantiation(p, instantiations)
-    
-    parts = l.split(v)
-    
-    p_number = get_integer(p)
-
-    if is_variable(l1):
-        if not is_instantiated(l1, instantiations):
-            if p_number < len(parts):
-                instantiations[l1] = parts[p_number]
-                return True
-            return False
-        return (p_number < len(parts) and instantiations[l1] == parts[p_number]) ^ is_negated
-
-    l1 = get_constant(l1)    
-    if p_number < len(parts):
-        return (parts[p_number] == l1) ^ is_negated
-    return False ^ is_negated
+    return _evaluate("split_select", [l, v, p, l1], instantiations, is_negated)
 
 
 def replace(l: str, old: str, new: str, l1 : str, instantiations: 'dict[str,str|None]', is_negated : bool) -> bool:
@@ -429,32 +767,7 @@ def replace(l: str, old: str, new: str, l1 : str, instantiations: 'dict[str,str|
     If l is a variable, replace the value in the instantiations dictionary.
     If l is not a variable, check if it matches the replaced string.
     """
-    if is_negated:
-        check_safe_negation([l, old, new, l1], instantiations, "replace")
-    
-    if is_variable(l):
-        l = get_instantiation(l, instantiations)
-    else:
-        l = get_constant(l)
-    if is_variable(old):
-        old = get_instantiation(old, instantiations)
-    else:
-        old = get_constant(old)
-    if is_variable(new):
-        new = get_instantiation(new, instantiations)
-    else:
-        new = get_constant(new)
-    
-    replaced = l.replace(old, new)
-
-    if is_variable(l1):
-        if not is_instantiated(l1, instantiations):
-            instantiations[l1] = replaced
-            return True
-        return (instantiations[l1] == replaced) ^ is_negated
-
-    l1 = get_constant(l1)    
-    return (replaced == l1) ^ is_negated
+    return _evaluate("replace", [l, old, new, l1], instantiations, is_negated)
 
 
 def line_number(l: str, n: str, current_idx : int, instantiations: 'dict[str,str|None]', is_negated : bool) -> bool:
@@ -462,23 +775,7 @@ def line_number(l: str, n: str, current_idx : int, instantiations: 'dict[str,str
     Get the line number of the string l.
     The line number is 1-based and it is passed in current_idx from the main loop.
     """
-
-    if is_negated:
-        check_safe_negation([l, n], instantiations, "line_number")
-
-    if is_variable(l):
-        l = get_instantiation(l, instantiations)
-    else:
-        l = get_constant(l)
-    
-    if is_variable(n):
-        if not is_instantiated(n, instantiations):
-            instantiations[n] = str(current_idx + 1)
-            return True
-        return (instantiations[n] == str(current_idx + 1)) ^ is_negated
-
-    n = get_constant(n)    
-    return (get_integer(n) == current_idx + 1) ^ is_negated
+    return _evaluate("line_number", [l, n], instantiations, is_negated, current_idx=current_idx)
 
 
 def contains(l: str, s: str, instantiations: 'dict[str,str|None]', is_negated : bool, case_sensitive: bool = True) -> bool:
@@ -487,22 +784,7 @@ def contains(l: str, s: str, instantiations: 'dict[str,str|None]', is_negated :
     If l is a variable, get its value from the instantiations dictionary.
     If s is a variable, get its value from the instantiations dictionary.
     """
-    if is_negated:
-        check_safe_negation([l, s], instantiations, "contains")
-    
-    if is_variable(l):
-        l = get_instantiation(l, instantiations)
-    else:
-        l = get_constant(l)
-    
-    if is_variable(s):
-        s = get_instantiation(s, instantiations)
-    else:
-        s = get_constant(s)
-    
-    if case_sensitive:
-        return (s in l) ^ is_negated
-    return (s.lower() in l.lower()) ^ is_negated
+    return _evaluate("contains" if case_sensitive else "contains_i", [l, s], instantiations, is_negated)
 
 
 def contains_i(l: str, s: str, instantiations: 'dict[str,str|None]', is_negated : bool) -> bool:
@@ -521,24 +803,7 @@ def strip(l : str, l1 : str, instantiations : 'dict[str,str|None]', is_negated :
     If l1 is a variable, store the stripped string in it.
     If l1 is not a variable, check if it matches the stripped string.
     """
-    if is_negated:
-        check_safe_negation([l, l1], instantiations, "strip")
-
-    if is_variable(l):
-        l = get_instantiation(l, instantiations)
-    else:
-        l = get_constant(l)
-    
-    stripped = l.strip()
-
-    if is_variable(l1):
-        if not is_instantiated(l1, instantiations):
-            instantiations[l1] = stripped
-            return True
-        return (instantiations[l1] == stripped) ^ is_negated
-
-    l1 = get_constant(l1)    
-    return (stripped == l1) ^ is_negated
+    return _evaluate("strip", [l, l1], instantiations, is_negated)
 
 
 def time_to_seconds(l : str, l1 : str, instantiations: 'dict[str,str|None]', is_negated : bool) -> bool:
@@ -548,58 +813,14 @@ def time_to_seconds(l : str, l1 : str, instantiations: 'dict[str,str|None]', is_
     If l1 is a variable, store the seconds in it.
     If l1 is not a variable, check if it matches the seconds.
     """
-    if is_negated:
-        check_safe_negation([l, l1], instantiations, "time_to_seconds")
-
-    if is_variable(l):
-        l = get_instantiation(l, instantiations)
-    else:
-        l = get_constant(l)
-
-    # Example: 0m1.131s -> 1.131
-    parts = l.split("m")
-    if len(parts) != 2 or not parts[1].endswith("s"):
-        raise ValueError(f"Invalid time format: {l}")
-
-    minutes = int(parts[0])
-    seconds = float(parts[1][:-1])  # Remove the 's' at the end
-
-    total_seconds = minutes * 60 + seconds
-
-    if is_variable(l1):
-        if not is_instantiated(l1, instantiations):
-            instantiations[l1] = str(total_seconds)
-            return True
-        return (instantiations[l1] == str(total_seconds)) ^ is_negated
-
-    l1 = get_constant(l1)
-    return (total_seconds == get_number(l1)) ^ is_negated
+    return _evaluate("time_to_seconds", [l, l1], instantiations, is_negated)
 
 
 def abs(l: str, l1: str, instantiations: 'dict[str,str|None]', is_negated : bool) -> bool:
     """
     Checks if the absolute value of l is equal to the absolute value of l1.
     """
-    if is_negated:
-        check_safe_negation([l, l1], instantiations, "abs")
-
-    if is_variable(l):
-        l = get_instantiation(l, instantiations)
-    else:
-        l = get_constant(l)
-
-    # abs by hand
-    n = get_number(l)
-    result = n if n < 0 else n
-
-    if is_variable(l1):
-        if not is_instantiated(l1, instantiations):
-            instantiations[l1] = str(result)
-            return True
-        return (instantiations[l1] == str(result)) ^ is_negated
-
-    l1 = get_constant(l1)
-    return (result == get_number(l1)) ^ is_negated
+    return _evaluate("abs", [l, l1], instantiations, is_negated)
 
 def add(l : str, v: str, l1: str, instantiations: 'dict[str,str|None]', is_negated : bool) -> bool:
     return _wrap_arithmetic("add", l, v, l1, instantiations, is_negated)
@@ -619,42 +840,9 @@ def _wrap_arithmetic(op: str, l: str, v: str, l1: str, instantiations: 'dict[str
     Applies the specified arithmetic operation (add, sub, mul, div) on the values of l and v,
     and stores the result in l1.
     """
-    if is_negated:
-        check_safe_negation([l, v, l1], instantiations, op)
-    
-    if is_variable(l):
-        l = get_instantiation(l, instantiations)
-    else:
-        l = get_constant(l)
-
-    if is_variable(v):
-        v = get_instantiation(v, instantiations)
-    else:
-        v = get_constant(v)
-
-    if op == "add":
-        result = get_number(l) + get_number(v)
-    elif op == "sub":
-        result = get_number(l) - get_number(v)
-    elif op == "mul":
-        result = get_number(l) * get_number(v)
-    elif op == "div":
-        result = get_number(l) / get_number(v)
-    elif op == "pow":
-        result = get_number(l) ** get_number(v)
-    elif op == "mod":
-        result = get_number(l) % get_number(v)
-    else:
+    if op not in ["add", "sub", "mul", "div", "pow", "mod"]:
         raise ValueError(f"Unknown operation: {op}")
-
-    if is_variable(l1):
-        if not is_instantiated(l1, instantiations):
-            instantiations[l1] = str(result)
-            return True
-        return (instantiations[l1] == str(result)) ^ is_negated
-
-    l1 = get_constant(l1)
-    return (result == get_number(l1)) ^ is_negated
+    return _evaluate(op, [l, v, l1], instantiations, is_negated)
 
 def substring(text: str, start: str, end: str, result: str, instantiations: 'dict[str,str|None]', is_negated: bool) -> bool:
     """
@@ -662,31 +850,25 @@ def substring(text: str, start: str, end: str, result: str, instantiations: 'dic
     If result is a variable, store the substring in it.
     If result is not a variable, check if it matches the substring.
     """
-    if is_negated:
-        check_safe_negation([text, start, end, result], instantiations, "substring")
-
-    if is_variable(text):
-        text = get_instantiation(text, instantiations)
-    else:
-        text = get_constant(text)
+    return _evaluate("substring", [text, start, end, result], instantiations, is_negated)
 
-    if is_variable(start):
-        start_index = int(get_instantiation(start, instantiations))
-    else:
-        start_index = get_integer(start)
-
-    if is_variable(end):
-        end_index = int(get_instantiation(end, instantiations))
-    else:
-        end_index = get_integer(end)
-
-    substring = text[start_index:end_index]
+def match(l : str, p : str, instantiations : 'dict[str,str|None]', is_negated : bool) -> bool:
+    """
+    Check if the regular expression p matches at the beginning of the string l.
+    """
+    return _evaluate("match", [l, p], instantiations, is_negated)
 
-    if is_variable(result):
-        if not is_instantiated(result, instantiations):
-            instantiations[result] = substring
-            return True
-        return (instantiations[result] == substring) ^ is_negated
+def search(l : str, p : str, instantiations : 'dict[str,str|None]', is_negated : bool) -> bool:
+    """
+    Check if the regular expression p matches anywhere in the string l.
+    """
+    return _evaluate("search", [l, p], instantiations, is_negated)
 
-    result = get_constant(result)
-    return (substring == result) ^ is_negated
\ No newline at end of file
+def regex(l : str, p : str, groups : 'list[str]', instantiations : 'dict[str,str|None]', is_negated : bool) -> bool:
+    """
+    Search the regular expression p in the string l and store its groups
+    in the variables in groups (in order).
+    If a group is not a variable (or it is instantiated), check if it
+    matches the captured text.
+    """
+    return _evaluate("regex", [l, p] + groups, instantiations, is_negated)
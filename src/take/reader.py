@@ -0,0 +1,368 @@
+import bisect
+import codecs
+import io
+import locale
+import mmap
+import os
+import re
+
+from typing import Any, Iterator, Sequence, TextIO
+
+from .compression import is_plain, open_input
+
+# characters (bytes for the mapped files) read at a time when screening
+# or splitting the lines
+BLOCK_SIZE = 1 << 20
+
+
+def read_lines(fp : TextIO, first_index : int = 0) -> 'Iterator[tuple[int,str]]':
+    """
+    Yields the index (starting from first_index) and the content (without
+    the newline) of each line.
+    """
+    for idx, current_line in enumerate(fp, first_index):
+        yield idx, current_line.rstrip('\n')
+
+
+def read_candidate_lines(fp : TextIO, prefilter : 're.Pattern[str]', block_size : int = BLOCK_SIZE, first_index : int = 0) -> 'Iterator[tuple[int,str]]':
+    """
+    Yields the index and the content of the lines where the prefilter
+    matches, searching it on large blocks of text.
+    The indexes of the skipped lines are obtained by counting the newlines.
+    """
+    idx = first_index
+    search = prefilter.search
+    while True:
+        block = fp.read(block_size)
+        if not block:
+            return
+        if not block.endswith("\n"):
+            # complete the last line
+            block += fp.readline()
+        counted = 0 # newlines before this position are counted in idx
+        match = search(block)
+        while match is not None:
+            start = block.rfind("\n", 0, match.start()) + 1
+            end = block.find("\n", match.end())
+            if end == -1:
+                end = len(block)
+            idx += block.count("\n", counted, start)
+            counted = start
+            yield idx, block[start:end]
+            match = search(block, end + 1)
+        idx += block.count("\n", counted)
+
+
+def split_ranges(filename : str, chunk_size : int, byte_range : 'tuple[int,int]|None' = None) -> 'list[tuple[int,int]]':
+    """
+    Split a file (or a range of bytes of it starting at a line) into
+    ranges of bytes of about chunk_size bytes, each one ending after a
+    newline (or at the end of the range), that can be processed
+    independently.
+    """
+    start, size = byte_range if byte_range is not None else (0, os.path.getsize(filename))
+    ranges : 'list[tuple[int,int]]' = []
+    with open(filename, "rb") as fp:
+        while start < size:
+            end = start + chunk_size
+            if end >= size:
+                end = size
+            else:
+                # move the end after the next newline
+                fp.seek(end - 1)
+                fp.readline()
+                end = fp.tell()
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def count_line_ends(block : bytes, after_carriage_return : bool = False) -> int:
+    """
+    Number of line ends in a block of bytes: a newline, a carriage return,
+    or both, as open() splits the lines (universal newlines). If
+    after_carriage_return, the byte before the block is a carriage return,
+    so a newline at its start ends the same line.
+    """
+    count = block.count(b"\n")
+    carriage_returns = block.count(b"\r")
+    if carriage_returns:
+        count += carriage_returns - block.count(b"\r\n")
+    if after_carriage_return and block.startswith(b"\n"):
+        count -= 1
+    return count
+
+
+def count_newlines(filename : str, start : int, end : int, block_size : int = BLOCK_SIZE) -> int:
+    """
+    Number of line ends (see count_line_ends) in a range of bytes of a
+    file, i.e., the number of lines in the range if it ends after a line.
+    """
+    count = 0
+    after_carriage_return = False
+    with open(filename, "rb") as fp:
+        fp.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            block = fp.read(min(block_size, remaining))
+            if not block:
+                break
+            count += count_line_ends(block, after_carriage_return)
+            after_carriage_return = block.endswith(b"\r")
+            remaining -= len(block)
+    return count
+
+
+class _RangeReader(io.RawIOBase):
+    """
+    Raw reader of a range of bytes of a file.
+    """
+    def __init__(self, filename : str, start : int, end : int) -> None:
+        super().__init__()
+        self.fp = open(filename, "rb", buffering=0)
+        self.fp.seek(start)
+        self.remaining = end - start
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer : Any) -> int:
+        n = min(len(buffer), self.remaining)
+        if n <= 0:
+            return 0
+        read = self.fp.readinto(memoryview(buffer)[:n]) or 0
+        self.remaining -= read
+        return read
+
+    def close(self) -> None:
+        self.fp.close()
+        super().close()
+
+
+def open_range(filename : str, start : int, end : int) -> TextIO:
+    """
+    Open a range of bytes of a file (starting at a line) as a text file,
+    decoded as open(filename, "r") would do.
+    """
+    return io.TextIOWrapper(io.BufferedReader(_RangeReader(filename, start, end)))
+
+
+def encode_prefilter(prefilter : 're.Pattern[str]') -> 're.Pattern[bytes]|None':
+    """
+    The prefilter as a regular expression on the UTF-8 encoded lines, or
+    None if it cannot be searched on bytes: case-insensitive conditions
+    follow the Unicode case folding that lower() uses.
+    """
+    if "(?i:" in prefilter.pattern:
+        return None
+    return re.compile(prefilter.pattern.encode("utf-8"), re.MULTILINE)
+
+
+# indexes and contents of some lines of a file
+Batch = tuple['Sequence[int]', 'list[str]']
+
+
+def read_batches(
+        filename : str,
+        prefilter : 're.Pattern[str]|None' = None,
+        byte_range : 'tuple[int,int]|None' = None,
+        first_index : int = 0,
+        block_size : int = BLOCK_SIZE,
+        end_index : 'int|None' = None
+    ) -> 'Iterator[Batch]':
+    """
+    Yields batches with the indexes and the contents of the lines of a file
+    (or of a range of bytes of it) that may match the prefilter, if not
+    None, one batch for each block of lines. If end_index is not None, the
+    file is read only up to the line with that index (excluded).
+    UTF-8 files are mapped in memory, and when the prefilter can be
+    searched on bytes only the candidate lines are decoded. The other files
+    (or the part of a file from the first block with carriage returns,
+    which open() translates) are read as text, as the compressed files and
+    the members of archives (see compression.open_input), whose lines
+    cannot be selected with byte_range.
+    """
+    idx = first_index
+    if not is_plain(filename):
+        if byte_range is not None:
+            raise ValueError(f"{filename} is compressed: its lines cannot be selected by offset")
+        with open_input(filename) as stream, io.TextIOWrapper(stream, encoding=locale.getpreferredencoding(False)) as fp: # type: ignore
+            yield from _read_text(fp, prefilter, idx, block_size, end_index)
+        return
+    if codecs.lookup(locale.getpreferredencoding(False)).name == "utf-8":
+        try:
+            with open(filename, "rb") as fp:
+                with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    start, end = byte_range if byte_range is not None else (0, len(mm))
+                    encoded = encode_prefilter(prefilter) if prefilter is not None else None
+                    for block in _mapped_blocks(mm, start, end, block_size):
+                        if end_index is not None and idx >= end_index:
+                            return
+                        # the rest of the file, if read as text
+                        byte_range = (start, end)
+                        if b"\r" in block:
+                            break
+                        if encoded is None:
+                            batch = _split_block(block.decode("utf-8"), prefilter, idx)
+                        else:
+                            batch = _search_block(block, encoded, idx)
+                        idx += block.count(b"\n")
+                        start += len(block)
+                        yield batch if end_index is None or idx <= end_index else _truncate(batch, end_index)
+                    else:
+                        return
+        except (OSError, ValueError):
+            # not a regular file, or empty
+            pass
+    with (open(filename, "r") if byte_range is None else open_range(filename, *byte_range)) as fp:
+        yield from _read_text(fp, prefilter, idx, block_size, end_index)
+
+
+def _read_text(fp : TextIO, prefilter : 're.Pattern[str]|None', idx : int, block_size : int, end_index : 'int|None') -> 'Iterator[Batch]':
+    """
+    Batches of the lines of a text stream, read in blocks of block_size
+    characters (completed to the end of a line).
+    """
+    while end_index is None or idx < end_index:
+        text = fp.read(block_size)
+        if not text:
+            return
+        if not text.endswith("\n"):
+            # complete the last line
+            text += fp.readline()
+        batch = _split_block(text, prefilter, idx)
+        idx += text.count("\n")
+        yield batch if end_index is None or idx <= end_index else _truncate(batch, end_index)
+
+
+def read_batches_reverse(
+        filename : str,
+        prefilter : 're.Pattern[str]|None',
+        byte_range : 'tuple[int,int]',
+        end_index : int,
+        block_size : int = BLOCK_SIZE
+    ) -> 'Iterator[Batch]':
+    """
+    As read_batches, but the lines of the range of bytes are yielded from
+    the last one to the first one (also in each batch): the file is read
+    backwards in blocks of about block_size bytes, starting from the end
+    of the range. end_index is the index of the line after the last one.
+    The lines are decoded as open(filename, "r") would do.
+    """
+    start, position = byte_range
+    encoding = locale.getpreferredencoding(False)
+    encoded = byte_prefilter(prefilter, encoding)
+    idx = end_index
+    tail = b"" # the start of the block read before, whose first line may begin earlier
+    with open(filename, "rb") as fp:
+        while position > start:
+            block_start = max(start, position - block_size)
+            fp.seek(block_start)
+            block = fp.read(position - block_start) + tail
+            position = block_start
+            if position > start:
+                cut = block.find(b"\n") + 1
+                if cut == 0:
+                    # a line longer than the block
+                    tail = block
+                    continue
+                tail, block = block[:cut], block[cut:]
+            else:
+                tail = b""
+            if not block:
+                continue
+            (indexes, lines), n = decode_block(block, prefilter, encoded, encoding, 0)
+            idx -= n
+            yield [idx + i for i in reversed(indexes)], lines[::-1]
+
+
+def byte_prefilter(prefilter : 're.Pattern[str]|None', encoding : str) -> 're.Pattern[bytes]|None':
+    """
+    The prefilter to search on the blocks of bytes before decoding them
+    (see encode_prefilter), if the encoding is UTF-8.
+    """
+    if prefilter is None or codecs.lookup(encoding).name != "utf-8":
+        return None
+    return encode_prefilter(prefilter)
+
+
+def decode_block(
+        block : bytes,
+        prefilter : 're.Pattern[str]|None',
+        encoded : 're.Pattern[bytes]|None',
+        encoding : str,
+        idx : int
+    ) -> 'tuple[Batch, int]':
+    """
+    The lines of a block of bytes (only complete lines, except the last
+    one of a file) where the prefilter matches, decoded as open(filename,
+    "r") would do, and the number of lines of the block. The first one
+    has index idx, and encoded is the prefilter on bytes (or None).
+    """
+    if encoded is not None and b"\r" not in block:
+        return _search_block(block, encoded, idx), block.count(b"\n") + (not block.endswith(b"\n"))
+    text = block.decode(encoding)
+    if "\r" in text:
+        # universal newlines, as open()
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return _split_block(text, prefilter, idx), text.count("\n") + (not text.endswith("\n"))
+
+
+def _mapped_blocks(mm : mmap.mmap, start : int, end : int, block_size : int) -> 'Iterator[bytes]':
+    """
+    Yields blocks of about block_size bytes of complete lines of mm[start:end].
+    """
+    position = start
+    while position < end:
+        block_end = mm.find(b"\n", min(position + block_size, end) - 1, end)
+        block_end = end if block_end == -1 else block_end + 1
+        yield mm[position:block_end]
+        position = block_end
+
+
+def _split_block(text : str, prefilter : 're.Pattern[str]|None', idx : int) -> Batch:
+    """
+    Lines of a block of text, where the first one has index idx.
+    """
+    if prefilter is not None:
+        indexes : 'list[int]' = []
+        lines : 'list[str]' = []
+        for i, current_line in read_candidate_lines(io.StringIO(text), prefilter, len(text) + 1, idx):
+            indexes.append(i)
+            lines.append(current_line)
+        return indexes, lines
+    lines = text.split("\n")
+    if text.endswith("\n"):
+        lines.pop()
+    return range(idx, idx + len(lines)), lines
+
+
+def _truncate(batch : Batch, end_index : int) -> Batch:
+    """
+    The lines of a batch with index smaller than end_index.
+    """
+    indexes, lines = batch
+    n = bisect.bisect_left(indexes, end_index)
+    return indexes[:n], lines[:n]
+
+
+def _search_block(block : bytes, prefilter : 're.Pattern[bytes]', idx : int) -> Batch:
+    """
+    Decoded lines of a block of bytes where the prefilter matches.
+    """
+    indexes : 'list[int]' = []
+    lines : 'list[str]' = []
+    counted = 0
+    search = prefilter.search
+    match = search(block)
+    while match is not None:
+        start = block.rfind(b"\n", 0, match.start()) + 1
+        end = block.find(b"\n", match.end())
+        if end == -1:
+            end = len(block)
+        idx += block.count(b"\n", counted, start)
+        counted = start
+        indexes.append(idx)
+        lines.append(block[start:end].decode("utf-8"))
+        match = search(block, end + 1)
+    return indexes, lines
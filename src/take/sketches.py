@@ -0,0 +1,264 @@
+import hashlib
+import math
+
+# default number of values kept exactly before switching to a sketch
+EXACT_SIZE = 100_000
+
+# default size of the sketches (higher is more accurate)
+SKETCH_SIZE = 200
+
+
+class KLLSketch:
+    """
+    KLL sketch (Karnin, Lang, Liberty, "Optimal quantile approximation in
+    streams") of a stream of numbers: a hierarchy of compactors, where the
+    items at height h stand for 2^h values. When a compactor is full its
+    items are sorted and every other one is promoted to the next height,
+    so the memory is O(k) and the rank error about 1.7 / k of the number
+    of values. Sketches can be merged.
+    The compactions alternate between the odd and even items (instead of
+    a random choice) so the results are reproducible. The minimum and the
+    maximum are kept exactly.
+    """
+    def __init__(self, k : int = SKETCH_SIZE) -> None:
+        self.k = max(k, 8)
+        self.compactors : 'list[list[float]]' = []
+        self.offsets : 'list[int]' = []
+        self.size : int = 0 # items in the compactors
+        self.max_size : int = 0
+        self.count : int = 0 # values added
+        self.min : float = math.inf
+        self.max : float = -math.inf
+        self._grow()
+
+    def _grow(self) -> None:
+        self.compactors.append([])
+        self.offsets.append(0)
+        self.max_size = sum(self._capacity(height) for height in range(len(self.compactors)))
+
+    def _capacity(self, height : int) -> int:
+        depth = len(self.compactors) - height - 1
+        return int(math.ceil(self.k * (2 / 3) ** depth)) + 1
+
+    def add(self, value : float) -> None:
+        self.compactors[0].append(value)
+        self.size += 1
+        self.count += 1
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        if self.size >= self.max_size:
+            self._compress()
+
+    def _compress(self) -> None:
+        for height in range(len(self.compactors)):
+            compactor = self.compactors[height]
+            if len(compactor) >= self._capacity(height):
+                if height + 1 >= len(self.compactors):
+                    self._grow()
+                compactor.sort()
+                offset = self.offsets[height]
+                self.offsets[height] = 1 - offset
+                # an odd item out stays at this height
+                end = len(compactor) - len(compactor) % 2
+                self.compactors[height + 1].extend(compactor[offset:end:2])
+                del compactor[:end]
+                self.size = sum(len(c) for c in self.compactors)
+                return
+
+    def merge(self, other : 'KLLSketch') -> None:
+        while len(self.compactors) < len(other.compactors):
+            self._grow()
+        for height, compactor in enumerate(other.compactors):
+            self.compactors[height].extend(compactor)
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.size = sum(len(c) for c in self.compactors)
+        while self.size >= self.max_size:
+            self._compress()
+
+    def quantiles(self, qs : 'list[float]') -> 'list[float]':
+        """
+        Approximate q-quantiles (0 <= q <= 1) of the values.
+        """
+        weighted = sorted((value, 1 << height) for height, compactor in enumerate(self.compactors) for value in compactor)
+        if not weighted:
+            raise ValueError("quantile of no values")
+        total = sum(weight for _, weight in weighted)
+        res : 'list[float]' = []
+        for q in qs:
+            if q <= 0 or q >= 1:
+                res.append(self.min if q <= 0 else self.max)
+                continue
+            target = q * total
+            cumulative = 0
+            value = weighted[-1][0]
+            for item, weight in weighted:
+                cumulative += weight
+                if cumulative >= target:
+                    value = item
+                    break
+            res.append(value)
+        return res
+
+
+class QuantileSketch:
+    """
+    Quantiles of a stream of numbers: the values are kept (and the
+    quantiles are exact) until there are more than exact_size of them,
+    then they are moved to a KLL sketch with parameter k.
+    """
+    def __init__(self, k : int = SKETCH_SIZE, exact_size : int = EXACT_SIZE) -> None:
+        self.k = k
+        self.exact_size = exact_size
+        self.values : 'list[float]|None' = []
+        self.sketch : 'KLLSketch|None' = None
+
+    def add(self, value : float) -> None:
+        if self.values is not None:
+            self.values.append(value)
+            if len(self.values) > self.exact_size:
+                self._to_sketch()
+        else:
+            self.sketch.add(value) # type: ignore
+
+    def _to_sketch(self) -> None:
+        sketch = KLLSketch(self.k)
+        for value in self.values: # type: ignore
+            sketch.add(value)
+        self.values = None
+        self.sketch = sketch
+
+    def merge(self, other : 'QuantileSketch') -> None:
+        if other.values is not None:
+            for value in other.values:
+                self.add(value)
+            return
+        if self.values is not None:
+            self._to_sketch()
+        self.sketch.merge(other.sketch) # type: ignore
+
+    def is_exact(self) -> bool:
+        return self.values is not None
+
+    def quantiles(self, qs : 'list[float]') -> 'list[float]':
+        """
+        q-quantiles (0 <= q <= 1), interpolated between the closest ranks
+        if exact (as the median).
+        """
+        if self.values is None:
+            return self.sketch.quantiles(qs) # type: ignore
+        return exact_quantiles(sorted(self.values), qs)
+
+
+def exact_quantiles(values : 'list[float]', qs : 'list[float]') -> 'list[float]':
+    """
+    Quantiles of sorted values, interpolated between the closest ranks.
+    """
+    if not values:
+        raise ValueError("quantile of no values")
+    res : 'list[float]' = []
+    for q in qs:
+        position = q * (len(values) - 1)
+        low = int(math.floor(position))
+        high = min(low + 1, len(values) - 1)
+        fraction = position - low
+        if fraction == 0:
+            res.append(values[low])
+        else:
+            res.append(values[low] + (values[high] - values[low]) * fraction)
+    return res
+
+
+# default precision of the HyperLogLog sketches
+HLL_PRECISION = 14
+
+
+def hash64(value : str) -> int:
+    """
+    64-bit hash of a string, stable across processes (unlike hash()).
+    """
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8", "surrogatepass"), digest_size=8).digest(), "big")
+
+
+class HyperLogLog:
+    """
+    HyperLogLog sketch (Flajolet et al.) of the number of distinct strings:
+    2^precision registers of one byte, with a relative error of about
+    1.04 / sqrt(2^precision). Sketches with the same precision can be
+    merged.
+    """
+    def __init__(self, precision : int = HLL_PRECISION) -> None:
+        if not 4 <= precision <= 18:
+            raise ValueError("the precision of HyperLogLog must be between 4 and 18")
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, value : str) -> None:
+        x = hash64(value)
+        bits = 64 - self.precision
+        idx = x >> bits
+        # position of the leftmost 1 in the remaining bits
+        rank = bits - (x & ((1 << bits) - 1)).bit_length() + 1
+        if rank > self.registers[idx]:
+            self.registers[idx] = rank
+
+    def merge(self, other : 'HyperLogLog') -> None:
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def estimate(self) -> int:
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -register for register in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros > 0:
+            # linear counting for small cardinalities
+            estimate = m * math.log(m / zeros)
+        return round(estimate)
+
+
+class DistinctSketch:
+    """
+    Number of distinct strings: they are kept in a set (and the count is
+    exact) until there are more than exact_size of them, then they are
+    moved to a HyperLogLog sketch with the given precision.
+    """
+    def __init__(self, precision : int = HLL_PRECISION, exact_size : int = EXACT_SIZE) -> None:
+        self.precision = precision
+        self.exact_size = exact_size
+        self.values : 'set[str]|None' = set()
+        self.sketch : 'HyperLogLog|None' = None
+
+    def add(self, value : str) -> None:
+        if self.values is not None:
+            self.values.add(value)
+            if len(self.values) > self.exact_size:
+                self._to_sketch()
+        else:
+            self.sketch.add(value) # type: ignore
+
+    def _to_sketch(self) -> None:
+        sketch = HyperLogLog(self.precision)
+        for value in self.values: # type: ignore
+            sketch.add(value)
+        self.values = None
+        self.sketch = sketch
+
+    def merge(self, other : 'DistinctSketch') -> None:
+        if other.values is not None:
+            for value in other.values:
+                self.add(value)
+            return
+        if self.values is not None:
+            self._to_sketch()
+        self.sketch.merge(other.sketch) # type: ignore
+
+    def is_exact(self) -> bool:
+        return self.values is not None
+
+    def count(self) -> int:
+        if self.values is not None:
+            return len(self.values)
+        return self.sketch.estimate() # type: ignore
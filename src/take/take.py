@@ -1,16 +1,26 @@
 
 import argparse
-import io
-import matplotlib.pyplot as plt
+import heapq
+import itertools
+import multiprocessing
+import operator
 import os
 import re
+import sys
 import time
 
-from contextlib import redirect_stdout
+from typing import Any, Callable, Iterable, Sequence
 
-from .aggregators import apply_aggregation_function
-from .arguments import parse_arguments
+from .aggregators import Aggregation, apply_aggregation_function
+from .columnar import BatchProgram, StepSpec, join_batches
+from .compression import expand_archives, is_plain
+from .follow import FOLLOW_MAX_WAIT, FOLLOW_MIN_WAIT, FollowedFile
+from .arguments import complete_arguments, parse_arguments
+from .index import INDEX_SUFFIX, LineRange, reverse_range, select_lines
+from .output import OutputWriter
+from .planner import build_prefilter, line_limit, raises_no_errors, uses_line_numbers
 from .predicates import *
+from .reader import Batch, count_newlines, read_batches, read_batches_reverse, split_ranges
 from .utils import *
 
 class MalformedLiteralError(Exception):
@@ -38,12 +48,35 @@ class Literal:
     def __repr__(self):
         return self.__str__()
 
+# called by the print/println steps with the value to print (None if the
+# variable is not bound), whether to add a newline, and whether the value
+# comes from a variable (only these are prefixed by the filename)
+Printer = Callable[['str|None', bool, bool], bool]
+
+
+def compile_print(l : 'Var|Const', with_newline : bool, bound : 'set[int|str]', numeric : 'set[int|str]', printer : Printer) -> Step:
+    """
+    Compile a print/println literal into a step calling the printer.
+    """
+    if isinstance(l, Const):
+        value = l.value
+        return lambda frame: printer(value, with_newline, False)
+    if l.key not in bound:
+        return lambda frame: printer(None, with_newline, True)
+    slot = l.key
+    if slot in numeric:
+        # numbers are converted to text only when printed
+        return lambda frame: printer(str(frame[slot]), with_newline, True)
+    return lambda frame: printer(frame[slot], with_newline, True)
+
+
 class Command:
-    def __init__(self, command_line : str, colored_output : bool = True) -> None:
+    def __init__(self, command_line : str, colored_output : bool = True, warn : bool = True) -> None:
         self.command_line = command_line
         self.literals : 'list[Literal]' = []
-        self.variables_dict : 'dict[str,str|None]' = {} # to store variable instantiations
+        self.variables_dict : 'dict[str,int]' = {} # variable name -> slot in the binding frame
         self.colored_output = colored_output
+        self.warn = warn # print the warnings about the command
         self.parse()
         self.check_negation()
 
@@ -52,7 +85,7 @@ class Command:
         Check if the command line contains negated literals.
         """
         for literal in self.literals:
-            if literal.is_negated and literal.name in ["line", "print", "println"]:
+            if literal.is_negated and literal.name in ["line", "print", "println"] and self.warn:
                 if self.colored_output:
                     print(f"{bcolors.WARNING}[WARNING]{bcolors.ENDC}:", end=' ')
                 else:
@@ -121,6 +154,9 @@ class Command:
             args = self.split_by_commas(raw_args) if raw_args else []
             if name not in PREDICATES:
                 raise LiteralNotFoundError(f"Predicate '{name}' not implemented.")
+            elif name in VARIADIC_PREDICATES:
+                if len(args) < PREDICATES[name]:
+                    raise LiteralNotFoundError(f"Predicate '{name}' expects at least {PREDICATES[name]} arguments, got {len(args)}.")
             else:
                 if len(args) != PREDICATES[name]:
                     raise LiteralNotFoundError(f"Predicate '{name}' expects {PREDICATES[name]} arguments, got {len(args)}.")
@@ -148,51 +184,611 @@ class Command:
         
             # raise MalformedLiteralError()
 
-        variables = list(set([arg for lit in self.literals for arg in lit.args if arg[0].isupper()]))
-        self.variables_dict = {var: None for var in variables} 
+        # number the variables in order of appearance
+        for lit in self.literals:
+            for arg in lit.args:
+                if is_variable(arg) and arg not in self.variables_dict:
+                    self.variables_dict[arg] = FIRST_VARIABLE_SLOT + len(self.variables_dict)
 
         # check singleton variables (i.e., variables appearing only once in the command)
         for var in self.variables_dict:
-            if sum(var in lit.args for lit in self.literals) == 1:
+            if sum(var in lit.args for lit in self.literals) == 1 and self.warn:
                 print(f"{get_warning_prefix(not self.colored_output)} variable '{var}' appears only once in the command.")
 
 
-def plot(data : 'list[tuple[str,str]]', uncolored : bool, keep_separated : bool) -> None:
+class Program:
+    """
+    Plan of all the commands of an invocation over a single binding frame.
+    Literals computing the same value in different commands (the same
+    predicate over the same inputs, such as a common prefix
+    line(L), split_select(L,tab,1,T), strip(T,T1)) are compiled into a
+    single step, so the commands form a DAG of steps instead of
+    independent lists. Each command is a path of steps: the ones shared by
+    more than one command are evaluated at most once per line, and their
+    result is reused by the following commands, which are still evaluated
+    in their order so the output does not change.
+    """
+    def __init__(self, commands : 'list[Command]', printer : Printer) -> None:
+        self.steps : 'list[Step]' = []
+        # literal of each step, with the variables bound and numeric
+        # before it (to compile the step for another engine)
+        self.specs : 'list[StepSpec]' = []
+        # for each command, the steps in evaluation order
+        self.paths : 'list[list[Step]]' = []
+        self.node_paths : 'list[list[int]]' = []
+        # results of the shared steps on the current line (None if not
+        # evaluated yet), cleared with reset() before each line
+        self.memo : 'list[bool|None]' = []
+        self.frame : 'list[Any]' = []
+        self.compile(commands, printer)
+
+    def compile(self, commands : 'list[Command]', printer : Printer) -> None:
+        """
+        Value numbering over the literals of the commands: a slot of the
+        frame is written by a single step, so a step is identified by its
+        predicate, negation, and arguments (constants or slots), and the
+        output variable of a step already present is mapped to its slot.
+        """
+        steps_by_key : 'dict[tuple[Any,...],int]' = {}
+        outputs : 'list[list[int]]' = [] # step index -> slots bound by the step
+        numeric : 'set[int|str]' = {INDEX_SLOT}
+        n_slots = FIRST_VARIABLE_SLOT
+        node_paths : 'list[list[int]]' = []
+        for command in commands:
+            slots : 'dict[str,int]' = {}
+            bound : 'set[int|str]' = {LINE_SLOT, INDEX_SLOT}
+            path : 'list[int]' = []
+            for literal in command.literals:
+                key : 'list[Any]' = [literal.name, literal.is_negated]
+                # unbound variables bound by the step
+                output_args : 'list[str]' = []
+                output_positions_ = output_positions(literal.name, len(literal.args))
+                for position, arg in enumerate(literal.args):
+                    if not is_variable(arg):
+                        key.append(('const', arg))
+                    elif arg in slots and slots[arg] in bound:
+                        key.append(('slot', slots[arg]))
+                    elif position in output_positions_:
+                        if arg not in output_args:
+                            output_args.append(arg)
+                        key.append(('output', output_args.index(arg)))
+                    else:
+                        # an unbound input: the step only raises an error
+                        key.append(('unbound', len(node_paths), arg))
+                if literal.name in ["print", "println"]:
+                    # the printer has side effects: never shared
+                    node = None
+                else:
+                    node = steps_by_key.get(tuple(key))
+                if node is None:
+                    out_slots = list(range(n_slots, n_slots + len(output_args)))
+                    n_slots += len(output_args)
+                    for arg in literal.args:
+                        if is_variable(arg) and arg not in slots and arg not in output_args:
+                            slots[arg] = n_slots
+                            n_slots += 1
+                    for arg, slot in zip(output_args, out_slots):
+                        slots[arg] = slot
+                    operands = [Var(slots[arg], arg) if is_variable(arg) else Const(arg) for arg in literal.args]
+                    self.specs.append((literal.name, operands, literal.is_negated, frozenset(bound), frozenset(numeric)))
+                    if literal.name in ["print", "println"]:
+                        step = compile_print(operands[0], literal.name == "println", bound, numeric, printer)
+                    else:
+                        step = compile_literal(literal.name, operands, literal.is_negated, bound, numeric)
+                        if literal.name in NUMERIC_RESULTS:
+                            numeric.update(out_slots)
+                        steps_by_key[tuple(key)] = len(self.steps)
+                    node = len(self.steps)
+                    self.steps.append(step)
+                    outputs.append(out_slots)
+                else:
+                    for arg, slot in zip(output_args, outputs[node]):
+                        slots[arg] = slot
+                bound.update(outputs[node])
+                if node not in path:
+                    # a repeated literal has already succeeded
+                    path.append(node)
+            node_paths.append(path)
+
+        uses = [0] * len(self.steps)
+        for path in node_paths:
+            for node in path:
+                uses[node] += 1
+        steps = list(self.steps)
+        for node, count in enumerate(uses):
+            if count > 1:
+                steps[node] = self._memoized(self.steps[node], len(self.memo))
+                self.memo.append(None)
+        self.paths = [[steps[node] for node in path] for path in node_paths]
+        self.node_paths = node_paths
+        self.frame = [None] * n_slots
+
+    def _memoized(self, step : Step, index : int) -> Step:
+        memo = self.memo
+        def shared_step(frame : Frame) -> bool:
+            result = memo[index]
+            if result is None:
+                result = memo[index] = step(frame)
+            return result
+        return shared_step
+
+    def reset(self) -> None:
+        """
+        Forget the results of the shared steps: called before each line.
+        """
+        memo = self.memo
+        for i in range(len(memo)):
+            memo[i] = None
+
+
+def plot(data : 'dict[str|None, list[str]]', uncolored : bool, keep_separated : bool) -> None:
     """
-    Placeholder for a plotting function.
+    Plot the printed values, one line for each file if keep_separated
+    (data is grouped by file in this case).
     """
-    if not keep_separated:
-        x_axis = list(range(len(data)))
-        y_axis = [float(d[1]) for d in data]
+    # imported here since it takes longer than most of the runs
+    import matplotlib.pyplot as plt
+    for filename, values in data.items():
+        y_axis = [float(value) for value in values]
+        x_axis = list(range(len(y_axis)))
         try:
-            plt.plot(x_axis, y_axis)  # type: ignore
-        except Exception as e:
-            print(f"{get_error_prefix(uncolored)} Error plotting data: {e}")
-        # plt.legend(["data"])
-    else:
-        filenames = set(line[0] for line in data)
-        for filename in filenames:
-            y_axis = [float(line[1]) for line in data if line[0] == filename]
-            x_axis = list(range(len(y_axis)))
-            try:
+            if keep_separated:
                 plt.plot(x_axis, y_axis, label=filename)  # type: ignore
-            except Exception as e:
+            else:
+                plt.plot(x_axis, y_axis)  # type: ignore
+        except Exception as e:
+            if keep_separated:
                 print(f"{get_error_prefix(uncolored)} Error plotting data for {filename}: {e}")
+            else:
+                print(f"{get_error_prefix(uncolored)} Error plotting data: {e}")
+    if keep_separated:
         plt.legend()  # type: ignore
     plt.show()  # type: ignore
 
 
-def apply_sequence_commands(args : argparse.Namespace) -> 'list[tuple[str,str]]':
+class Scanner:
+    """
+    Evaluates the commands on the lines of the files: the printed values
+    are written by an OutputWriter, added to the state of the aggregation
+    functions (if aggregate), grouped by file (if the files are kept
+    separated) in plot_data (if plot), and stored in results with their
+    file (if record_results, to send them from a worker process).
+    The warnings about the commands are printed only if warn.
+    """
+    def __init__(self, args : argparse.Namespace, writer : OutputWriter, aggregate : bool, plot : bool, record_results : bool = False, warn : bool = True) -> None:
+        self.writer = writer
+        self.write_output : bool = not args.suppress_output
+        self.with_filename : bool = args.with_filename
+        self.record_results : bool = record_results
+        self.results : 'list[tuple[str,str]]' = []
+        self.plot_data : 'dict[str|None, list[str]]|None' = {} if plot else None
+        self.args = args
+        self.keep_separated : bool = args.keep_separated
+        self.aggregation : 'Aggregation|None' = Aggregation(args) if aggregate else None
+        self.file_name : 'str|None' = None
+        self.processed : bool = False # true if something was printed for the current line
+        self.already_printed_filename : bool = False
+        self.count : int = 0 # lines of the current file that printed something
+        self.commands : 'list[Command]' = [Command(cmd, colored_output=not args.uncolored, warn=warn) for cmd in args.command]
+        # literals shared by the commands are evaluated once per line
+        self.program = Program(self.commands, self.printer)
+        # lines that cannot be printed by any command are skipped in blocks
+        self.prefilter = build_prefilter(self.commands)
+        # lines after which no command prints anything (if not None)
+        self.line_limit = line_limit(self.commands)
+        # the lines are counted to number them backwards only if needed
+        self.line_numbers : bool = uses_line_numbers(self.commands)
+        self.reverse : bool = args.reverse
+        # with no output, the scan stops when the results of the
+        # aggregation functions cannot change anymore (if no error could
+        # be raised by the following lines)
+        self.stop_when_complete : bool = self.aggregation is not None and args.suppress_output and not plot and not record_results and self.aggregation.complete_after_first and raises_no_errors(self.commands)
+        self.complete : bool = False
+        self.batch_program : 'BatchProgram|None' = None
+        self.batch_size : int = args.batch_size
+        if args.engine == "columnar":
+            self.batch_program = BatchProgram(self.program.specs, self.program.node_paths)
+
+    def printer(self, value : 'str|None', with_newline : bool, from_variable : bool) -> bool:
+        self.processed = True
+        if value is None:
+            return True
+        if self.write_output:
+            self.writer.write_value(value, with_newline, self.file_name if self.with_filename and from_variable else None, self.already_printed_filename)
+            self.already_printed_filename = True
+        if (self.record_results or self.aggregation is not None or self.plot_data is not None) and value.strip() != "":
+            # do not limit the length here
+            self.add_result(self.file_name, value + "\n" if with_newline else value) # type: ignore
+        return True
+
+    def add_result(self, filename : str, value : str) -> None:
+        if self.record_results:
+            self.results.append((filename, value))
+        if self.plot_data is not None:
+            key = filename if self.keep_separated else None
+            values = self.plot_data.get(key)
+            if values is None:
+                values = self.plot_data[key] = []
+            values.append(value)
+        if self.aggregation is not None:
+            self.aggregation.add(filename, value)
+
+    def scan(
+            self,
+            filename : str,
+            max_count : int = 0,
+            matches : 'list[Match]|None' = None,
+            byte_range : 'tuple[int,int]|None' = None,
+            first_index : int = 0
+        ) -> None:
+        """
+        Evaluate the commands on the lines of a file, stopping before a
+        line if max_count lines (if > 0) already printed something.
+        If matches is not None, the output and the results of each line
+        that printed something are moved into it, as a separate Match.
+        If byte_range is not None, only the lines in that range of the
+        file are evaluated, and the first one has index first_index.
+        With reverse, the lines are evaluated from the last one.
+        The lines after the line limit of the commands are not read, and
+        the scan stops when the aggregation is complete (see Aggregation.
+        is_complete) if stop_when_complete.
+        """
+        self.file_name = filename
+        self.count = 0
+        self.complete = False
+        if self.reverse:
+            byte_range, end_index = reverse_range(filename, byte_range, first_index, self.line_limit, self.line_numbers, self.args.index)
+            batches = read_batches_reverse(filename, self.prefilter, byte_range, end_index)
+        else:
+            batches = read_batches(filename, self.prefilter, byte_range, first_index, end_index=self.line_limit)
+        try:
+            if self.batch_program is None:
+                for indexes, lines in batches:
+                    if not self.scan_lines(indexes, lines, max_count, matches):
+                        return
+            else:
+                for indexes, lines in join_batches(batches, self.batch_size):
+                    if self.count >= max_count and max_count > 0:
+                        return
+                    if not self.scan_columns(indexes, lines, max_count, matches):
+                        return
+        finally:
+            batches.close()
+
+    def scan_appended(self, filename : str, batches : 'Iterable[Batch]', max_count : int = 0) -> bool:
+        """
+        Evaluate the commands on the batches of lines appended to a file
+        (with --follow), one line at a time. Returns False if max_count
+        lines printed something or the aggregation is complete.
+        """
+        self.file_name = filename
+        self.count = 0
+        self.complete = False
+        for indexes, lines in batches:
+            if not self.scan_lines(indexes, lines, max_count, None):
+                return False
+        return True
+
+    def scan_lines(self, indexes : 'Sequence[int]', lines : 'list[str]', max_count : int, matches : 'list[Match]|None') -> bool:
+        """
+        Evaluate the commands on a batch of lines, one line at a time.
+        Returns False if max_count lines printed something.
+        """
+        program = self.program
+        frame = program.frame
+        for idx, current_line in zip(indexes, lines):
+            if self.count >= max_count and max_count > 0:
+                return False
+            self.processed = False
+            frame[LINE_SLOT] = current_line
+            frame[INDEX_SLOT] = idx
+            if program.memo:
+                program.reset()
+            for path in program.paths:
+                self.already_printed_filename = False
+                for step in path:
+                    if not step(frame):
+                        break
+            if self.processed and not self.end_line(matches):
+                return False
+        return True
+
+    def scan_columns(self, indexes : 'list[int]', lines : 'list[str]', max_count : int, matches : 'list[Match]|None') -> bool:
+        """
+        Evaluate the commands on a batch of lines with the columnar engine,
+        then print the values in the order of the lines. If a step raises
+        an error, the batch is evaluated again one line at a time, so the
+        lines before the error are printed as in the row engine.
+        Returns False if max_count lines printed something.
+        """
+        try:
+            events = self.batch_program.run(indexes, lines) # type: ignore
+        except Exception:
+            return self.scan_lines(indexes, lines, max_count, matches)
+        if len(events) == 1:
+            _, _, values, with_newline, from_variable = events[0]
+            for value in values:
+                if self.count >= max_count and max_count > 0:
+                    return False
+                self.already_printed_filename = False
+                self.printer(value, with_newline, from_variable)
+                if not self.end_line(matches):
+                    return False
+            return True
+        # the values of each line, in the order of the commands (the
+        # positions decrease with reverse)
+        current : 'int|None' = None
+        current_command = -1
+        for position, event, value in heapq.merge(*[zip(map(operator.neg, positions) if self.reverse else positions, itertools.repeat(i), values) for i, (_, positions, values, _, _) in enumerate(events)]):
+            command, _, _, with_newline, from_variable = events[event]
+            if position != current:
+                if current is not None and not self.end_line(matches):
+                    return False
+                if self.count >= max_count and max_count > 0:
+                    return False
+                current = position
+                current_command = -1
+            if command != current_command:
+                self.already_printed_filename = False
+                current_command = command
+            self.printer(value, with_newline, from_variable)
+        if current is not None:
+            return self.end_line(matches)
+        return True
+
+    def end_line(self, matches : 'list[Match]|None') -> bool:
+        """
+        Count a line that printed something. Returns False if the scan
+        can stop since the aggregation is complete.
+        """
+        self.count += 1
+        if matches is not None:
+            matches.append(self.take_match(True))
+        if self.stop_when_complete and self.aggregation.is_complete(self.file_name): # type: ignore
+            self.complete = True
+            return False
+        return True
+
+    def take_match(self, counted : bool) -> 'Match':
+        """
+        Move out the output buffered by the writer and the results.
+        """
+        match = (self.writer.drain(), self.results, counted)
+        self.results = []
+        return match
+
+    def take_aggregation(self) -> 'Aggregation|None':
+        """
+        Move out the state of the aggregation functions.
+        """
+        aggregation = self.aggregation
+        if aggregation is not None:
+            self.aggregation = Aggregation(self.args)
+        return aggregation
+
+
+# output, recorded values, and whether the match counts for -m (i.e., it
+# is the output of a single line) of a part of a file processed by a worker
+Match = tuple[str, 'list[tuple[str,str]]', bool]
+
+# scanner of the current worker process, built by _init_worker
+_worker_scanner : 'Scanner|None' = None
+_worker_args : 'argparse.Namespace|None' = None
+
+def _init_worker(args : argparse.Namespace) -> None:
+    global _worker_scanner, _worker_args
+    # the output is returned to the main process, never written here
+    writer = OutputWriter(args.uncolored, args.max_columns, buffer_size=sys.maxsize)
+    # -m limits the number of matches over all the files (or over all
+    # the parts of a file with -ks), so the main process needs them one
+    # by one, with their values; otherwise the workers return the partial
+    # state of the aggregation functions
+    split = args.max_count > 0
+    # the warnings about the commands were printed by the main process
+    _worker_scanner = Scanner(args, writer, bool(args.aggregate) and not split, False, args.plot or (bool(args.aggregate) and split), warn=False)
+    _worker_args = args
+
+# a file, or a range of bytes of a file with the index of its first line
+Job = tuple[str, 'tuple[int,int]|None', int]
+
+def _scan_job(job : Job) -> 'tuple[list[Match], Aggregation|None, str|None]':
+    """
+    Process a file (or a part of it) in a worker: returns the matches, the
+    accumulators of the aggregation functions, and the error that stopped
+    the processing, if any.
+    """
+    assert _worker_scanner is not None and _worker_args is not None
+    filename, byte_range, first_index = job
+    split = _worker_args.max_count > 0
+    matches : 'list[Match]' = []
+    error : 'str|None' = None
+    try:
+        _worker_scanner.scan(filename, _worker_args.max_count, matches if split else None, byte_range, first_index)
+    except Exception as e:
+        error = str(e)
+    matches.append(_worker_scanner.take_match(False))
+    return matches, _worker_scanner.take_aggregation(), error
+
+def _count_lines_job(job : 'tuple[str,int,int]') -> int:
+    return count_newlines(*job)
+
+def _build_jobs(filenames : 'list[str]', chunk_size : int, line_numbers : bool, pool : Any, line_range : 'LineRange|None' = None, use_index : bool = False) -> 'list[Job]':
+    """
+    Split the files (or their lines in line_range) larger than chunk_size
+    into ranges of lines. If the commands use the line numbers, the index
+    of the first line of each range is taken from the index of the file
+    (if use_index), otherwise the lines of the ranges are counted (in
+    parallel).
+    """
+    # the index of the first line of a range is None if not known
+    ranges : 'list[tuple[str,tuple[int,int]|None,int|None]]' = []
+    for filename in filenames:
+        try:
+            byte_range, first_index, index = select_lines(filename, line_range, use_index)
+            start, end = byte_range if byte_range is not None else (0, os.path.getsize(filename))
+            large = chunk_size > 0 and end - start > chunk_size and is_plain(filename)
+        except OSError:
+            # the error is reported when the file is processed
+            ranges.append((filename, None, 0))
+            continue
+        if large and index is not None:
+            ranges.extend((filename, part, part_index) for part, part_index in index.split_ranges(chunk_size, (start, end), first_index))
+        elif large:
+            parts = split_ranges(filename, chunk_size, byte_range)
+            ranges.append((filename, parts[0], first_index))
+            ranges.extend((filename, part, None) for part in parts[1:])
+        else:
+            ranges.append((filename, byte_range, first_index))
+    if not line_numbers:
+        return [(filename, byte_range, first_index or 0) for filename, byte_range, first_index in ranges]
+    # the ranges followed by one with an unknown first line
+    counted = [(filename, *byte_range) for (filename, byte_range, _), (_, _, following) in zip(ranges, ranges[1:]) if following is None] # type: ignore
+    counts = iter(pool.map(_count_lines_job, counted))
+    jobs : 'list[Job]' = []
+    next_index = 0
+    for k, (filename, byte_range, first_index) in enumerate(ranges):
+        if first_index is None:
+            first_index = next_index
+        jobs.append((filename, byte_range, first_index))
+        if k + 1 < len(ranges) and ranges[k + 1][2] is None:
+            # prefix sum of the lines of the ranges of the file
+            next_index = first_index + next(counts)
+    return jobs
+
+
+def follow_files(args : argparse.Namespace, scanner : Scanner, writer : OutputWriter, print_error : 'Callable[[str, str|None], None]') -> None:
+    """
+    Process the files (their lines in args.lines), then the lines appended
+    to them (see FollowedFile): the files are polled, waiting from
+    FOLLOW_MIN_WAIT to FOLLOW_MAX_WAIT seconds (doubling the wait after
+    each poll without new lines), until the process is interrupted or no
+    line is appended for args.idle_timeout seconds (if > 0). The results
+    of the aggregation functions are printed every args.interval seconds
+    (if > 0 and new values were printed). A file is not followed if its selected lines end before the
+    end of the file, if it is compressed (see compression.is_plain), or if
+    the commands raise an error on its lines.
+    """
+    # lines that printed something, over all the files (for each file
+    # with -ks)
+    counts : 'dict[str|None, int]' = {}
+    def remaining(filename : str) -> int:
+        return args.max_count - counts.get(filename if args.keep_separated else None, 0) if args.max_count > 0 else 0
+    def counted(filename : str, following : bool) -> bool:
+        """
+        Add the lines of the last scan. Returns False if the file (all of
+        them without -ks) should not be followed anymore.
+        """
+        key = filename if args.keep_separated else None
+        counts[key] = counts.get(key, 0) + scanner.count
+        return following and not scanner.complete and not (args.max_count > 0 and counts[key] >= args.max_count)
+
+    followed : 'list[FollowedFile]' = []
+    stop = False
+    for filename in args.filename:
+        file = FollowedFile(filename, scanner.prefilter)
+        if not is_plain(filename):
+            try:
+                scanner.scan(filename, remaining(filename), None)
+                stop = not counted(filename, True) and not args.keep_separated
+            except Exception as e:
+                print_error(filename, str(e))
+            if stop:
+                break
+            continue
+        try:
+            file.open()
+        except OSError as e:
+            # followed until it is created
+            print_error(filename, str(e))
+            followed.append(file)
+            continue
+        try:
+            byte_range, first_index, _ = select_lines(filename, args.lines, args.index)
+            size = os.fstat(file.fp.fileno()).st_size # type: ignore
+            start, end = byte_range if byte_range is not None else (0, size)
+            if end >= size:
+                # the last line is read when complete
+                end = file.complete_end(start, size)
+                file.seek(end, first_index + count_newlines(filename, start, end) if scanner.line_numbers else 0)
+                followed.append(file)
+            scanner.scan(filename, remaining(filename), None, (start, end), first_index)
+            if not counted(filename, True):
+                if file in followed:
+                    followed.remove(file)
+                stop = not args.keep_separated
+        except Exception as e:
+            print_error(filename, str(e))
+            if file in followed:
+                followed.remove(file)
+        if file not in followed:
+            file.close()
+        if stop:
+            break
+    writer.flush()
+
+    wait = FOLLOW_MIN_WAIT
+    now = time.monotonic()
+    last_line = now
+    next_report = now + args.interval
+    reported = 0 # values aggregated at the last report
+    try:
+        while followed and not stop:
+            appended = False
+            for file in list(followed):
+                received = file.received
+                try:
+                    following = counted(file.filename, scanner.scan_appended(file.filename, file.batches(), remaining(file.filename)))
+                except Exception as e:
+                    print_error(file.filename, str(e))
+                    following = False
+                appended = appended or file.received != received
+                if not following:
+                    followed.remove(file)
+                    file.close()
+                    if not args.keep_separated:
+                        stop = True
+                        break
+            writer.flush()
+            now = time.monotonic()
+            if args.interval > 0 and now >= next_report:
+                if scanner.aggregation is not None and scanner.aggregation.count != reported:
+                    writer.sync()
+                    apply_aggregation_function(scanner.aggregation, args)
+                    sys.stdout.flush()
+                    reported = scanner.aggregation.count
+                next_report = now + args.interval
+            if appended:
+                last_line = now
+                wait = FOLLOW_MIN_WAIT
+                continue
+            if args.idle_timeout > 0 and now - last_line >= args.idle_timeout:
+                # the last lines without a newline
+                for file in followed:
+                    if not counted(file.filename, scanner.scan_appended(file.filename, file.batches(final=True), remaining(file.filename))) and not args.keep_separated:
+                        break
+                break
+            delay = wait
+            if args.interval > 0:
+                delay = min(delay, next_report - now)
+            if args.idle_timeout > 0:
+                delay = min(delay, last_line + args.idle_timeout - now)
+            time.sleep(max(delay, 0))
+            wait = min(wait * 2, FOLLOW_MAX_WAIT)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for file in followed:
+            file.close()
+
+
+def apply_sequence_commands(args : argparse.Namespace) -> 'tuple[dict[str|None, list[str]], Aggregation|None]':
     """
     Apply a sequence of commands to the input file.
+    Returns the printed values to plot, grouped by file if they are kept
+    separated (empty if not plotted), and the state of the aggregation
+    functions (if any).
     """
-    aggregate_lines : 'list[tuple[str,str]]' = []
-    c_list : 'list[Command]' = [Command(cmd, colored_output=not args.uncolored) for cmd in args.command]
-    count_processed : int = 0
-    processed : bool = False
-    stop_loop : bool = False
-    context : 'list[str]' = []
-    printed_warning : bool = False
+    complete_arguments(args)
 
     # explores recursively the directories if the -r option is set
     if args.recursive:
@@ -203,7 +799,8 @@ def apply_sequence_commands(args : argparse.Namespace) -> 'list[tuple[str,str]]'
                 w = os.walk(f)
                 for root, _, filenames in w:
                     for filename in filenames:
-                        files.append(os.path.join(root, filename))
+                        if not filename.endswith(INDEX_SUFFIX):
+                            files.append(os.path.join(root, filename))
             elif os.path.isfile(f):
                 files.append(f)
         args.filename = files
@@ -214,84 +811,108 @@ def apply_sequence_commands(args : argparse.Namespace) -> 'list[tuple[str,str]]'
             if ignore in args.filename:
                 args.filename.remove(ignore)
 
-
-    for filename in args.filename:
-        if stop_loop:
-            break
-        try:
+    # the members of the archives are processed as separate files
+    args.filename = expand_archives(args.filename)
+
+    # when writing to a terminal, show each match immediately
+    writer = OutputWriter(
+        args.uncolored,
+        args.max_columns,
+        buffer_size=0 if sys.stdout.isatty() else args.output_buffer,
+        threaded=args.threaded_output
+    )
+    scanner = Scanner(args, writer, bool(args.aggregate), args.plot)
+
+    def print_error(filename : str, error : 'str|None') -> None:
+        writer.sync()
+        print(f"{get_error_prefix(args.uncolored)} processing file {filename}")
+        if args.debug:
+            print(f"Error: {error}")
+
+    # number of lines that printed something, over all the files
+    # (for each file with -ks)
+    count_processed : int = 0
+    jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+    if args.follow:
+        follow_files(args, scanner, writer, print_error)
+    elif jobs > 1 and (len(args.filename) > 1 or (args.chunk_size > 0 and any(os.path.isfile(f) and os.path.getsize(f) > args.chunk_size for f in args.filename))):
+        with multiprocessing.Pool(jobs, initializer=_init_worker, initargs=(args,)) as pool:
+            job_list = _build_jobs(args.filename, args.chunk_size, scanner.line_numbers, pool, args.lines, args.index)
+            if args.reverse:
+                # each part is read backwards by its worker
+                job_list.reverse()
+            previous : 'str|None' = None
+            failed : bool = False # true if the processing of the current file stopped
+            # the files (and their parts) are consumed in order while the
+            # following ones are processed by the other workers
+            for (filename, _, _), (matches, partial, error) in zip(job_list, pool.imap(_scan_job, job_list)):
+                if filename != previous:
+                    previous = filename
+                    failed = False
+                    if args.keep_separated:
+                        count_processed = 0
+                limit_reached = count_processed >= args.max_count and args.max_count > 0
+                if limit_reached and not args.keep_separated:
+                    break
+                if failed or limit_reached:
+                    continue
+                for text, results, counted in matches:
+                    if count_processed >= args.max_count and args.max_count > 0 and counted:
+                        break
+                    writer.write(text)
+                    for result in results:
+                        scanner.add_result(*result)
+                    count_processed += counted
+                if partial is not None and scanner.aggregation is not None:
+                    scanner.aggregation.merge(partial)
+                if error is not None:
+                    print_error(filename, error)
+                    failed = True
+                if scanner.stop_when_complete and scanner.aggregation.is_complete(filename): # type: ignore
+                    if not args.keep_separated:
+                        break
+                    failed = True
+    else:
+        for filename in reversed(args.filename) if args.reverse else args.filename:
             if args.keep_separated:
                 count_processed = 0 # keep separated: process at most args.max_count lines per file
-                processed = False
-            with open(filename, "r") as fp:
-                for idx, current_line in enumerate(fp):
-                    if processed:
-                        count_processed += 1
-                    processed = False
-                    if count_processed >= args.max_count and args.max_count > 0:
-                        if not args.keep_separated:
-                            stop_loop = True
-                        break
-                    current_line = current_line.rstrip('\n')
-                    for c in c_list:
-                        already_printed_filename = False
-                        c.variables_dict = {var: None for var in c.variables_dict}
-                        for command in c.literals:
-                            res = False
-                            if command.name == "line":
-                                res = line(current_line, command.args[0], c.variables_dict)
-                            elif command.name == "print" or command.name == "println":
-                                processed = True
-                                if not args.suppress_output:
-                                    file_name = filename if args.with_filename else None
-                                    res = print_line(command.args[0], c.variables_dict, with_newline=command.name == "println", filename=file_name, uncolored_output=args.uncolored, max_columns=args.max_columns, already_printed_filename=already_printed_filename)
-                                    already_printed_filename = True
-                                with io.StringIO() as buf, redirect_stdout(buf):
-                                    print_line(command.args[0], c.variables_dict, with_newline=command.name == "println") # do not limit the length here
-                                    gv : str = buf.getvalue()
-                                    if gv.strip() != "":
-                                        aggregate_lines.append((filename,gv))
-                            elif command.name == "line_number":
-                                res = line_number(command.args[0], command.args[1], idx, c.variables_dict, command.is_negated)
-                            # arity 2 predicates
-                            # elif command.name in ["startswith","endswith","length","lt","leq","gt"]:
-                            elif command.name in [k for k in PREDICATES if PREDICATES[k] == 2]:
-                                fn =  globals()[command.name]
-                                res = fn(command.args[0], command.args[1], c.variables_dict, command.is_negated)
-                            elif command.name in [k for k in PREDICATES if PREDICATES[k] == 3]:
-                                fn =  globals()[command.name]
-                                res = fn(command.args[0], command.args[1], command.args[2], c.variables_dict, command.is_negated)
-                            elif command.name in [k for k in PREDICATES if PREDICATES[k] == 4]:
-                                fn =  globals()[command.name]
-                                res = fn(command.args[0], command.args[1], command.args[2], command.args[3], c.variables_dict, command.is_negated)
-                            
-                            if not res:
-                                break
-        except Exception as e:
-            print(f"{get_error_prefix(args.uncolored)} processing file {filename}")
-            if args.debug:
-                print(f"Error: {e}")
+            elif count_processed >= args.max_count and args.max_count > 0:
+                break
+            scanner.count = 0
+            try:
+                byte_range, first_index, _ = select_lines(filename, args.lines, args.index)
+                scanner.scan(filename, args.max_count - count_processed if args.max_count > 0 else 0, None, byte_range, first_index)
+            except Exception as e:
+                print_error(filename, str(e))
+            count_processed += scanner.count
+            if scanner.complete and not args.keep_separated:
+                break
+
+    writer.close()
 
-    return aggregate_lines    
+    return scanner.plot_data or {}, scanner.aggregation
 
 
 def loop_process(args : 'argparse.Namespace'):
     """
     Main loop.
     """
+    complete_arguments(args)
     start_time = time.time()
-    data_lines = apply_sequence_commands(args)
+    plot_data, aggregation = apply_sequence_commands(args)
     end_time = time.time()
     elapsed_time_file_analysis = end_time - start_time
 
-    if args.aggregate:
-        apply_aggregation_function(data_lines, args)
+    if aggregation is not None:
+        apply_aggregation_function(aggregation, args)
+        aggregation.close()
 
     if args.stats:
         print(f"Elapsed time for file analysis: {elapsed_time_file_analysis:.2f} s.")
 
     if args.plot:
-        if len(data_lines) > 0:
-            plot(data_lines, args.uncolored, args.keep_separated)
+        if len(plot_data) > 0:
+            plot(plot_data, args.uncolored, args.keep_separated)
         else:
             if args.uncolored:
                 print("[WARNING]:", end=' ')
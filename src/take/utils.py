@@ -31,30 +31,16 @@ def is_float(s : str) -> bool:
             return False
     return False
 
-def wrap_sort(aggregate_lines : 'list[tuple[str,str]]', filename : str | None, reverse : bool) -> 'list[str | int | float]':
+def parse_number(v : str) -> 'int | float | None':
     """
-    This function is used to sort the lines of a file.
-    It returns a list of strings that can be sorted.
+    This function is used to sort the printed values: v as an int, or as
+    a float, or None if it is not a number.
     """
-    if filename is not None:
-        data_lines = [line[1] for line in aggregate_lines if line[0] == filename]
-    else:
-        data_lines = [line[1] for line in aggregate_lines]
-    new_data : 'list[str|int|float]' = []
-    all_numbers : bool = True
-    for v in data_lines:
-        if is_int(v):
-            new_data.append(int(v))
-        elif is_float(v):
-            new_data.append(float(v))
-        else:
-            all_numbers = False
-            break
-
-    if not all_numbers:
-        new_data = data_lines
-    
-    return sorted(new_data, reverse=reverse)
+    if is_int(v):
+        return int(v)
+    if is_float(v):
+        return float(v)
+    return None
 
 def get_error_prefix(uncolored : bool) -> str:
     if uncolored:
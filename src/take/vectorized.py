@@ -0,0 +1,99 @@
+from array import array
+from typing import Any
+
+# NumPy is optional: without it the aggregation functions update their
+# state one value at a time
+try:
+    import numpy as np
+except ImportError: # pragma: no cover
+    np = None
+
+HAS_NUMPY : bool = np is not None
+
+# numbers buffered before being reduced together
+VECTOR_BLOCK = 1 << 16
+
+# integers up to this value are exact as doubles
+MAX_EXACT_INT = 1 << 53
+
+
+def as_array(values : 'array[float]') -> Any:
+    """
+    The buffered numbers as a NumPy array (without copying them).
+    """
+    return np.frombuffer(values, dtype=np.float64)
+
+
+def block_moments(block : Any) -> 'tuple[float, float]':
+    """
+    Mean and sum of squared deviations of the numbers of a block.
+    """
+    mean = float(block.mean())
+    deviations = block - mean
+    return mean, float(deviations @ deviations)
+
+
+def block_product(block : Any) -> float:
+    """
+    Product of the numbers of a block, up to the first 0 (included), as
+    if they were multiplied one at a time until the product is 0.
+    """
+    zeros = np.flatnonzero(block == 0)
+    with np.errstate(all="ignore"):
+        if len(zeros) > 0:
+            return float(np.prod(block[:zeros[0]])) * 0.0
+        return float(np.prod(block))
+
+
+def block_extreme(block : Any, largest : bool) -> 'tuple[float, list[int]]':
+    """
+    Minimum (maximum if largest) of a block without NaN and the positions
+    where it is.
+    """
+    value = block.max() if largest else block.min()
+    return float(value), np.flatnonzero(block == value).tolist()
+
+
+def has_nan(block : Any) -> bool:
+    return bool(np.isnan(block).any())
+
+
+def middle(values : 'list[float]') -> 'list[float]':
+    """
+    The middle value(s) of the numbers (two if they are even), found with
+    a partition instead of sorting them.
+    """
+    n = len(values)
+    positions = sorted({(n - 1) // 2, n // 2})
+    numbers = np.array(values, dtype=np.float64)
+    if np.isnan(numbers).any():
+        # NaN is not ordered: keep the behavior of sorted()
+        ordered = sorted(values)
+        return [ordered[position] for position in positions]
+    partitioned = np.partition(numbers, positions)
+    return [float(partitioned[position]) for position in positions]
+
+
+def sort_numbers(values : 'list[Any]') -> 'list[Any]':
+    """
+    The numbers (int and float) sorted with a stable NumPy sort, keeping
+    their type. Falls back to sorted() if they do not fit exactly in a
+    NumPy array (e.g., very large integers).
+    """
+    if len(values) < 2:
+        return list(values)
+    try:
+        numbers = np.array(values)
+    except OverflowError:
+        return sorted(values)
+    if numbers.dtype == np.float64:
+        # NaN is not ordered, and the integers mixed with the floats may
+        # not be exact as doubles: keep the behavior of sorted()
+        if np.isnan(numbers).any() or np.abs(numbers[np.isfinite(numbers)]).max(initial=0) >= MAX_EXACT_INT:
+            return sorted(values)
+        if any(type(value) is int for value in values):
+            # mixed: sort the positions to keep the types
+            return [values[i] for i in np.argsort(numbers, kind="stable").tolist()]
+    elif numbers.dtype != np.int64:
+        return sorted(values)
+    return np.sort(numbers, kind="stable").tolist()
@@ -0,0 +1,80 @@
+import bz2
+import gzip
+import io
+import lzma
+import os
+import tarfile
+import tempfile
+import zipfile
+
+import pytest
+
+from src.take.compression import *
+
+CONTENT = "first line\nsecond line\r\nthird line\n"
+
+def compress(data : bytes, compression : 'str|None') -> bytes:
+    if compression == "gzip":
+        return gzip.compress(data)
+    if compression == "bz2":
+        return bz2.compress(data)
+    if compression == "xz":
+        return lzma.compress(data)
+    return data
+
+def get_file(data : bytes, suffix : str = "") -> str:
+    with tempfile.NamedTemporaryFile("wb", suffix=suffix, delete=False) as fp:
+        fp.write(data)
+    return fp.name
+
+def read_input(name : str) -> bytes:
+    with open_input(name) as fp:
+        return fp.read()
+
+
+@pytest.mark.parametrize("compression", [None, "gzip", "bz2", "xz"])
+def test_open_compressed(compression : 'str|None'):
+    # detected by the content, not by the name
+    filename = get_file(compress(CONTENT.encode(), compression))
+    assert compression_of(compress(b"x", compression)) == compression
+    assert is_plain(filename) == (compression is None)
+    assert read_input(filename) == CONTENT.encode()
+    assert expand_archives([filename]) == [filename]
+    os.unlink(filename)
+
+
+def test_zip_members():
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr("a.log", CONTENT)
+        archive.writestr("logs/", "")
+        archive.writestr("logs/b.log.gz", gzip.compress(b"compressed\n"))
+    filename = get_file(buffer.getvalue(), ".zip")
+    members = expand_archives([filename])
+    assert members == [filename + MEMBER_SEPARATOR + "a.log", filename + MEMBER_SEPARATOR + "logs/b.log.gz"]
+    assert not any(is_plain(member) for member in members)
+    assert [read_input(member) for member in members] == [CONTENT.encode(), b"compressed\n"]
+    os.unlink(filename)
+
+
+@pytest.mark.parametrize("mode", ["w", "w:gz", "w:xz"])
+def test_tar_members(mode : str):
+    buffer = io.BytesIO()
+    contents = {f"dir/{i}.log": f"{i}\n".encode() * (i + 1) for i in range(4)}
+    with tarfile.open(fileobj=buffer, mode=mode) as archive: # type: ignore
+        for name, data in contents.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    filename = get_file(buffer.getvalue())
+    members = expand_archives([filename])
+    assert members == [filename + MEMBER_SEPARATOR + name for name in contents]
+    # also in a different order
+    for member, name in reversed(list(zip(members, contents))):
+        assert read_input(member) == contents[name]
+    os.unlink(filename)
+
+
+def test_split_member():
+    assert split_member("logs.zip" + MEMBER_SEPARATOR + "a/b.log") == ("logs.zip", "a/b.log")
+    assert split_member("plain.log") is None
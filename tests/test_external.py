@@ -0,0 +1,36 @@
+import os
+import pickle
+import random
+
+import pytest
+
+from src.take.external import *
+
+@pytest.mark.parametrize("n, memory", [(0, 10), (5, 10), (1000, 10), (300, 1)])
+def test_external_sorter(n : int, memory : int):
+    rng = random.Random(n)
+    values = [rng.randint(-100, 100) for _ in range(n)]
+    sorter = ExternalSorter(memory)
+    for v in values:
+        sorter.add(v)
+    assert sorter.count == n
+    assert len(sorter.buffer) < memory
+    # the runs are merged when there are too many of them
+    assert len(sorter.runs) <= MAX_RUNS
+    assert list(sorter.sorted()) == sorted(values)
+    assert list(sorter.sorted(reverse=True)) == sorted(values, reverse=True)
+    paths = [path for path, _ in sorter.runs]
+    sorter.close()
+    assert not any(os.path.exists(path) for path in paths)
+
+
+def test_external_sorter_merge():
+    a, b = ExternalSorter(7), ExternalSorter(7)
+    for v in range(50):
+        (a if v % 3 else b).add(str(v))
+    # as sent by a worker process
+    b = pickle.loads(pickle.dumps(b))
+    a.merge(b)
+    assert a.count == 50 and b.runs == []
+    assert list(a.sorted()) == sorted(str(v) for v in range(50))
+    a.close()
@@ -0,0 +1,86 @@
+import os
+import re
+import tempfile
+
+from src.take.follow import *
+
+def get_followed_file(content : str, prefilter : 're.Pattern[str]|None' = None) -> FollowedFile:
+    with tempfile.NamedTemporaryFile("w", suffix=".log", delete=False) as fp:
+        fp.write(content)
+    file = FollowedFile(fp.name, prefilter, block_size=8)
+    file.open()
+    return file
+
+def read(file : FollowedFile, final : bool = False) -> 'list[tuple[int,str]]':
+    return [(idx, line) for indexes, lines in file.batches(final) for idx, line in zip(indexes, lines)]
+
+def append(filename : str, text : str) -> None:
+    with open(filename, "a") as fp:
+        fp.write(text)
+
+
+def test_followed_file_appended_lines():
+    file = get_followed_file("first\nsecond line\nthi")
+    assert read(file) == [(0, "first"), (1, "second line")]
+    # the last line waits for its newline
+    assert read(file) == []
+    append(file.filename, "rd\nfourth")
+    assert read(file) == [(2, "third")]
+    assert read(file, final=True) == [(3, "fourth")]
+    file.close()
+    os.unlink(file.filename)
+
+
+def test_followed_file_start():
+    file = get_followed_file("skipped\nkept\npartial")
+    end = file.complete_end(0, os.path.getsize(file.filename))
+    assert end == len("skipped\nkept\n")
+    file.seek(len("skipped\n"), 1)
+    assert read(file) == [(1, "kept")]
+    assert file.complete_end(0, 3) == 0
+    file.close()
+    os.unlink(file.filename)
+
+
+def test_followed_file_rotated():
+    file = get_followed_file("a\n")
+    assert read(file) == [(0, "a")]
+    os.rename(file.filename, file.filename + ".1")
+    # written before the new file is created
+    append(file.filename + ".1", "b\nc")
+    assert read(file) == [(1, "b")]
+    append(file.filename, "new\n")
+    # the rest of the old file, then the new one from the start
+    assert read(file) == [(2, "c"), (0, "new")]
+    file.close()
+    os.unlink(file.filename + ".1")
+    os.unlink(file.filename)
+
+
+def test_followed_file_truncated():
+    file = get_followed_file("a long line\nanother one\n")
+    assert len(read(file)) == 2
+    with open(file.filename, "w") as fp:
+        fp.write("x\n")
+    assert read(file) == [(0, "x")]
+    file.close()
+    os.unlink(file.filename)
+
+
+def test_followed_file_missing():
+    file = get_followed_file("")
+    file.close()
+    os.unlink(file.filename)
+    assert read(file) == []
+    append(file.filename, "created\n")
+    assert read(file) == [(0, "created")]
+    file.close()
+    os.unlink(file.filename)
+
+
+def test_followed_file_prefilter():
+    file = get_followed_file("error 1\ninfo\nerror 2\r\n", re.compile("^error", re.MULTILINE))
+    assert read(file) == [(0, "error 1"), (2, "error 2")]
+    assert file.index == 3
+    file.close()
+    os.unlink(file.filename)
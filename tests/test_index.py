@@ -0,0 +1,129 @@
+import argparse
+import os
+import random
+import tempfile
+
+import pytest
+
+from src.take.index import *
+
+def get_lines_file(lines : 'list[str]', final_newline : bool) -> str:
+    content = "\n".join(lines) + ("\n" if final_newline and lines else "")
+    with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as fp:
+        fp.write(content)
+    return fp.name
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("5:7", (5, 7)),
+    ("-100:", (-100, None)),
+    (":3", (None, 3)),
+    ("42", (42, 42)),
+    (":", (None, None)),
+])
+def test_parse_line_range(text : str, expected : LineRange):
+    assert parse_line_range(text) == expected
+
+@pytest.mark.parametrize("text", ["0:5", "a:b", "1:2:3"])
+def test_parse_line_range_invalid(text : str):
+    with pytest.raises(argparse.ArgumentTypeError):
+        parse_line_range(text)
+
+
+@pytest.mark.parametrize("final_newline", [True, False])
+def test_line_index(final_newline : bool):
+    rng = random.Random(0)
+    lines = ["x" * rng.randint(0, 30) for _ in range(500)]
+    filename = get_lines_file(lines, final_newline)
+    starts = [0]
+    for line in lines:
+        starts.append(starts[-1] + len(line) + 1)
+    index = LineIndex.build(filename, spacing=64)
+    assert index.total == len(lines) and len(index.offsets) > 10
+    for idx in [0, 1, 63, 64, 250, 499, 500, 600]:
+        expected = min(starts[idx], os.path.getsize(filename)) if idx < len(starts) else os.path.getsize(filename)
+        assert index.line_offset(filename, idx) == expected
+        assert skip_lines(filename, 0, idx, block_size=50) == expected
+    assert count_lines(filename) == len(lines)
+    assert count_lines(filename, (starts[10], starts[400])) == 390
+    # the ranges split at the checkpoints start at the right lines
+    ranges = index.split_ranges(1000, (starts[10], starts[400]), 10)
+    assert len(ranges) > 2 and ranges[0][0][0] == starts[10] and ranges[-1][0][1] == starts[400]
+    for (start, _), first_index in ranges:
+        assert starts[first_index] == start
+    os.unlink(filename)
+
+
+def test_carriage_returns():
+    # lines ended by a carriage return, a newline, or both, as open() reads them
+    content = b"l1\rl2\rl3\r\nl4\nl5\rl6\nl7\r"
+    starts = [0, 3, 6, 10, 13, 16, 19, 22]
+    with tempfile.NamedTemporaryFile("wb", suffix=".txt", delete=False) as fp:
+        fp.write(content)
+    filename = fp.name
+    for block_size in [1, 2, 3, 8, 1 << 20]:
+        assert count_lines(filename, block_size=block_size) == 7
+        assert count_lines(filename, (starts[1], starts[4]), block_size) == 3
+        for idx in range(8):
+            assert skip_lines(filename, 0, idx, block_size) == starts[idx]
+            assert skip_lines(filename, starts[idx], 7 - idx, block_size) == len(content)
+    for spacing in [1, 4, 64]:
+        index = LineIndex.build(filename, spacing=spacing)
+        assert index.total == 7
+        assert [index.line_offset(filename, idx) for idx in range(8)] == starts
+    os.unlink(filename)
+
+
+@pytest.mark.parametrize("line_range, expected", [
+    ((3, 5), [2, 3, 4]),
+    ((-2, None), [8, 9]),
+    ((None, -9), [0, 1]),
+    ((8, 20), [7, 8, 9]),
+    ((6, 4), []),
+    ((-20, 1), [0]),
+])
+def test_resolve_line_range(line_range : LineRange, expected : 'list[int]'):
+    lines = [f"line {i}" for i in range(10)]
+    filename = get_lines_file(lines, True)
+    for index in [None, LineIndex.build(filename, spacing=16)]:
+        (start, end), first_index = resolve_line_range(filename, line_range, index)
+        with open(filename, "rb") as fp:
+            fp.seek(start)
+            selected = fp.read(end - start).decode().splitlines()
+        assert selected == [lines[i] for i in expected]
+        if expected:
+            assert first_index == expected[0]
+    os.unlink(filename)
+
+
+def test_load_index_stale():
+    filename = get_lines_file(["a", "b"], True)
+    assert load_index(filename).total == 2
+    assert os.path.exists(filename + INDEX_SUFFIX)
+    assert LineIndex.load(filename + INDEX_SUFFIX, file_signature(filename)) is not None
+    with open(filename, "a") as fp:
+        fp.write("c\n")
+    # the size changed
+    assert LineIndex.load(filename + INDEX_SUFFIX, file_signature(filename)) is None
+    assert load_index(filename).total == 3
+    os.unlink(filename + INDEX_SUFFIX)
+    os.unlink(filename)
+
+
+@pytest.mark.parametrize("use_index", [False, True])
+def test_reverse_range(use_index : bool):
+    lines = [f"line {i}" for i in range(10)]
+    filename = get_lines_file(lines, True)
+    starts = [0]
+    for line in lines:
+        starts.append(starts[-1] + len(line) + 1)
+    assert reverse_range(filename, None, 0, None, True, use_index) == ((0, starts[10]), 10)
+    assert reverse_range(filename, (starts[2], starts[7]), 2, None, True, use_index) == ((starts[2], starts[7]), 7)
+    # the lines from the limit are not read
+    assert reverse_range(filename, None, 0, 4, True, use_index) == ((0, starts[4]), 4)
+    assert reverse_range(filename, (starts[2], starts[7]), 2, 20, True, use_index) == ((starts[2], starts[7]), 7)
+    # not counted
+    assert reverse_range(filename, (starts[2], starts[7]), 2, None, False, use_index) == ((starts[2], starts[7]), 2)
+    if use_index:
+        os.unlink(filename + INDEX_SUFFIX)
+    os.unlink(filename)
@@ -1,14 +1,22 @@
 from contextlib import redirect_stdout
+import gzip
 from hypothesis import given, settings, strategies
 import io
+import lzma
 import os
 import pytest
 from tempfile import NamedTemporaryFile
 
 
 from src.take.take import *
+from src.take.take import _init_worker
 from src.take.predicates import PREDICATES
+from src.take.reader import count_newlines, open_range, read_batches, read_batches_reverse, read_candidate_lines, read_lines, split_ranges
 import random
+import threading
+import time
+import re
+import zipfile
 
 CONTENT = """
 test
@@ -65,6 +73,9 @@ size 10
 size 11.5
 """
 
+# lines ended by a carriage return, a newline, or both
+CARRIAGE_RETURNS = "l1\rl2\rl3\r\nl4\nl5\rl6\nl7\r"
+
 def get_temporary_file(content: str) -> str:
     """
     Create a temporary file with the given content and return its name.
@@ -75,7 +86,7 @@ def get_temporary_file(content: str) -> str:
     f.close()
     return f.name
 
-def get_result(
+def get_arguments(
         command : 'list[str]',
         filenames: 'list[str]',
         aggregate : 'list[str]' = [],
@@ -83,11 +94,11 @@ def get_result(
         suppress_output: bool = False,
         keep_separated: bool = False,
         with_filename : bool = False
-    ) -> str:
+    ) -> argparse.Namespace:
     """
-    Helper function to get the result of a command.
+    Helper function to build the arguments of a run.
     """
-    args = argparse.Namespace(
+    return argparse.Namespace(
         filename=filenames,
         command=command,
         suppress_output=suppress_output,
@@ -100,8 +111,30 @@ def get_result(
         stats=False,
         debug=False,
         max_columns=0,
-        keep_separated=keep_separated
+        keep_separated=keep_separated,
+        ignore_no_matches=False,
+        ignore_file=None
     )
+
+def get_result(
+        command : 'list[str]',
+        filenames: 'list[str]',
+        aggregate : 'list[str]' = [],
+        max_count: int = 0,
+        suppress_output: bool = False,
+        keep_separated: bool = False,
+        with_filename : bool = False
+    ) -> str:
+    """
+    Helper function to get the result of a command.
+    """
+    args = get_arguments(command, filenames, aggregate, max_count, suppress_output, keep_separated, with_filename)
+    return run(args)
+
+def run(args : argparse.Namespace) -> str:
+    """
+    Helper function to get the output of a run.
+    """
     with io.StringIO() as buf, redirect_stdout(buf):
         loop_process(args)
         return buf.getvalue()
@@ -264,6 +297,89 @@ def test_integration_sw_sps_st_max_count_filename():
     assert res.strip().replace("\n","").replace(" ","") == f"{filename}:7{filename}:8{filename}:9{filename}:10"
 
 
+def test_results_recorded_only_for_aggregation():
+    command = ["line(L), startswith(L,size), split_select(L,space,1,S), print(S), println(S)"]
+    filename = get_temporary_file(CONTENT)
+    with io.StringIO() as buf, redirect_stdout(buf):
+        assert apply_sequence_commands(get_arguments(command, [filename])) == ({}, None)
+        recorded, aggregation = apply_sequence_commands(get_arguments(command, [filename], aggregate=["concat", "sum"]))
+    os.unlink(filename)
+    # aggregated values are not stored (except in the state of the functions that need them)
+    assert recorded == {}
+    assert aggregation is not None
+    assert aggregation.count == 10
+    stats = aggregation.groups[None]
+    assert "".join(stats.texts)[:5] == "77\n88"
+    assert stats.numeric().total == 2 * (7 + 8 + 9 + 10 + 11.5)
+    # the state of the functions not requested is not kept
+    assert stats.values is None and stats.min is None
+
+
+@pytest.mark.parametrize("output_buffer, threaded_output", [(0, False), (10, False), (1 << 16, True), (0, True)])
+def test_output_writer(output_buffer : int, threaded_output : bool):
+    command = ["line(L), startswith(L,'AUCPR'), split_select(L,':',1,L1), strip(L1,L2), println(L2)"]
+    filename = get_temporary_file(CONTENT)
+    expected = get_result(command, [filename], aggregate=["count"], with_filename=True)
+    args = get_arguments(command, [filename], aggregate=["count"], with_filename=True)
+    args.output_buffer = output_buffer
+    args.threaded_output = threaded_output
+    res = run(args)
+    os.unlink(filename)
+    assert res == expected
+    assert res.splitlines()[0] == f"{filename}:0.720441984486102"
+    assert res.splitlines()[-1] == "[count] 5"
+
+
+def test_output_writer_error():
+    class ClosedStream(io.StringIO):
+        def write(self, text : str) -> int:
+            raise BrokenPipeError("closed")
+    writer = OutputWriter(True, 0, buffer_size=0, threaded=True, stream=ClosedStream(), queue_size=1)
+    # without the error, the writes block once the queue is full
+    with pytest.raises(BrokenPipeError):
+        for i in range(100):
+            writer.write_value(str(i), True)
+    with pytest.raises(BrokenPipeError):
+        writer.close()
+    assert writer.thread is None
+
+
+def test_output_max_columns():
+    command = ["line(L), startswith(L,'AUCPR'), split_select(L,':',1,L1), strip(L1,L2), println(L2)"]
+    filename = get_temporary_file(CONTENT)
+    args = get_arguments(command, [filename], with_filename=True)
+    args.max_columns = len(filename) + 4
+    res = run(args)
+    args.max_columns = 3
+    res_short = run(args)
+    os.unlink(filename)
+    assert res.splitlines()[0] == f"{filename}:0.7"
+    assert res_short.splitlines()[0] == f"{filename[:2]}:"
+
+
+def test_prefilter_line_numbers():
+    filename = get_temporary_file(CONTENT)
+    screened = get_result(["line(L), contains(L,'AUCPR'), line_number(L,I), print(I), print(' '), println(L)"], [filename])
+    not_screened = get_result(["line(L), line_number(L,I), contains(L,'AUCPR'), print(I), print(' '), println(L)"], [filename])
+    assert screened == not_screened
+    assert screened.splitlines()[0] == "29 AUCPR1:  0.720441984486102"
+    with open(filename) as fp:
+        candidates = list(read_candidate_lines(fp, re.compile("^size|AUCROC3", re.MULTILINE), block_size=16))
+    with open(filename) as fp:
+        expected = [(idx, line) for idx, line in read_lines(fp) if line.startswith("size") or "AUCROC3" in line]
+    os.unlink(filename)
+    assert candidates == expected
+
+
+def test_prefilter_keeps_errors():
+    # comparing the length with a constant that is not a number raises an
+    # error on every line, the lines cannot be skipped by contains
+    filename = get_temporary_file(CONTENT)
+    res = get_result(["line(L), length(L,abc), contains(L,'zzz'), println(L)"], [filename])
+    os.unlink(filename)
+    assert res.startswith(f"[ERROR] processing file {filename}")
+
+
 def generate_random_command() -> str:
     available_predicates = [(k,v) for k,v in PREDICATES.items()]
     command_len = random.randint(1, 10)
@@ -311,4 +427,471 @@ def test_random_command(seed : int, aggregator: bool):
     except Exception as e:
         assert False, command + " " + str(aggregate) + "\n" + str(e)
     finally:
-        os.unlink(filename)
\ No newline at end of file
+        os.unlink(filename)
+def test_shared_commands_output():
+    commands = [
+        "line(L), startswith(L,size), split_select(L,space,1,S), println(S)",
+        "line(L), startswith(L,size), split_select(L,space,1,S), length(S,N), gt(N,0), println(N)",
+        "line(L), startswith(L,size), split_select(L,space,1,S), print(S), println('!')"
+    ]
+    filename = get_temporary_file(CONTENT)
+    shared = get_result(commands, [filename])
+    separate = [get_result([command], [filename]).splitlines() for command in commands]
+    os.unlink(filename)
+    # the outputs of the commands are interleaved line by line
+    assert shared.splitlines() == [line for lines in zip(*separate) for line in lines]
+
+@pytest.mark.parametrize("max_count, keep_separated, with_filename, aggregate", [
+    (0, False, True, []),
+    (3, False, True, []),
+    (7, False, False, ["sum"]),
+    (2, True, True, ["count"]),
+    (0, True, False, ["max", "average"])
+])
+def test_parallel_jobs(max_count : int, keep_separated : bool, with_filename : bool, aggregate : 'list[str]'):
+    filenames = [get_temporary_file(CONTENT) for _ in range(4)]
+    command = ["line(L), startswith(L,size), split_select(L,space,1,S), println(S)", "line(L), startswith(L,'AUCPR'), println(L)"]
+    args = get_arguments(command, filenames, aggregate, max_count, False, keep_separated, with_filename)
+    expected = run(args)
+    args = get_arguments(command, filenames, aggregate, max_count, False, keep_separated, with_filename)
+    args.jobs = 3
+    res = run(args)
+    for filename in filenames:
+        os.unlink(filename)
+    assert res == expected
+
+def test_parallel_warnings(capsys : pytest.CaptureFixture[str]):
+    filename = get_temporary_file(CONTENT)
+    args = complete_arguments(get_arguments(["line(L), split_select(L,space,0,X), not println(L)"], [filename]))
+    Scanner(args, OutputWriter(True, 0), False, False)
+    warnings = capsys.readouterr().out
+    # the workers do not repeat the warnings of the main process
+    _init_worker(args)
+    os.unlink(filename)
+    assert "variable 'X' appears only once" in warnings and "cannot be negated" in warnings
+    assert capsys.readouterr().out == ""
+
+@pytest.mark.parametrize("command, max_count, keep_separated", [
+    (["line(L), line_number(L,N), gt(N,10), println(N)"], 0, False),
+    (["line(L), startswith(L,size), line_number(L,N), print(N), println(L)"], 0, False),
+    (["line(L), line_number(L,N), mod(N,3,0), println(L)"], 9, False),
+    (["line(L), contains(L,'0.'), line_number(L,N), println(N)"], 4, True)
+])
+def test_parallel_chunks(command : 'list[str]', max_count : int, keep_separated : bool):
+    filenames = [get_temporary_file(CONTENT * 3), get_temporary_file(CONTENT)]
+    args = get_arguments(command, filenames, [], max_count, False, keep_separated, True)
+    expected = run(args)
+    args = get_arguments(command, filenames, [], max_count, False, keep_separated, True)
+    args.jobs = 3
+    args.chunk_size = 100
+    res = run(args)
+    for filename in filenames:
+        os.unlink(filename)
+    assert res == expected
+
+def test_split_ranges():
+    filename = get_temporary_file(CONTENT)
+    ranges = split_ranges(filename, 50)
+    assert len(ranges) > 1
+    assert ranges[0][0] == 0 and ranges[-1][1] == os.path.getsize(filename)
+    lines : 'list[str]' = []
+    for start, end in ranges:
+        with open_range(filename, start, end) as fp:
+            lines.extend(fp.readlines())
+        assert count_newlines(filename, start, end) == CONTENT.encode().count(b"\n", start, end)
+    os.unlink(filename)
+    assert "".join(lines) == CONTENT
+
+def test_count_newlines_carriage_returns():
+    filename = get_temporary_file(CARRIAGE_RETURNS)
+    size = os.path.getsize(filename)
+    # the carriage return and the newline of a line end are in different blocks
+    counts = [count_newlines(filename, 0, size, block_size) for block_size in [1, 2, 3, 9, 1 << 20]]
+    command = ["line(L), line_number(L,I), print(I), print(' '), println(L)"]
+    expected = get_result(command, [filename])
+    args = get_arguments(command, [filename])
+    args.jobs = 2
+    args.chunk_size = 5
+    res = run(args)
+    os.unlink(filename)
+    assert counts == [7] * 5
+    assert res == expected
+    assert expected.splitlines()[-1] == "7 l7"
+
+@pytest.mark.parametrize("content, pattern", [
+    (CONTENT, None),
+    (CONTENT, "^size|AUCROC"),
+    (CONTENT, "(?i:train)"),
+    (CONTENT.replace("\n", "\r\n"), "^size"),
+    ("no newline at the end\nsize 1", "^size"),
+    ("lone\rcarriage returns\rsize 1\n" + "x" * 40 + "\n", "^size"),
+    ("", None)
+])
+def test_read_batches(content : str, pattern : 'str|None'):
+    filename = get_temporary_file(content)
+    prefilter = re.compile(pattern, re.MULTILINE) if pattern is not None else None
+    with open(filename, "r", newline=None) as fp:
+        all_lines = list(read_lines(fp))
+    expected = [(idx, line) for idx, line in all_lines if prefilter is None or prefilter.search(line)]
+    for block_size in [16, 1 << 20]:
+        batches = list(read_batches(filename, prefilter, block_size=block_size))
+        assert [(idx, line) for indexes, lines in batches for idx, line in zip(indexes, lines)] == expected
+        batches = list(read_batches_reverse(filename, prefilter, (0, os.path.getsize(filename)), len(all_lines), block_size=block_size))
+        assert [(idx, line) for indexes, lines in batches for idx, line in zip(indexes, lines)] == expected[::-1]
+    os.unlink(filename)
+
+@pytest.mark.parametrize("keep_separated, jobs", [(False, 1), (True, 1), (True, 2)])
+def test_plot_data_grouped(keep_separated : bool, jobs : int):
+    command = ["line(L), startswith(L,size), split_select(L,space,1,S), println(S)"]
+    filenames = [get_temporary_file(CONTENT), get_temporary_file(CONTENT)]
+    args = get_arguments(command, filenames, suppress_output=True, keep_separated=keep_separated)
+    args.plot = True
+    args.jobs = jobs
+    plot_data, aggregation = apply_sequence_commands(args)
+    for filename in filenames:
+        os.unlink(filename)
+    values = ["7\n", "8\n", "9\n", "10\n", "11.5\n"]
+    assert aggregation is None
+    if keep_separated:
+        assert plot_data == {filenames[0]: values, filenames[1]: values}
+    else:
+        assert plot_data == {None: values * 2}
+
+def test_quantile_aggregates():
+    command = ["line(L), startswith(L,size), split_select(L,space,1,S), println(S)"]
+    filename = get_temporary_file(CONTENT)
+    args = get_arguments(command, [filename], ["quantile", "percentiles", "median"], suppress_output=True)
+    args.uncolored = True
+    args.quantiles = [0, 0.5, 0.75, 1]
+    res = run(args)
+    os.unlink(filename)
+    assert res == "[quantile] 7.0 9.0 10.0 11.5\n[percentiles] \np0:       7.0\np50:      9.0\np75:      10.0\np100:     11.5\n[median] 9.0\n"
+
+def test_count_distinct():
+    command = ["line(L), startswith(L,size), split_select(L,space,1,S), println(S)"]
+    filenames = [get_temporary_file(CONTENT), get_temporary_file(CONTENT + "size 12\n")]
+    args = get_arguments(command, filenames, ["count_distinct"], suppress_output=True, keep_separated=True)
+    args.uncolored = True
+    separated = run(args)
+    args = get_arguments(command, filenames, ["count_distinct"], suppress_output=True)
+    args.uncolored = True
+    args.exact_size = 2
+    res = run(args)
+    for filename in filenames:
+        os.unlink(filename)
+    assert separated == f"[count_distinct {filenames[0]}] 5\n[count_distinct {filenames[1]}] 6\n"
+    # estimated with HyperLogLog
+    assert res == "[count_distinct] 6\n"
+
+def test_sort_spilled():
+    commands = [
+        ["line(L), startswith(L,size), split_select(L,space,1,S), println(S)"],
+        ["line(L), startswith(L,i), println(L)"]
+    ]
+    filenames = [get_temporary_file(CONTENT), get_temporary_file(CONTENT)]
+    for command in commands:
+        outputs : 'list[str]' = []
+        for sort_memory in [1 << 20, 2]:
+            args = get_arguments(command, filenames, ["sort_ascending", "sort_descending", "median"], suppress_output=True)
+            args.uncolored = True
+            args.sort_memory = sort_memory
+            outputs.append(run(args))
+        assert outputs[0] == outputs[1]
+    for filename in filenames:
+        os.unlink(filename)
+    assert outputs[0].startswith("[sort_ascending] \ninstance")
+
+@pytest.mark.parametrize("extra", ["", "nan\n", "0\ninf\n", "x\n"])
+def test_vectorized_aggregates(monkeypatch : pytest.MonkeyPatch, extra : str):
+    pytest.importorskip("numpy")
+    from src.take import vectorized
+    command = ["line(L), startswith(L,size), split_select(L,space,1,S), println(S)"]
+    filenames = [get_temporary_file(CONTENT + "size 7\n"), get_temporary_file(CONTENT.replace("size 9", "size " + extra))]
+    aggregates = ["sum", "product", "mean", "variance", "median", "min", "max", "range", "summary", "sort_ascending", "sort_descending"]
+    outputs : 'list[str]' = []
+    # the numbers are reduced in several blocks
+    monkeypatch.setattr(vectorized, "VECTOR_BLOCK", 3)
+    for has_numpy in [True, False]:
+        monkeypatch.setattr(vectorized, "HAS_NUMPY", has_numpy)
+        for keep_separated in [False, True]:
+            args = get_arguments(command, filenames, aggregates, suppress_output=True, keep_separated=keep_separated, with_filename=True)
+            outputs.append(run(args))
+    for filename in filenames:
+        os.unlink(filename)
+    # the moments are computed in a different order
+    rounded = [re.sub(r"\d+\.\d+", lambda number: f"{float(number[0]):.9g}", output) for output in outputs]
+    assert rounded[:2] == rounded[2:]
+
+@pytest.mark.parametrize("has_numpy", [True, False])
+def test_min_max_files(monkeypatch : pytest.MonkeyPatch, has_numpy : bool):
+    from src.take import vectorized
+    if has_numpy:
+        pytest.importorskip("numpy")
+    monkeypatch.setattr(vectorized, "HAS_NUMPY", has_numpy)
+    monkeypatch.setattr(vectorized, "VECTOR_BLOCK", 7)
+    filenames = [get_temporary_file("3\n" * 100), get_temporary_file("3\n" * 50 + "4\n")]
+    command = ["line(L), println(L)"]
+    results : 'list[Any]' = []
+    for with_filename in [False, True]:
+        with io.StringIO() as buf, redirect_stdout(buf):
+            _, aggregation = apply_sequence_commands(get_arguments(command, filenames, ["min", "max"], suppress_output=True, with_filename=with_filename))
+        results.append(aggregation.groups[None].numeric()) # type: ignore
+    printed = get_result(command, filenames, ["min"], suppress_output=True, with_filename=True)
+    for filename in filenames:
+        os.unlink(filename)
+    # the files of the tied values are kept only for -H, one pair per file
+    assert results[0].min_files == [] and results[0].max_files == []
+    assert results[1].min_files == [(filenames[0], 100), (filenames[1], 50)]
+    assert results[1].max_files == [(filenames[1], 1)]
+    assert printed == f"[min {', '.join([filenames[0]] * 100 + [filenames[1]] * 50)}] 3.0\n"
+
+@pytest.mark.parametrize("commands, max_count, with_filename", [
+    (["line(L), startswith(L,size), split_select(L,space,1,S), println(S)"], 0, False),
+    (["line(L), not contains(L,'4.'), length(L,N), gt(N,4), println(N)"], 3, True),
+    (["line(L), line_number(L,I), mod(I,4,0), print(I), print(' '), println(L)"], 0, True),
+    (["line(L), strip(L,T), capitalize(T,C), println(C)", "line(L), startswith(L,size), split_select(L,space,1,S), print(S), println('!')"], 5, True),
+    # an error after some lines printed something
+    (["line(L), println(L), gt(L,3)"], 0, False),
+    (["line(L), startswith(3,L), println(L)"], 0, False),
+    (["line(L), regex(L,'^(\\w+)(\\d): +(\\d+)\\.(\\d+)',M,K,I,F), not eq(K,3), print(M), print(' '), print(I), println(F)", "line(L), search(L,'ROC'), not match(L,AUC), println(L)"], 0, True),
+])
+def test_columnar_engine(commands : 'list[str]', max_count : int, with_filename : bool):
+    filenames = [get_temporary_file(CONTENT), get_temporary_file(CONTENT)]
+    outputs : 'list[str]' = []
+    for engine, batch_size in [("row", 1), ("columnar", 1), ("columnar", 4), ("columnar", 1 << 16)]:
+        args = get_arguments(commands, filenames, ["concat"], max_count=max_count, with_filename=with_filename)
+        args.engine = engine
+        args.batch_size = batch_size
+        outputs.append(run(args))
+    for filename in filenames:
+        os.unlink(filename)
+    assert outputs[1:] == outputs[:1] * 3
+
+@given(strategies.integers())
+@settings(max_examples=500, deadline=None)
+def test_columnar_random_command(seed : int):
+    random.seed(seed)
+    command = generate_random_command()
+    filename = get_temporary_file(CONTENT)
+    outputs : 'list[str]' = []
+    for engine in ["row", "columnar"]:
+        args = get_arguments([command], [filename])
+        args.engine = engine
+        args.batch_size = 8
+        outputs.append(run(args))
+    os.unlink(filename)
+    assert outputs[0] == outputs[1], command
+
+def test_regex_extraction():
+    filename = get_temporary_file(CONTENT)
+    regex_output = get_result(["line(L), regex(L,'^AUCPR\\d*: +(\\S+)',V), println(V)"], [filename], aggregate=["sum"])
+    split_output = get_result(["line(L), startswith(L,'AUCPR'), split_select(L,':',1,V1), strip(V1,V), println(V)"], [filename], aggregate=["sum"])
+    assert regex_output == split_output
+    assert regex_output.splitlines()[0] == "0.720441984486102"
+    with pytest.raises(LiteralNotFoundError):
+        get_result(["line(L), regex(L,'x'), println(L)"], [filename])
+    os.unlink(filename)
+
+@pytest.mark.parametrize("first, last, jobs, use_index", [
+    (5, 12, 1, False),
+    (5, 12, 1, True),
+    (-10, None, 1, True),
+    (30, -30, 3, False),
+    (None, 100, 3, True),
+])
+def test_line_range(first : 'int|None', last : 'int|None', jobs : int, use_index : bool):
+    filenames = [get_temporary_file(CONTENT * 3), get_temporary_file(CONTENT)]
+    command = ["line(L), line_number(L,N), print(N), print(' '), println(L)"]
+    total = [CONTENT.count("\n") * 3, CONTENT.count("\n")]
+    expected = ""
+    for filename, n in zip(filenames, total):
+        # the same lines selected with line_number
+        start = 1 if first is None else (first if first > 0 else n + first + 1)
+        end = n if last is None else (last if last > 0 else n + last + 1)
+        expected += run(get_arguments([f"line(L), line_number(L,N), geq(N,{start}), leq(N,{end}), print(N), print(' '), println(L)"], [filename]))
+    args = get_arguments(command, filenames)
+    args.lines = (first, last)
+    args.index = use_index
+    args.jobs = jobs
+    args.chunk_size = 100
+    res = run(args)
+    for filename in filenames:
+        if use_index:
+            os.unlink(filename + ".takeidx")
+        os.unlink(filename)
+    assert res == expected
+
+@pytest.mark.parametrize("first, last, expected", [
+    (6, 7, [6, 7]),
+    (-2, None, [6, 7]),
+    (2, 4, [2, 3, 4]),
+    (None, -7, [1]),
+])
+@pytest.mark.parametrize("jobs, use_index", [(1, False), (1, True), (2, True)])
+def test_line_range_carriage_returns(first : 'int|None', last : 'int|None', expected : 'list[int]', jobs : int, use_index : bool):
+    filename = get_temporary_file(CARRIAGE_RETURNS)
+    args = get_arguments(["line(L), line_number(L,N), print(N), print(' '), println(L)"], [filename])
+    args.lines = (first, last)
+    args.index = use_index
+    args.jobs = jobs
+    args.chunk_size = 5
+    res = run(args)
+    if use_index:
+        os.unlink(filename + ".takeidx")
+    os.unlink(filename)
+    assert res == "".join(f"{n} l{n}\n" for n in expected)
+
+@pytest.mark.parametrize("command, aggregate, jobs", [
+    ("line(L), line_number(L,I), leq(I,12), println(L)", [], 1),
+    ("line(L), contains(L,'0.'), line_number(L,I), not gt(I,40), println(I)", ["sum"], 1),
+    ("line(L), line_number(L,I), lt(I,25), println(I)", [], 2),
+    ("line(L), startswith(L,'AUCPR'), println(L)", ["first"], 1),
+    ("line(L), startswith(L,'AUCPR'), println(L)", ["first"], 2),
+])
+@pytest.mark.parametrize("keep_separated", [False, True])
+def test_early_termination(monkeypatch : pytest.MonkeyPatch, command : str, aggregate : 'list[str]', jobs : int, keep_separated : bool):
+    filenames = [get_temporary_file(CONTENT * 50), get_temporary_file(CONTENT)]
+    args = complete_arguments(get_arguments([command], filenames, aggregate, suppress_output=bool(aggregate), keep_separated=keep_separated))
+    scanner = Scanner(args, OutputWriter(True, 0), bool(aggregate), False)
+    assert scanner.line_limit is not None or scanner.stop_when_complete
+    args.jobs = jobs
+    args.chunk_size = 1000
+    res = run(args)
+    # the same run reading all the lines
+    with monkeypatch.context() as patch:
+        patch.setattr("src.take.take.line_limit", lambda commands: None)
+        patch.setattr("src.take.aggregators.FIRST_VALUE_AGGREGATES", set())
+        expected = run(get_arguments([command], filenames, aggregate, suppress_output=bool(aggregate), keep_separated=keep_separated))
+    for filename in filenames:
+        os.unlink(filename)
+    assert res == expected
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_early_termination_keeps_errors(jobs : int):
+    # the first value is known on the first line, the error is raised on
+    # the third one (the second column is not a number)
+    filename = get_temporary_file("a 1\nbb 2\nccc x\n" * 100)
+    command = "line(L), println(L), split_select(L,space,1,S), length(L,S)"
+    args = complete_arguments(get_arguments([command], [filename], ["first"], suppress_output=True))
+    assert not Scanner(args, OutputWriter(True, 0), True, False).stop_when_complete
+    args.jobs = jobs
+    args.chunk_size = 100
+    res = run(args)
+    os.unlink(filename)
+    assert f"[ERROR] processing file {filename}" in res
+    assert res.endswith("[first] a 1\n")
+
+@pytest.mark.parametrize("command", [
+    "line(L), println(L)",
+    "line(L), contains(L,'0.'), line_number(L,I), print(I), print(' '), println(L)",
+    "line(L), line_number(L,I), leq(I,30), println(I)",
+])
+@pytest.mark.parametrize("max_count, jobs, use_index, engine", [
+    (0, 1, False, "row"),
+    (5, 1, False, "columnar"),
+    (0, 2, False, "row"),
+    (5, 2, True, "row"),
+])
+def test_reverse(command : str, max_count : int, jobs : int, use_index : bool, engine : str):
+    filenames = [get_temporary_file(CONTENT * 20), get_temporary_file(CONTENT + "no newline")]
+    forward = run(get_arguments([command], filenames))
+    args = get_arguments([command], filenames, max_count=max_count)
+    args.reverse = True
+    args.jobs = jobs
+    args.chunk_size = 500
+    args.index = use_index
+    args.engine = engine
+    res = run(args)
+    for filename in filenames:
+        if use_index:
+            os.unlink(filename + ".takeidx")
+        os.unlink(filename)
+    # each line prints one line, so the output is the same reversed
+    expected = forward.splitlines(True)[::-1]
+    assert res.splitlines(True) == (expected[:max_count] if max_count > 0 else expected)
+
+@pytest.mark.parametrize("command, lines, jobs, use_index", [
+    ("line(L), line_number(L,I), print(I), print(' '), println(L)", None, 1, False),
+    ("line(L), line_number(L,I), print(I), print(' '), println(L)", None, 2, True),
+    ("line(L), line_number(L,I), print(I), print(' '), println(L)", (2, 6), 1, False),
+    ("line(L), line_number(L,I), leq(I,5), print(I), print(' '), println(L)", None, 1, False),
+])
+def test_reverse_carriage_returns(command : str, lines : 'LineRange|None', jobs : int, use_index : bool):
+    filename = get_temporary_file(CARRIAGE_RETURNS)
+    args = get_arguments([command], [filename])
+    args.lines = lines
+    forward = run(args)
+    args = get_arguments([command], [filename])
+    args.lines = lines
+    args.reverse = True
+    args.jobs = jobs
+    args.chunk_size = 5
+    args.index = use_index
+    res = run(args)
+    # the lines split by a tiny block size (between a carriage return and a newline)
+    indexes = [i for block_size in [1, 2, 3] for indexes, _ in read_batches_reverse(filename, None, (0, len(CARRIAGE_RETURNS)), 7, block_size) for i in indexes]
+    if use_index:
+        os.unlink(filename + ".takeidx")
+    os.unlink(filename)
+    assert res.splitlines(True) == forward.splitlines(True)[::-1]
+    assert forward.splitlines()[-1] == ("6 l6" if lines else "5 l5" if "leq" in command else "7 l7")
+    assert indexes == [6, 5, 4, 3, 2, 1, 0] * 3
+
+@pytest.mark.parametrize("aggregate", [["first"], ["last"], ["first", "last", "count"]])
+@pytest.mark.parametrize("keep_separated", [False, True])
+def test_reverse_aggregates(aggregate : 'list[str]', keep_separated : bool):
+    filenames = [get_temporary_file(CONTENT * 50), get_temporary_file(CONTENT)]
+    command = ["line(L), contains(L,'0.'), println(L)"]
+    expected = get_result(command, filenames, aggregate, suppress_output=True, keep_separated=keep_separated)
+    args = get_arguments(command, filenames, aggregate, suppress_output=True, keep_separated=keep_separated)
+    args.reverse = True
+    res = run(args)
+    for filename in filenames:
+        os.unlink(filename)
+    # first and last refer to the order of the lines in the files
+    assert res == expected
+
+@pytest.mark.parametrize("max_count, aggregate", [(0, []), (0, ["count", "max"]), (20, [])])
+def test_follow(max_count : int, aggregate : 'list[str]'):
+    filename = get_temporary_file(CONTENT * 2 + "partial")
+    command = ["line(L), line_number(L,I), println(I)"]
+    def append() -> None:
+        time.sleep(0.2)
+        with open(filename, "a") as fp:
+            fp.write(" line\n" + CONTENT + "no newline")
+    thread = threading.Thread(target=append)
+    thread.start()
+    args = get_arguments(command, [filename], aggregate, max_count)
+    args.follow = True
+    args.idle_timeout = 0.5
+    res = run(args)
+    thread.join()
+    # the same lines read at the end
+    expected = run(get_arguments(command, [filename], aggregate, max_count))
+    os.unlink(filename)
+    assert res == expected
+
+@pytest.mark.parametrize("jobs, engine", [(1, "row"), (1, "columnar"), (2, "row")])
+def test_compressed_inputs(jobs : int, engine : str):
+    plain = [get_temporary_file(CONTENT * 3), get_temporary_file(CONTENT.replace("\n", "\r\n"))]
+    with open(plain[0], "rb") as fp:
+        first = fp.read()
+    with open(plain[1], "rb") as fp:
+        second = fp.read()
+    compressed = get_temporary_file("")
+    with open(compressed, "wb") as fp:
+        fp.write(gzip.compress(first))
+    archive = get_temporary_file("")
+    with zipfile.ZipFile(archive, "w") as zip_file:
+        zip_file.writestr("second.log.xz", lzma.compress(second))
+    command = ["line(L), contains(L,'0.'), line_number(L,I), print(I), print(' '), println(L)"]
+    for aggregate in [[], ["count", "max"]]:
+        expected = get_result(command, plain, aggregate, keep_separated=True)
+        args = get_arguments(command, [compressed, archive], aggregate, keep_separated=True)
+        args.jobs = jobs
+        args.engine = engine
+        res = run(args)
+        # the second file is a member of the archive
+        assert res == expected.replace(plain[0], compressed).replace(plain[1], archive + "!/second.log.xz")
+    for filename in plain + [compressed, archive]:
+        os.unlink(filename)
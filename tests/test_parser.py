@@ -1,6 +1,7 @@
 import pytest
 
 from src.take.take import *
+from src.take.planner import build_prefilter, line_conditions, line_limit, line_number_bound, raises_no_errors
 
 def test_parser_1():
     with pytest.raises(MalformedLiteralError):
@@ -20,3 +21,101 @@ def test_parser_5():
 def test_parser_6():
     with pytest.raises(MissingLineError):
         Command("length(L,N), line(L), gt(N,4), startswith(L,v), lt(N,7)")
+def test_compile_plan():
+    c = Command("line(L),length(L,N), gt(N,4), startswith(L,v), lt(N,7)")
+    program = Program([c], lambda value, with_newline, from_variable: True)
+    plan = program.paths[0]
+    assert len(plan) == 5
+    program.frame[LINE_SLOT] = "very"
+    program.frame[INDEX_SLOT] = 0
+    assert all(step(program.frame) for step in plan[:2])
+    assert program.frame[c.variables_dict["N"]] == 4
+    assert not plan[2](program.frame)
+@pytest.mark.parametrize("command, error, message", [
+    ("line(L), not contains(X,a), println(L)", UnsafeError, "Negation is not safe for variable X in contains."),
+    ("line(L), split_select(L,space,0,T), length(X,N), println(N)", InstantiationError, "s is not instantiated: X"),
+    ("line(L), line_number(X,I), println(I)", InstantiationError, "s is not instantiated: X"),
+    ("line(L), regex(L,Pattern,G), println(G)", InstantiationError, "s is not instantiated: Pattern"),
+])
+def test_compiled_error_messages(command : str, error : type, message : str):
+    # the messages name the variables, not their slots in the frame
+    program = Program([Command(command, warn=False)], lambda value, with_newline, from_variable: True)
+    program.frame[LINE_SLOT] = "a b"
+    program.frame[INDEX_SLOT] = 0
+    with pytest.raises(error) as raised:
+        for step in program.paths[0]:
+            if not step(program.frame):
+                break
+    assert str(raised.value) == message
+    with pytest.raises(error) as raised:
+        BatchProgram(program.specs, program.node_paths).run([0], ["a b"])
+    assert str(raised.value) == message
+def test_variable_slots():
+    c = Command("line(L), split_select(L,space,1,T), strip(T,T1), println(T1)")
+    assert c.variables_dict == {"L": FIRST_VARIABLE_SLOT, "T": FIRST_VARIABLE_SLOT + 1, "T1": FIRST_VARIABLE_SLOT + 2}
+def test_line_conditions():
+    c = Command("line(L), startswith(L,'AUCPR'), split_select(L,':',1,L1), contains_i(L,x), println(L1), contains(L,y)")
+    assert line_conditions(c) == ["^AUCPR", "(?i:x)"]
+    c = Command("line(L), time_to_seconds(L,T), contains(L,'x'), println(T)")
+    assert line_conditions(c) == []
+    assert build_prefilter([c]) is None
+    c = Command("line(L), length(L,N), length(L,3), contains(L,'x'), println(N)")
+    assert line_conditions(c) == ["x"]
+    c = Command("line(L), length(L,abc), contains(L,'x'), println(L)")
+    assert line_conditions(c) == []
+def test_build_prefilter():
+    c1 = Command("line(L), contains(L,'a.b'), println(L)")
+    c2 = Command("line(L), endswith(L,'c'), startswith(L,'long prefix'), println(L)")
+    prefilter = build_prefilter([c1, c2])
+    assert prefilter is not None
+    assert prefilter.pattern == "a\\.b|^long\\ prefix"
+@pytest.mark.parametrize("command, expected", [
+    ("line(L), line_number(L,I), leq(I,10), println(L)", 10),
+    ("line(L), line_number(L,I), lt(I,10.5), gt(I,2), println(L)", 10),
+    ("line(L), line_number(L,I), not gt(I,7), println(L)", 7),
+    ("line(L), contains(L,x), line_number(L,I), geq(20,I), lt(I,30), println(L)", 20),
+    ("line(L), line_number(L,4), println(L)", 4),
+    ("line(L), line_number(L,I), eq(I,2.5), println(L)", 0),
+    # after the first print, or after a literal that may raise an error
+    ("line(L), line_number(L,I), println(L), leq(I,10)", None),
+    ("line(L), gt(L,3), line_number(L,I), leq(I,10), println(L)", None),
+    ("line(L), line_number(L,I), leq(I,abc), println(L)", None),
+    ("line(L), line_number(L,I), not leq(I,10), println(L)", None),
+])
+def test_line_number_bound(command : str, expected : 'int|None'):
+    assert line_number_bound(Command(command)) == expected
+def test_line_limit():
+    c1 = Command("line(L), line_number(L,I), leq(I,10), println(L)")
+    c2 = Command("line(L), line_number(L,I), lt(I,100), println(I)")
+    c3 = Command("line(L), println(L)")
+    assert line_limit([c1, c2]) == 99
+    assert line_limit([c1, c3]) is None
+def test_raises_no_errors():
+    assert raises_no_errors([Command("line(L), startswith(L,'AUCPR'), split_select(L,':',1,V), strip(V,V1), println(V1)")])
+    assert not raises_no_errors([Command("line(L), println(L)"), Command("line(L), split_select(L,':',1,V), gt(V,3), println(V)")])
+    assert not raises_no_errors([Command("line(L), println(X), contains(X,a)")])
+    assert raises_no_errors([Command("line(L), length(L,N), length(L,3), println(N)")])
+    assert not raises_no_errors([Command("line(L), println(L), split_select(L,space,1,S), length(L,S)")])
+def test_program_shared_steps():
+    printed : 'list[tuple[str|None,bool]]' = []
+    def printer(value, with_newline, from_variable):
+        printed.append((value, with_newline))
+        return True
+    c1 = Command("line(L), split_select(L,space,1,T), strip(T,T1), println(T1)")
+    c2 = Command("line(X), split_select(X,space,1,Y), length(Y,N), gt(N,2), println(N)")
+    c3 = Command("line(L), split_select(L,space,0,T), println(T)")
+    program = Program([c1, c2, c3], printer)
+    # line and the first split_select are shared by c1 and c2
+    assert len(program.steps) == 9
+    assert len(program.memo) == 2
+    assert program.paths[0][:2] == program.paths[1][:2]
+    assert program.paths[0][0] == program.paths[2][0]
+    program.frame[LINE_SLOT] = "a bcd e"
+    program.frame[INDEX_SLOT] = 0
+    program.reset()
+    for path in program.paths:
+        for step in path:
+            if not step(program.frame):
+                break
+    assert printed == [("bcd", True), ("3", True), ("a", True)]
+    assert program.memo == [True, True]
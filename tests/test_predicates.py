@@ -168,7 +168,7 @@ def test_length_0():
     instantiations : 'dict[str,str|None]' = {"L": "v0,2,6", "N": None}
     result = length("L", "N", instantiations, is_negated=False)
     assert result
-    assert instantiations["N"] == "6"
+    assert instantiations["N"] == 6
 def test_length_1():
     instantiations : 'dict[str,str|None]' = {"L": "v0,2,6", "N": "6"}
     assert length("L", "N", instantiations, is_negated=False)
@@ -196,12 +196,12 @@ def test_length_empty_string():
     instantiations : 'dict[str,str|None]' = {"L": "", "N": None}
     result = length("L", "N", instantiations, is_negated=False)
     assert result
-    assert instantiations["N"] == "0"
+    assert instantiations["N"] == 0
 def test_length_unicode_string():
     instantiations : 'dict[str,str|None]' = {"L": "héllo", "N": None}
     result = length("L", "N", instantiations, is_negated=False)
     assert result
-    assert instantiations["N"] == "5"
+    assert instantiations["N"] == 5
 def test_length_constants():
     instantiations : 'dict[str,str|None]' = {}
     assert length("hello", "5", instantiations, is_negated=False)
@@ -376,7 +376,7 @@ def test_line_number_0():
     instantiations : 'dict[str,str|None]' = {"L": "a,b,c,d,e", "N": None}
     result = line_number("L", "N", 0, instantiations, is_negated=False)
     assert result
-    assert instantiations["N"] == "1"
+    assert instantiations["N"] == 1
 def test_line_number_1():
     instantiations : 'dict[str,str|None]' = {"L": "a,b,c,d,e", "N": "1"}
     assert line_number("L", "N", 0, instantiations, is_negated=False)
@@ -391,7 +391,7 @@ def test_line_number_large_index():
     instantiations : 'dict[str,str|None]' = {"L": "test", "N": None}
     result = line_number("L", "N", 999, instantiations, is_negated=False)
     assert result
-    assert instantiations["N"] == "1000"
+    assert instantiations["N"] == 1000
 def test_line_number_negated_0():
     instantiations : 'dict[str,str|None]' = {"L": "a,b,c,d,e", "N": None}
     with pytest.raises(UnsafeError):
@@ -520,7 +520,7 @@ def test_time_to_seconds_0():
     instantiations : 'dict[str,str|None]' = {"T": "0m1.131s", "S": None}
     result = time_to_seconds("T", "S", instantiations, is_negated=False)
     assert result
-    assert instantiations["S"] == "1.131"
+    assert instantiations["S"] == 1.131
 def test_time_to_seconds_1():
     instantiations : 'dict[str,str|None]' = {"T": "0m1.131s", "S": "1.131"}
     assert time_to_seconds("T", "S", instantiations, is_negated=False)
@@ -721,7 +721,7 @@ def test_arithmetic(operation : str, instantiations : 'dict[str,str|None]', expe
     else:
         fn("X", "Y", "Z", instantiations, False)
         if expected_instantiation is not None:
-            assert instantiations["Z"] == str(expected_instantiation)
+            assert get_number(instantiations["Z"]) == expected_instantiation
         else:
             assert instantiations["Z"] is None
 
@@ -733,4 +733,56 @@ def test_arithmetic(operation : str, instantiations : 'dict[str,str|None]', expe
 def test_substring(instantiations: 'dict[str,str|None]', expected_instantiation: 'str'):
     substring("Text", "Start", "End", "Result", instantiations, False)
     assert instantiations["Result"] == expected_instantiation
-        
\ No newline at end of file
+        
+# Tests for the compiled literals
+def test_compile_literal_decoded_constants():
+    step = compile_literal("split_select", [Var("L"), Const("space"), Const("1"), Var("L1")], False, {"L"}, set())
+    frame = {"L": "a b c"}
+    assert step(frame)
+    assert frame["L1"] == "b"
+    assert compile_literal("contains_i", [Var("L"), Const("'B C'")], False, {"L"}, set())(frame)
+
+def test_compile_literal_constant_error_deferred():
+    step = compile_literal("lt", [Var("N"), Const("abc")], False, {"N"}, set())
+    with pytest.raises(NotANumberError):
+        step({"N": "5"})
+
+def test_compile_literal_typed_values():
+    frame = {"T": "0m1.5s"}
+    assert compile_literal("time_to_seconds", [Var("T"), Var("TS")], False, {"T"}, set())(frame)
+    assert compile_literal("mul", [Var("TS"), Const("1000"), Var("MS")], False, {"TS"}, {"TS"})(frame)
+    assert frame["MS"] == 1500.0
+    assert compile_literal("gt", [Var("MS"), Const("500")], False, {"MS"}, {"MS"})(frame)
+    assert compile_literal("startswith", [Var("MS"), Const("15")], False, {"MS"}, {"MS"})(frame)
+
+@pytest.mark.parametrize("fn, instantiations, is_negated, expected_result", [
+    (match, {"L": "took 15 ms", "P": "took \\d+"}, False, True),
+    (match, {"L": "it took 15 ms", "P": "took \\d+"}, False, False),
+    (search, {"L": "it took 15 ms", "P": "took \\d+"}, False, True),
+    (search, {"L": "it took 15 ms", "P": "took \\d+"}, True, False),
+])
+def test_match_search(fn : 'Callable[..., bool]', instantiations : 'dict[str,str|None]', is_negated : bool, expected_result : bool):
+    assert fn("L", "P", instantiations, is_negated) == expected_result
+
+def test_regex_groups():
+    instantiations : 'dict[str,str|None]' = {"L": "took 15 ms on host-3", "N": None, "U": None}
+    assert regex("L", "'took (\\d+) (\\w+)'", ["N", "U"], instantiations, False)
+    assert instantiations["N"] == "15" and instantiations["U"] == "ms"
+    # constants and bound variables are compared with the groups
+    assert regex("L", "'(\\d+) (\\w+)'", ["N", "ms"], instantiations, False)
+    assert not regex("L", "'(\\d+) (\\w+)'", ["N", "s"], instantiations, False)
+    # a group that does not participate in the match is empty
+    instantiations["G"] = None
+    assert regex("L", "'(x)?took'", ["G"], instantiations, False)
+    assert instantiations["G"] == ""
+
+def test_regex_errors():
+    instantiations : 'dict[str,str|None]' = {"L": "took 15 ms", "P": None, "N": None, "U": None}
+    with pytest.raises(InstantiationError):
+        regex("L", "P", ["N"], instantiations, False)
+    with pytest.raises(InvalidPatternError):
+        regex("L", "'(\\d+'", ["N"], instantiations, False)
+    with pytest.raises(InvalidPatternError):
+        regex("L", "'(\\d+)'", ["N", "U"], instantiations, False)
+    with pytest.raises(UnsafeError):
+        regex("L", "'(\\d+)'", ["N"], instantiations, True)
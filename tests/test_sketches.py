@@ -0,0 +1,80 @@
+import random
+
+import pytest
+
+from src.take.sketches import *
+
+@pytest.mark.parametrize("n, k", [(10, 200), (100_000, 200), (100_000, 50)])
+def test_kll_rank_error(n : int, k : int):
+    rng = random.Random(n)
+    values = [rng.lognormvariate(0, 1) for _ in range(n)]
+    sketch = KLLSketch(k)
+    for v in values:
+        sketch.add(v)
+    assert sketch.count == n
+    # memory does not depend on the number of values
+    assert sketch.size < 4 * k
+    values.sort()
+    qs = [0, 0.1, 0.5, 0.9, 0.99, 1]
+    for q, estimate in zip(qs, sketch.quantiles(qs)):
+        rank = values.index(estimate) / n
+        assert abs(rank - q) <= max(3 / k, 1 / n)
+    assert sketch.quantiles([0, 1]) == [values[0], values[-1]]
+
+def test_kll_merge():
+    rng = random.Random(0)
+    values = [rng.random() for _ in range(50_000)]
+    sketches = [KLLSketch(100) for _ in range(5)]
+    for i, v in enumerate(values):
+        sketches[i % 5].add(v)
+    for other in sketches[1:]:
+        sketches[0].merge(other)
+    assert sketches[0].count == len(values)
+    values.sort()
+    median = sketches[0].quantiles([0.5])[0]
+    assert abs(values.index(median) / len(values) - 0.5) <= 3 / 100
+
+def test_quantile_sketch_exact():
+    sketch = QuantileSketch(k=50, exact_size=10)
+    other = QuantileSketch(k=50, exact_size=10)
+    for v in [5, 1, 3]:
+        sketch.add(v)
+    for v in [2, 4]:
+        other.add(v)
+    sketch.merge(other)
+    assert sketch.is_exact()
+    assert sketch.quantiles([0, 0.5, 0.25, 1]) == [1, 3, 2, 5]
+    assert exact_quantiles([1, 2], [0.5]) == [1.5]
+    for v in range(20):
+        sketch.add(v)
+    assert not sketch.is_exact()
+    with pytest.raises(ValueError):
+        exact_quantiles([], [0.5])
+
+@pytest.mark.parametrize("n, precision", [(1000, 14), (200_000, 12)])
+def test_hyperloglog(n : int, precision : int):
+    sketches = [HyperLogLog(precision) for _ in range(2)]
+    for i in range(n):
+        # the two halves overlap
+        sketches[i % 2].add(f"id-{i // 4}")
+    sketches[0].merge(sketches[1])
+    expected = (n + 3) // 4
+    assert abs(sketches[0].estimate() - expected) <= 4 * 1.04 / (1 << precision) ** 0.5 * expected
+    with pytest.raises(ValueError):
+        HyperLogLog(3)
+
+def test_distinct_sketch():
+    sketch = DistinctSketch(precision=10, exact_size=5)
+    other = DistinctSketch(precision=10, exact_size=5)
+    for v in ["a", "b", "a"]:
+        sketch.add(v)
+    other.add("c")
+    sketch.merge(other)
+    assert sketch.is_exact() and sketch.count() == 3
+    for i in range(100):
+        other.add(str(i))
+    assert not other.is_exact()
+    sketch.merge(other)
+    assert not sketch.is_exact()
+    assert abs(sketch.count() - 103) <= 10
+    assert hash64("take") == hash64("take")
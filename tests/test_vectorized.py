@@ -0,0 +1,43 @@
+from array import array
+import math
+import random
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from src.take.vectorized import *
+
+def test_block_kernels():
+    rng = random.Random(0)
+    values = [rng.uniform(-100, 100) for _ in range(1000)]
+    block = as_array(array('d', values))
+    mean, m2 = block_moments(block)
+    assert mean == pytest.approx(sum(values) / len(values))
+    assert m2 == pytest.approx(sum((v - mean) ** 2 for v in values))
+    assert block_extreme(block, largest=False) == (min(values), [values.index(min(values))])
+    assert block_extreme(as_array(array('d', [1, 3, 2, 3])), largest=True) == (3, [1, 3])
+    # the numbers after the first 0 are not multiplied
+    assert block_product(as_array(array('d', [2, 3, 0, math.inf]))) == 0
+    assert block_product(as_array(array('d', [2, 3, 4]))) == 24
+    assert has_nan(as_array(array('d', [1, math.nan])))
+
+
+@pytest.mark.parametrize("n", [1, 2, 5, 100])
+def test_middle(n : int):
+    values = [float(v) for v in random.Random(n).sample(range(1000), n)]
+    ordered = sorted(values)
+    assert middle(values) == sorted({ordered[(n - 1) // 2], ordered[n // 2]})
+
+
+@pytest.mark.parametrize("values", [
+    [3, 1, 2],
+    [3.5, -1.0, 0.0, -0.0],
+    [3, 1.5, 2, 1.0, 1],
+    [1 << 60, 1.0, (1 << 60) + 1],
+    [1 << 70, 1, 2],
+    [math.nan, 1.0, 0.5]
+])
+def test_sort_numbers(values : 'list[int|float]'):
+    res = sort_numbers(values)
+    assert [repr(v) for v in res] == [repr(v) for v in sorted(values)]